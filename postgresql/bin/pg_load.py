@@ -0,0 +1,363 @@
+##
+# .bin.pg_load - Load a file into a table over multiple connections.
+##
+"""
+Load text or CSV COPY data from a file into a table using concurrent
+``COPY ... FROM STDIN`` statements.
+"""
+import os
+import sys
+import time
+import optparse
+import threading
+from queue import Queue, Full, Empty
+
+from .. import clientparameters
+from .. import project
+from .. import copyman
+from ..copyformat import record_chunks
+from ..string import quote_literal
+from ..driver import default as pg_driver
+
+__all__ = ['command']
+
+default_options = [
+	optparse.make_option('-t', '--table',
+		dest = 'table',
+		help = 'table to load, optionally followed by a column list: "t(a,b)"',
+		default = None,
+	),
+	optparse.make_option('-j', '--jobs',
+		dest = 'jobs',
+		type = 'int',
+		help = 'number of connections loading the file',
+		default = 4,
+	),
+	optparse.make_option('--format',
+		dest = 'format',
+		choices = ('text', 'csv'),
+		help = 'format of the file: text or csv; csv if the file name ends with .csv',
+		default = None,
+	),
+	optparse.make_option('--delimiter',
+		dest = 'delimiter',
+		help = 'field delimiter',
+		default = None,
+	),
+	optparse.make_option('--quote',
+		dest = 'quote',
+		help = 'CSV quote character',
+		default = '"',
+	),
+	optparse.make_option('--null',
+		dest = 'null',
+		help = 'string representing NULL',
+		default = None,
+	),
+	optparse.make_option('--header',
+		dest = 'header',
+		action = 'store_true',
+		help = 'the first record of the CSV file is a header',
+		default = False,
+	),
+	optparse.make_option('--encoding',
+		dest = 'encoding',
+		help = 'encoding of the file',
+		default = None,
+	),
+	optparse.make_option('--chunk-size',
+		dest = 'chunk_size',
+		type = 'int',
+		help = 'size of the chunks given to the connections in megabytes',
+		default = 64,
+	),
+	optparse.make_option('--commit-every',
+		dest = 'commit_every',
+		type = 'int',
+		help = 'number of chunks loaded by a connection per transaction',
+		default = 1,
+	),
+	optparse.make_option('--journal',
+		dest = 'journal',
+		help = 'file recording the committed chunks; chunks recorded are skipped',
+		default = None,
+	),
+	optparse.make_option('-q', '--quiet',
+		dest = 'quiet',
+		action = 'store_true',
+		help = 'do not report progress',
+		default = False,
+	),
+]
+
+def copy_statement(co, header = False):
+	"""
+	Construct the ``COPY ... FROM STDIN`` statement for the options.
+	"""
+	opts = ['FORMAT ' + co.format]
+	if co.delimiter is not None:
+		opts.append('DELIMITER ' + quote_literal(co.delimiter))
+	if co.null is not None:
+		opts.append('NULL ' + quote_literal(co.null))
+	if co.format == 'csv':
+		opts.append('QUOTE ' + quote_literal(co.quote))
+		if header:
+			opts.append('HEADER true')
+	if co.encoding is not None:
+		opts.append('ENCODING ' + quote_literal(co.encoding))
+	return 'COPY ' + co.table + ' FROM STDIN WITH (' + ', '.join(opts) + ')'
+
+class Journal(object):
+	"""
+	Record of the chunks committed by a load; used to restart failed loads.
+	"""
+	def __init__(self, path, chunk_size):
+		self.path = path
+		self.committed = set()
+		if os.path.exists(path):
+			with open(path) as f:
+				first = f.readline().split()
+				if first != ['chunk-size', str(chunk_size)]:
+					raise ValueError(
+						"journal %r was not created with a chunk size of %d bytes" %(
+							path, chunk_size
+						)
+					)
+				self.committed.update(int(x) for x in f if x.strip())
+			self.file = open(path, 'a')
+		else:
+			self.file = open(path, 'w')
+			self.file.write('chunk-size %d\n' %(chunk_size,))
+			self.file.flush()
+
+	def record(self, offsets):
+		self.file.write(''.join('%d\n' %(x,) for x in offsets))
+		self.file.flush()
+		os.fsync(self.file.fileno())
+
+	def close(self):
+		self.file.close()
+
+class Progress(object):
+	"""
+	Thread-safe accounting of the committed chunks.
+	"""
+	def __init__(self, journal = None, output = None, clock = time.time):
+		self.journal = journal
+		self.output = output
+		self.clock = clock
+		self.started = clock()
+		self.lock = threading.Lock()
+		self.chunks = 0
+		self.rows = 0
+		self.bytes = 0
+		self.skipped = 0
+		self.failures = []
+
+	def committed(self, chunks):
+		"""
+		Record the given ``(offset, bytes, rows)`` triples as committed.
+		"""
+		with self.lock:
+			if self.journal is not None:
+				self.journal.record([x[0] for x in chunks])
+			for offset, size, rows in chunks:
+				self.chunks += 1
+				self.bytes += size
+				self.rows += rows
+			self.report()
+
+	def failed(self, offsets, err):
+		with self.lock:
+			self.failures.append((offsets, err))
+			if self.output is not None:
+				self.output.write(
+					"%sERROR: chunks at %s failed: %s%s" %(
+						os.linesep, ', '.join(map(str, offsets)), err, os.linesep
+					)
+				)
+
+	def status(self):
+		elapsed = max(self.clock() - self.started, 1e-9)
+		return "%d chunks, %d rows, %.1f MB in %.1fs: %.0f rows/s, %.1f MB/s" %(
+			self.chunks, self.rows, self.bytes / (1024**2), elapsed,
+			self.rows / elapsed, self.bytes / (1024**2) / elapsed,
+		)
+
+	def report(self):
+		if self.output is not None:
+			self.output.write('\r' + self.status())
+			self.output.flush()
+
+def load_worker(connector, statements, work, progress, commit_every):
+	"""
+	Load the chunks taken from `work` until `None` is received.
+
+	A worker whose connection cannot be established, or is lost, reports the
+	chunks it holds as failed and exits; the remaining chunks are left for the
+	other workers.
+	"""
+	db = connector()
+	try:
+		try:
+			db.connect()
+			copy = db.prepare(statements[0])
+		except Exception as err:
+			progress.failed([], err)
+			return
+		copy_header = None
+		finished = False
+		while not finished:
+			batch = []
+			offset = None
+			try:
+				with db.xact():
+					while len(batch) < commit_every:
+						x = work.get()
+						if x is None:
+							finished = True
+							break
+						offset, pieces = x
+						if offset == 0 and statements[1] is not None:
+							if copy_header is None:
+								copy_header = db.prepare(statements[1])
+							ps = copy_header
+						else:
+							ps = copy
+						r = copyman.StatementReceiver(ps)
+						copyman.CopyManager(copyman.IteratorProducer([pieces]), r).run()
+						batch.append((offset, sum(map(len, pieces)), r.count() or 0))
+						offset = None
+			except Exception as err:
+				failed = [b[0] for b in batch]
+				if offset is not None:
+					failed.append(offset)
+				progress.failed(failed, err)
+				if db.closed:
+					return
+			else:
+				if batch:
+					progress.committed(batch)
+	finally:
+		db.close()
+
+def put(work, workers, x, timeout = 0.5):
+	"""
+	Queue `x` for the workers; `False` if none of them are alive to take it.
+	"""
+	while any(t.is_alive() for t in workers):
+		try:
+			work.put(x, timeout = timeout)
+			return True
+		except Full:
+			pass
+	return False
+
+def load(connectors, statements, chunks, progress, commit_every = 1, skip = ()):
+	"""
+	Load the ``(offset, pieces)`` pairs of `chunks` using a worker for each of
+	the `connectors`. Chunks whose offsets are in `skip` are not loaded.
+
+	When no worker is left, the chunk that could not be given out is reported
+	as failed and no more are read.
+	"""
+	work = Queue(len(connectors) * 2)
+	workers = [
+		threading.Thread(
+			target = load_worker,
+			args = (connector, statements, work, progress, commit_every),
+		)
+		for connector in connectors
+	]
+	for x in workers:
+		x.start()
+	try:
+		for offset, pieces in chunks:
+			if offset in skip:
+				progress.skipped += 1
+				continue
+			if not put(work, workers, (offset, pieces)):
+				progress.failed([offset], RuntimeError(
+					"no connections are left to load the chunks at and after this offset"
+				))
+				break
+	finally:
+		for x in workers:
+			if not put(work, workers, None):
+				break
+		for x in workers:
+			x.join()
+		# Chunks queued after the last worker exited.
+		try:
+			while True:
+				x = work.get_nowait()
+				if x is not None:
+					progress.failed([x[0]], RuntimeError("chunk was not loaded"))
+		except Empty:
+			pass
+
+def command(argv = sys.argv):
+	p = clientparameters.DefaultParser(
+		"%prog [connection options] -t table [options] file",
+		version = project.version,
+		option_list = default_options
+	)
+	co, ca = p.parse_args(argv[1:])
+	if len(ca) != 1 or not co.table:
+		p.error("a table and a single file must be given")
+	path = ca[0]
+	if co.format is None:
+		co.format = 'csv' if path.lower().endswith('.csv') else 'text'
+	if co.header and co.format != 'csv':
+		p.error("--header can only be used with the csv format")
+	if co.jobs < 1 or co.chunk_size < 1 or co.commit_every < 1:
+		p.error("--jobs, --chunk-size, and --commit-every must be positive")
+	chunk_size = co.chunk_size * 1024 * 1024
+
+	cond = clientparameters.collect(parsed_options = co, prompt_title = None)
+	try:
+		clientparameters.resolve_password(cond, prompt_title = 'pg_load')
+	except EOFError:
+		raise SystemExit(1)
+	connector = pg_driver.fit(**cond)
+
+	statements = (
+		copy_statement(co),
+		copy_statement(co, header = True) if co.header else None,
+	)
+	journal = None
+	if co.journal is not None:
+		journal = Journal(co.journal, chunk_size)
+	progress = Progress(journal, None if co.quiet else sys.stderr)
+
+	quote = co.quote.encode('ascii') if co.format == 'csv' else None
+	try:
+		with open(path, 'rb') as f:
+			load(
+				[connector] * co.jobs, statements,
+				record_chunks(f, chunk_size, quote = quote),
+				progress, commit_every = co.commit_every,
+				skip = journal.committed if journal is not None else (),
+			)
+	finally:
+		if journal is not None:
+			journal.close()
+
+	if not co.quiet:
+		sys.stderr.write('\r' + progress.status() + os.linesep)
+		if progress.skipped:
+			sys.stderr.write(
+				"%d chunks were skipped as committed by the journal%s" %(
+					progress.skipped, os.linesep
+				)
+			)
+	if progress.failures:
+		if co.journal is not None:
+			sys.stderr.write(
+				"HINT: Run the command again with the same journal to load the failed chunks." + os.linesep
+			)
+		return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(command(sys.argv))
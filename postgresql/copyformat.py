@@ -0,0 +1,675 @@
+##
+# .copyformat - COPY data formats
+##
+r"""
+Encoding and decoding of COPY data.
+
+`BinaryDecoder` turns the data produced by ``COPY ... TO STDOUT WITH BINARY``
+into rows using the unpackers of a connection's `TypeIO`::
+
+	>>> from postgresql import copyformat
+	>>> from postgresql.types import INT4OID, TEXTOID
+	>>> copy = db.prepare("COPY (SELECT i, i::text FROM generate_series(1, 3) g(i)) TO STDOUT WITH BINARY")
+	>>> list(copyformat.binary_rows(copy.chunks(), db.typio, (INT4OID, TEXTOID)))
+	[(1, '1'), (2, '2'), (3, '3')]
+
+The decoder is incremental; the COPY data may be split at any point, so it can
+be fed the lines of ``chunks()`` or the data given to a `copyman.CallReceiver`.
+
+`text_fields` and `text_line` split and construct the lines of the text format::
+
+	>>> copyformat.text_fields(b'1\\tone\t\\N\n')
+	[b'1\tone', None]
+	>>> copyformat.text_line([b'1\tone', None])
+	b'1\\tone\t\\N\n'
+
+`TextEncoder` and `TextDecoder` convert between rows and the lines of the text
+and CSV formats::
+
+	>>> copy_from = db.prepare("COPY emp FROM STDIN WITH (FORMAT csv)")
+	>>> copy_from.load_chunks(copyformat.TextEncoder(db.typio, 'csv').chunks(rows))
+	>>> copy_to = db.prepare("COPY emp TO STDOUT WITH (FORMAT csv)")
+	>>> list(copyformat.text_rows(copy_to.chunks(), db.typio, (INT4OID, TEXTOID), 'csv'))
+
+`record_chunks` divides text or CSV COPY data read from a file into chunks of
+complete records that can be loaded independently.
+"""
+import re
+import uuid
+import decimal
+import datetime
+from binascii import hexlify
+from .python.functools import process_tuple
+from .python.structlib import ulong_unpack, short_unpack, long_unpack
+from .protocol import element3 as element
+from . import types as pg_types
+
+__all__ = [
+	'BinaryDecoder',
+	'binary_rows',
+	'record_chunks',
+	'text_fields',
+	'text_line',
+	'csv_fields',
+	'csv_line',
+	'TextEncoder',
+	'TextDecoder',
+	'text_rows',
+]
+
+#: The signature at the beginning of COPY BINARY data.
+binary_signature = b'PGCOPY\n\xff\r\n\x00'
+
+class BinaryDecoder(object):
+	"""
+	Incremental decoder for COPY BINARY data.
+
+	Instances are called with sequences of COPY data(`bytes` or buffers), and
+	return the list of rows completed by the data. The data does not need to be
+	aligned to tuple boundaries.
+	"""
+	@classmethod
+	def from_oids(typ, typio, oids, row_constructor = tuple):
+		"""
+		Create a decoder for columns of the given type Oids using the unpackers
+		resolved by `typio`.
+		"""
+		oids = tuple(oids)
+		d = typ(tuple(map(typio.resolve_unpack, oids)), row_constructor = row_constructor)
+		d.typio = typio
+		d.oids = oids
+		return d
+
+	typio = None
+	oids = None
+
+	def __init__(self, unpackers, row_constructor = tuple):
+		self.unpackers = unpackers
+		self.row_constructor = row_constructor
+		self.buffer = bytearray()
+		# Header is not read until the signature is available.
+		self.header = None
+		self.finished = False
+
+	def _raise_unpack_error(self, cause, procs, tup, itemnum):
+		data = repr(tup[itemnum])
+		if len(data) > 80:
+			# Be sure not to fill screen with noise.
+			data = data[:75] + ' ...'
+		if self.typio is None:
+			raise ValueError(
+				"failed to unpack column {0} from COPY data: {1}".format(itemnum, data)
+			) from cause
+		typ = self.typio.sql_type_from_oid(self.oids[itemnum]) or '<unknown>'
+		self.typio.raise_client_error(element.ClientError((
+			(b'S', 'ERROR'),
+			(b'C', '--CIO'),
+			(b'M', "failed to unpack column %r, %s, from COPY data" %(itemnum, typ)),
+			(b'D', data),
+			(b'P', str(itemnum)),
+		)), cause = cause, creator = self)
+
+	def _read_header(self, view):
+		# signature, flags, header extension length, header extension
+		if len(view) < 19:
+			return 0
+		if view[:11] != binary_signature:
+			raise ValueError("invalid COPY BINARY signature")
+		flags = ulong_unpack(view[11:15])
+		if flags & 0x10000:
+			raise ValueError("COPY BINARY data with OIDs is not supported")
+		extlen = ulong_unpack(view[15:19])
+		if len(view) < 19 + extlen:
+			return 0
+		self.header = (flags, view[19:19+extlen].tobytes())
+		return 19 + extlen
+
+	def _read_tuples(self, view, rows,
+		ulong_unpack = ulong_unpack,
+		short_unpack = short_unpack,
+		long_unpack = long_unpack,
+		process_tuple = process_tuple,
+	):
+		# Read complete tuples from the view; return the consumed size.
+		unpackers = self.unpackers
+		ncolumns = len(unpackers)
+		rc = self.row_constructor
+		fail = self._raise_unpack_error
+		append = rows.append
+		end = len(view)
+		position = 0
+		while position + 2 <= end:
+			count = short_unpack(view[position:position+2])
+			if count == -1:
+				self.finished = True
+				return position + 2
+			if count != ncolumns:
+				raise ValueError(
+					"COPY BINARY tuple has %d fields, expecting %d" %(count, ncolumns)
+				)
+			p = position + 2
+			raw = []
+			for x in range(count):
+				if p + 4 > end:
+					return position
+				l = long_unpack(view[p:p+4])
+				p += 4
+				if l == -1:
+					raw.append(None)
+				else:
+					if p + l > end:
+						return position
+					raw.append(view[p:p+l].tobytes())
+					p += l
+			append(rc(process_tuple(unpackers, tuple(raw), fail)))
+			position = p
+		return position
+
+	def __call__(self, data):
+		"""
+		Decode the given sequence of COPY data, returning the completed rows.
+		"""
+		if self.finished:
+			if any(map(len, data)):
+				raise ValueError("data after COPY BINARY trailer")
+			return []
+		buf = self.buffer
+		for x in data:
+			buf += x
+		rows = []
+		view = memoryview(buf)
+		try:
+			consumed = 0
+			if self.header is None:
+				consumed = self._read_header(view)
+				if self.header is None:
+					return rows
+			consumed += self._read_tuples(view[consumed:], rows)
+		finally:
+			view.release()
+		del buf[:consumed]
+		if self.finished and buf:
+			raise ValueError("data after COPY BINARY trailer")
+		return rows
+
+	def decode(self, data):
+		"""
+		Decode a single COPY data buffer.
+		"""
+		return self((data,))
+
+	def close(self):
+		"""
+		Verify that the complete COPY data was given to the decoder.
+		"""
+		if not self.finished:
+			raise ValueError("COPY BINARY data ended before the trailer")
+
+def binary_rows(chunks, typio, oids, row_constructor = tuple):
+	"""
+	Produce the rows of COPY BINARY data given as an iterable of sequences of
+	COPY lines--``Statement.chunks()`` of a ``COPY ... TO STDOUT WITH BINARY``.
+	"""
+	d = BinaryDecoder.from_oids(typio, oids, row_constructor = row_constructor)
+	for x in chunks:
+		rows = d(x)
+		if rows:
+			yield from rows
+	d.close()
+
+def _record_end(data, start, quote, parity):
+	"""
+	The index of the first newline at or after `start` that is not inside a
+	quoted field, or -1. `parity` is the number of quotes before `data`.
+	"""
+	find = data.find
+	count = data.count
+	position = 0
+	while True:
+		nl = find(b'\n', start)
+		if nl == -1 or quote is None:
+			return nl
+		parity += count(quote, position, nl)
+		if not parity & 1:
+			return nl
+		position = nl
+		start = nl + 1
+
+def record_chunks(file, size, quote = None, buffer_size = 1024 * 1024):
+	"""
+	Divide the COPY data read from `file` into chunks of complete records.
+
+	Produces ``(offset, pieces)`` pairs where `offset` is the position of the
+	chunk in the file and `pieces` is a list of `bytes` objects holding the
+	chunk's data. Each chunk ends with the first record boundary at or after
+	`size` bytes, so the chunks produced for a file are always the same for a
+	given `size`.
+
+	For CSV data, `quote` is the quote character as `bytes`; newlines inside
+	quoted fields do not end records. Quotes must be escaped by doubling them,
+	the default for CSV.
+	"""
+	read = file.read
+	offset = 0
+	pieces = []
+	length = 0
+	parity = 0
+	while True:
+		data = read(buffer_size)
+		if not data:
+			break
+		while data:
+			start = size - length - 1
+			nl = -1
+			if start < len(data):
+				nl = _record_end(data, max(start, 0), quote, parity)
+			if nl == -1:
+				pieces.append(data)
+				length += len(data)
+				if quote is not None:
+					parity += data.count(quote)
+				break
+			nl += 1
+			pieces.append(data[:nl])
+			yield offset, pieces
+			offset += length + nl
+			pieces = []
+			length = 0
+			parity = 0
+			data = data[nl:]
+	if pieces:
+		yield offset, pieces
+
+_text_escape_pattern = re.compile(br'\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))', re.S)
+_text_escapes = {
+	b'b' : b'\b',
+	b'f' : b'\f',
+	b'n' : b'\n',
+	b'r' : b'\r',
+	b't' : b'\t',
+	b'v' : b'\v',
+}
+
+def _text_unescape(match, bytes = bytes, int = int):
+	octal, hex, c = match.groups()
+	if octal is not None:
+		return bytes((int(octal, 8) & 0xFF,))
+	if hex is not None:
+		return bytes((int(hex, 16),))
+	return _text_escapes.get(c, c)
+
+# delimiter -> pattern matching escapes and the delimiter
+_text_splitters = {}
+
+def text_fields(line, delimiter = b'\t', null = b'\\N',
+	unescape = _text_escape_pattern.sub,
+):
+	"""
+	Split a line of text format COPY data into a list of its fields.
+
+	Escape sequences are replaced, and fields equal to `null` are `None`. A
+	trailing line ending is ignored.
+	"""
+	if len(delimiter) != 1:
+		raise ValueError("delimiter must be a single byte")
+	line = bytes(line)
+	if line.endswith(b'\n'):
+		line = line[:-2] if line.endswith(b'\r\n') else line[:-1]
+
+	if b'\\' not in line:
+		return [None if x == null else x for x in line.split(delimiter)]
+
+	splitter = _text_splitters.get(delimiter)
+	if splitter is None:
+		splitter = _text_splitters[delimiter] = re.compile(
+			br'\\.|' + re.escape(delimiter), re.S
+		)
+	fields = []
+	start = 0
+	for m in splitter.finditer(line):
+		if m.group() == delimiter:
+			fields.append(line[start:m.start()])
+			start = m.end()
+	fields.append(line[start:])
+	return [
+		None if x == null else (
+			unescape(_text_unescape, x) if b'\\' in x else x
+		)
+		for x in fields
+	]
+
+def _text_escape(field, delimiter):
+	field = field.replace(b'\\', b'\\\\').replace(b'\n', b'\\n').replace(b'\r', b'\\r')
+	if delimiter == b'\t':
+		return field.replace(b'\t', b'\\t')
+	return field.replace(delimiter, b'\\' + delimiter)
+
+def text_line(fields, delimiter = b'\t', null = b'\\N'):
+	"""
+	Construct a line of text format COPY data from a sequence of `bytes` and
+	`None` fields.
+	"""
+	return delimiter.join([
+		null if x is None else _text_escape(x, delimiter)
+		for x in fields
+	]) + b'\n'
+
+def csv_fields(line, delimiter = b',', quote = b'"', null = b''):
+	"""
+	Split a line of CSV format COPY data into a list of its fields.
+
+	Quotes inside quoted sections must be escaped by doubling them. Fields
+	that are equal to `null` and were not quoted are `None`. A trailing line
+	ending is ignored.
+	"""
+	if len(delimiter) != 1:
+		raise ValueError("delimiter must be a single byte")
+	if len(quote) != 1:
+		raise ValueError("quote must be a single byte")
+	line = bytes(line)
+	if line.endswith(b'\n'):
+		line = line[:-2] if line.endswith(b'\r\n') else line[:-1]
+
+	if quote not in line:
+		return [None if x == null else x for x in line.split(delimiter)]
+
+	fields = []
+	find = line.find
+	end = len(line)
+	position = 0
+	while True:
+		parts = []
+		quoted = False
+		start = position
+		while True:
+			d = find(delimiter, position)
+			if d == -1:
+				d = end
+			q = find(quote, position, d)
+			if q == -1:
+				parts.append(line[position:d])
+				position = d
+				break
+			# A quoted section; delimiters inside of it are data.
+			parts.append(line[position:q])
+			quoted = True
+			position = q + 1
+			while True:
+				q = find(quote, position)
+				if q == -1:
+					raise ValueError("unterminated quoted CSV field")
+				parts.append(line[position:q])
+				if line.startswith(quote, q + 1):
+					parts.append(quote)
+					position = q + 2
+				else:
+					position = q + 1
+					break
+		if quoted:
+			fields.append(b''.join(parts))
+		else:
+			raw = line[start:position]
+			fields.append(None if raw == null else raw)
+		if position == end:
+			return fields
+		position += 1
+
+def csv_line(fields, delimiter = b',', quote = b'"', null = b''):
+	"""
+	Construct a line of CSV format COPY data from a sequence of `bytes` and
+	`None` fields.
+	"""
+	special = (delimiter, quote, b'\n', b'\r')
+	double = quote + quote
+	fields = [
+		null if x is None else (
+			quote + x.replace(quote, double) + quote
+			if x == null or x == b'\\.' or any(c in x for c in special)
+			else x
+		)
+		for x in fields
+	]
+	return delimiter.join(fields) + b'\n'
+
+try:
+	from .port.optimized import text_fields, csv_fields
+except ImportError:
+	pass
+
+##
+# Conversions of the values of columns to and from their text representation.
+# Types without a parser are decoded as strings.
+def _parse_bool(x):
+	return x == b't'
+
+def _parse_bytea(x, fromhex = bytes.fromhex, unescape = _text_escape_pattern.sub):
+	if x.startswith(b'\\x'):
+		return fromhex(x[2:].decode('ascii'))
+	# The escape format of bytea_output.
+	return unescape(_text_unescape, x)
+
+def _parse_numeric(x, Decimal = decimal.Decimal):
+	return Decimal(x.decode('ascii'))
+
+def _parse_uuid(x, UUID = uuid.UUID):
+	return UUID(x.decode('ascii'))
+
+text_parsers = {
+	pg_types.BOOLOID : _parse_bool,
+	pg_types.INT2OID : int,
+	pg_types.INT4OID : int,
+	pg_types.INT8OID : int,
+	pg_types.OIDOID : int,
+	pg_types.XIDOID : int,
+	pg_types.CIDOID : int,
+	pg_types.FLOAT4OID : float,
+	pg_types.FLOAT8OID : float,
+	pg_types.NUMERICOID : _parse_numeric,
+	pg_types.BYTEAOID : _parse_bytea,
+	pg_types.UUIDOID : _parse_uuid,
+}
+
+def _format_float(x, repr = repr):
+	if x != x:
+		return 'NaN'
+	if x in (float('inf'), float('-inf')):
+		return 'Infinity' if x > 0 else '-Infinity'
+	return repr(x)
+
+def _format_interval(x):
+	return '%d days %d seconds %d microseconds' %(x.days, x.seconds, x.microseconds)
+
+# Python type -> callable returning the str of the value's text representation.
+text_formatters = {
+	bool : lambda x: 't' if x else 'f',
+	int : str,
+	float : _format_float,
+	decimal.Decimal : str,
+	uuid.UUID : str,
+	datetime.date : datetime.date.isoformat,
+	datetime.datetime : datetime.datetime.isoformat,
+	datetime.time : datetime.time.isoformat,
+	datetime.timedelta : _format_interval,
+}
+
+class TextEncoder(object):
+	"""
+	Encoder of rows into lines of text or CSV format COPY data.
+
+	`str` values are encoded using `typio`, or as UTF-8 if no `typio` is
+	given. `bytes` values are written as ``bytea`` data in the hex format, and
+	the values of the types in `formatters` are converted to strings by the
+	corresponding callable. Other values are converted using `str`.
+	"""
+	def __init__(self,
+		typio = None,
+		format = 'text',
+		delimiter = None,
+		null = None,
+		quote = b'"',
+		formatters = None,
+	):
+		if format not in ('text', 'csv'):
+			raise ValueError("unknown COPY format: " + repr(format))
+		self.typio = typio
+		self.format = format
+		self.quote = quote
+		if format == 'csv':
+			self.delimiter = b',' if delimiter is None else delimiter
+			self.null = b'' if null is None else null
+		else:
+			self.delimiter = b'\t' if delimiter is None else delimiter
+			self.null = b'\\N' if null is None else null
+		self.formatters = dict(text_formatters)
+		if formatters:
+			self.formatters.update(formatters)
+		self.encode = (
+			typio.encode if typio is not None
+			else lambda x: x.encode('utf-8')
+		)
+
+	def field(self, value, str = str, bytes = bytes):
+		"""
+		The `bytes` representing the value, or `None` for `None`.
+		"""
+		if value is None:
+			return None
+		typ = value.__class__
+		if typ is str:
+			return self.encode(value)
+		if typ is bytes or typ is bytearray or typ is memoryview:
+			return b'\\x' + hexlify(value)
+		f = self.formatters.get(typ)
+		if f is None:
+			return self.encode(str(value))
+		return f(value).encode('ascii')
+
+	def line(self, row):
+		"""
+		Encode the row into a line of COPY data.
+		"""
+		fields = list(map(self.field, row))
+		if self.format == 'csv':
+			return csv_line(fields, self.delimiter, self.quote, self.null)
+		return text_line(fields, self.delimiter, self.null)
+
+	def __call__(self, rows):
+		"""
+		Encode the rows into a list of lines.
+		"""
+		return list(map(self.line, rows))
+
+	def chunks(self, rows, size = 256):
+		"""
+		Produce lists of at most `size` lines encoding the rows; for use with
+		``Statement.load_chunks``.
+		"""
+		line = self.line
+		chunk = []
+		for x in rows:
+			chunk.append(line(x))
+			if len(chunk) >= size:
+				yield chunk
+				chunk = []
+		if chunk:
+			yield chunk
+
+class TextDecoder(object):
+	"""
+	Decoder of the lines of text or CSV format COPY data into rows.
+
+	Instances are called with sequences of lines, the chunks produced by
+	``Statement.chunks()`` of a ``COPY ... TO STDOUT`` or given to a
+	`copyman.CallReceiver`, and return the list of rows. Each line must be a
+	complete row, as the lines produced by the server are.
+	"""
+	@classmethod
+	def from_oids(typ, typio, oids, format = 'text', parsers = None, **kw):
+		"""
+		Create a decoder for columns of the given type Oids. Columns whose
+		type has no parser in `text_parsers`, or `parsers`, are decoded into
+		strings using `typio`.
+		"""
+		oids = tuple(oids)
+		known = dict(text_parsers)
+		if parsers:
+			known.update(parsers)
+		decode = typio.decode
+		d = typ(tuple([known.get(x, decode) for x in oids]), format = format, **kw)
+		d.typio = typio
+		d.oids = oids
+		return d
+
+	typio = None
+	oids = None
+
+	def __init__(self,
+		parsers,
+		format = 'text',
+		delimiter = None,
+		null = None,
+		quote = b'"',
+		row_constructor = tuple,
+	):
+		if format not in ('text', 'csv'):
+			raise ValueError("unknown COPY format: " + repr(format))
+		self.parsers = tuple(parsers)
+		self.format = format
+		self.quote = quote
+		self.row_constructor = row_constructor
+		if format == 'csv':
+			self.delimiter = b',' if delimiter is None else delimiter
+			self.null = b'' if null is None else null
+		else:
+			self.delimiter = b'\t' if delimiter is None else delimiter
+			self.null = b'\\N' if null is None else null
+
+	_raise_unpack_error = BinaryDecoder._raise_unpack_error
+
+	def fields(self, line):
+		"""
+		Split the line into its unconverted fields.
+		"""
+		if self.format == 'csv':
+			return csv_fields(line, self.delimiter, self.quote, self.null)
+		return text_fields(line, self.delimiter, self.null)
+
+	def row(self, line):
+		"""
+		Decode a single line.
+		"""
+		return self.row_constructor(process_tuple(
+			self.parsers, tuple(self.fields(line)), self._raise_unpack_error
+		))
+
+	def __call__(self, lines,
+		process_tuple = process_tuple,
+		text_fields = text_fields,
+		csv_fields = csv_fields,
+		tuple = tuple,
+	):
+		parsers = self.parsers
+		rc = self.row_constructor
+		fail = self._raise_unpack_error
+		delimiter = self.delimiter
+		null = self.null
+		if self.format == 'csv':
+			quote = self.quote
+			return [
+				rc(process_tuple(parsers, tuple(csv_fields(x, delimiter, quote, null)), fail))
+				for x in lines
+			]
+		return [
+			rc(process_tuple(parsers, tuple(text_fields(x, delimiter, null)), fail))
+			for x in lines
+		]
+
+def text_rows(chunks, typio, oids, format = 'text', **kw):
+	"""
+	Produce the rows of text or CSV COPY data given as an iterable of
+	sequences of COPY lines--``Statement.chunks()`` of a ``COPY ... TO
+	STDOUT``. The keywords are given to `TextDecoder.from_oids`.
+	"""
+	d = TextDecoder.from_oids(typio, oids, format = format, **kw)
+	for x in chunks:
+		yield from d(x)
@@ -7,18 +7,58 @@ Manage complex COPY operations; one-to-many COPY streaming.
 Primarily this module houses the `CopyManager` class, and the `transfer`
 function for a high-level interface to using the `CopyManager`.
 """
+import os
+import re
 import sys
+import gzip
+import json
+import time
+import mmap
+import socket
+import threading
+import selectors
+from collections import deque
+from queue import Queue, Empty, Full
+from concurrent.futures import ThreadPoolExecutor
 from abc import abstractmethod, abstractproperty
 from collections import Iterator
 from .python.element import Element, ElementSet
 from .python.structlib import ulong_unpack, ulong_pack
+from .python.itertools import chunk
 from .protocol.buffer import pq_message_stream
 from .protocol.element3 import CopyData, CopyDone, Complete, cat_messages
 from .protocol.xact3 import Complete as xactComplete
+from .string import quote_literal
+from .copyformat import text_fields, text_line
 
 #: 10KB buffer for COPY messages by default.
 default_buffer_size = 1024 * 10
 
+try:
+	import bz2
+except ImportError:
+	bz2 = None
+try:
+	import lzma
+except ImportError:
+	lzma = None
+
+try:
+	import ssl
+	_would_block = (BlockingIOError, ssl.SSLWantWriteError, ssl.SSLWantReadError)
+	del ssl
+except ImportError:
+	_would_block = (BlockingIOError,)
+
+def _detach(producer, data):
+	"""
+	Copy the data if it is a view of the producer's reusable buffer.
+	"""
+	if data.__class__ is memoryview \
+	and data.obj is getattr(producer, 'buffer', None):
+		return bytes(data)
+	return data
+
 class Fault(Exception):
 	pass
 
@@ -97,6 +137,79 @@ class ChunkProtocol(object):
 		self.buffer.write(bytes(data))
 		return [x[1] for x in self.buffer.read()]
 
+class CopyDataPacker(object):
+	"""
+	Serialize lists of COPY lines as CopyData messages holding at least `size`
+	bytes of lines each. If `size` is zero or `None`, a message is serialized
+	for each line.
+
+	Lines that do not fill a message are held for the following lists. They are
+	serialized once `delay` seconds have passed since the oldest of them was
+	received, or by `flush` at the end of the COPY data. A `delay` of `None`
+	holds them until the size is reached or `flush` is called. As with
+	`postgresql.python.itertools.coalesce`, the delay is checked as lists are
+	received.
+	"""
+	__slots__ = ('size', 'delay', 'clock', 'held', 'held_bytes', 'started')
+
+	def __init__(self, size = 1024 * 128, delay = None, clock = time.monotonic):
+		self.size = size
+		self.delay = delay
+		self.clock = clock
+		self.held = []
+		self.held_bytes = 0
+		self.started = None
+
+	def __call__(self, lines, lpack = ulong_pack, len = len, memoryview = memoryview):
+		size = self.size
+		if not size:
+			return cat_messages(lines)
+
+		out = []
+		parts = self.held
+		pending = self.held_bytes
+		for x in lines:
+			n = len(x)
+			if not n:
+				continue
+			parts.append(x)
+			pending += n
+			if pending >= size:
+				out.append(b'd' + lpack(pending + 4))
+				out.extend(parts)
+				parts = []
+				pending = 0
+				self.started = None
+
+		if pending and self.delay is not None:
+			now = self.clock()
+			if self.started is None:
+				self.started = now
+			if now - self.started >= self.delay:
+				out.append(b'd' + lpack(pending + 4))
+				out.extend(parts)
+				parts = []
+				pending = 0
+				self.started = None
+
+		# Views may be of a buffer the producer reuses.
+		self.held = [bytes(x) if x.__class__ is memoryview else x for x in parts]
+		self.held_bytes = pending
+		return b''.join(out)
+
+	def flush(self, lpack = ulong_pack):
+		"""
+		Serialize the held lines; `b''` if there are none.
+		"""
+		if not self.held_bytes:
+			return b''
+		out = [b'd' + lpack(self.held_bytes + 4)]
+		out.extend(self.held)
+		self.held = []
+		self.held_bytes = 0
+		self.started = None
+		return b''.join(out)
+
 # Null protocol mapping.
 def EmptyView(arg):
 	return memoryview(b'')
@@ -113,7 +226,7 @@ copy_protocol_mappings = {
 	# PQv3 -> Chunks
 	(PROTOCOL_PQv3, PROTOCOL_CHUNKS) : ChunkProtocol,
 	# Chunks -> PQv3
-	(PROTOCOL_CHUNKS, PROTOCOL_PQv3) : lambda: cat_messages,
+	(PROTOCOL_CHUNKS, PROTOCOL_PQv3) : CopyDataPacker,
 	# Null Producers and Receivers
 	(PROTOCOL_NULL, PROTOCOL_PQv3) : lambda: EmptyView,
 	(PROTOCOL_NULL, PROTOCOL_CHUNKS) : lambda: EmptyList,
@@ -128,19 +241,138 @@ copy_protocol_mappings = {
 # Used to manage the conversions of COPY data.
 # Notably, chunks -> PQv3 or PQv3 -> chunks.
 class CopyTransformer(object):
-	__slots__ = ('current', 'transformers', 'get')
-	def __init__(self, source_protocol, target_protocols):
+	__slots__ = ('current', 'transformers', 'get', 'stage', 'source', 'rows')
+	def __init__(self, source_protocol, target_protocols, stage = None,
+		message_size = 1024 * 128, flush_delay = None,
+	):
 		self.current = {}
-		self.transformers = {
-			x : copy_protocol_mappings[(source_protocol, x)]()
-			for x in set(target_protocols)
-		}
+		self.stage = stage
+		self.rows = None
+		if stage is None:
+			self.source = None
+			self.transformers = {
+				x : copy_protocol_mappings[(source_protocol, x)]()
+				for x in set(target_protocols)
+			}
+		else:
+			# The stage is given complete lines, and the lines it returns are
+			# serialized anew, so the receivers remain on message boundaries.
+			self.source = copy_protocol_mappings[(source_protocol, PROTOCOL_CHUNKS)]()
+			self.transformers = {
+				x : copy_protocol_mappings[(PROTOCOL_CHUNKS, x)]()
+				for x in set(target_protocols)
+			}
+		for x in self.transformers.values():
+			if isinstance(x, CopyDataPacker):
+				x.size = message_size
+				x.delay = flush_delay
 		self.get = self.current.__getitem__
 
-	def __call__(self, data):
+	def _deliver(self, data):
 		for protocol, transformer in self.transformers.items():
 			self.current[protocol] = transformer(data)
 
+	def __call__(self, data):
+		if self.stage is not None:
+			data = self.stage(self.source(data))
+			self.rows = len(data)
+		self._deliver(data)
+
+	def flush(self):
+		"""
+		Deliver the lines held by the stage and by the packers at the end of the
+		COPY data. `False` if there were none.
+		"""
+		flush = getattr(self.stage, 'flush', None)
+		lines = flush() if flush is not None else None
+		if not lines and not any(
+			x.held_bytes for x in self.transformers.values()
+			if isinstance(x, CopyDataPacker)
+		):
+			return False
+		# Only the stage's lines are new rows.
+		lines = lines or []
+		self.rows = len(lines)
+		for protocol, transformer in self.transformers.items():
+			data = transformer(lines)
+			if isinstance(transformer, CopyDataPacker):
+				data += transformer.flush()
+			self.current[protocol] = data
+		return True
+
+# Returned by CopyManager._read when the transform stage was flushed.
+_flushed = object()
+
+class TextTransform(object):
+	"""
+	Transform stage for text format COPY data; given to a `CopyManager` as its
+	`transform`.
+
+	The COPY data is divided into rows, which may span messages, and the rows
+	are split into lists of fields, `bytes` or `None` for NULLs,
+	using `postgresql.copyformat.text_fields`. Lines whose fields do not satisfy
+	the `predicate` are dropped, and then the fields of the remaining lines
+	are replaced:
+
+	 `functions`
+	  A mapping of column indexes to callables given the column's field and
+	  returning its replacement.
+
+	 `vectorized`
+	  A mapping of column indexes to callables given a list of the column's
+	  fields in a chunk and returning a sequence of their replacements.
+
+	The lines are then joined using `postgresql.copyformat.text_line`.
+	"""
+	def __init__(self,
+		functions = None,
+		predicate = None,
+		vectorized = None,
+		delimiter = b'\t',
+		null = b'\\N',
+	):
+		self.functions = tuple((functions or {}).items())
+		self.vectorized = tuple((vectorized or {}).items())
+		self.predicate = predicate
+		self.delimiter = delimiter
+		self.null = null
+		# The incomplete row at the end of the data.
+		self._partial = b''
+
+	def __call__(self, lines):
+		data = b''.join(lines)
+		if self._partial:
+			data = self._partial + data
+		# Line endings in the fields are always escaped.
+		rows = data.splitlines(True)
+		if rows and not rows[-1].endswith(b'\n'):
+			self._partial = rows.pop()
+		else:
+			self._partial = b''
+		return self._transform(rows)
+
+	def flush(self):
+		"""
+		Transform the final row when the data does not end with a newline.
+		"""
+		partial = self._partial
+		self._partial = b''
+		return self._transform([partial]) if partial else []
+
+	def _transform(self, lines, text_fields = text_fields, text_line = text_line):
+		delimiter = self.delimiter
+		null = self.null
+		rows = [text_fields(x, delimiter, null) for x in lines]
+		if self.predicate is not None:
+			rows = list(filter(self.predicate, rows))
+		for i, f in self.functions:
+			for r in rows:
+				r[i] = f(r[i])
+		for i, f in self.vectorized:
+			for r, v in zip(rows, f([r[i] for r in rows])):
+				r[i] = v
+		return [text_line(r, delimiter, null) for r in rows]
+
 ##
 # This is the object that does the magic.
 # It tracks the state of the wire.
@@ -249,9 +481,142 @@ class WireState(object):
 		self.final_view = None
 		self.condition = condition
 
+def tuple_size(row,
+	len = len, str = str,
+	lengthed = (bytes, bytearray, memoryview, str),
+):
+	"""
+	Estimate the bytes of a parameter tuple as a COPY text line: the length of
+	each field's text, or of its bytes, and a byte for each delimiter.
+	"""
+	n = len(row)
+	for x in row:
+		if x is None:
+			continue
+		if x.__class__ in lengthed:
+			n += len(x)
+		else:
+			n += len(str(x))
+	return n
+
+class Throttle(object):
+	"""
+	Token bucket limiting the rate of the COPY data passing through the
+	fittings it is attached to, or given to ``load_chunks`` using `chunks`.
+
+	`bytes_per_second` and `rows_per_second` are the sustained rates, `None` for
+	no limit, and may be changed while a COPY is running; a rate must be
+	positive. After an idle period,
+	`burst` seconds of data may pass at once. `throttled` is the total number of
+	seconds spent waiting for the rates.
+	"""
+	def __init__(self,
+		bytes_per_second = None,
+		rows_per_second = None,
+		burst = 1.0,
+		clock = time.monotonic,
+		sleep = time.sleep,
+	):
+		self.burst = burst
+		self.clock = clock
+		self.sleep = sleep
+		self.throttled = 0.0
+		self._lock = threading.Lock()
+		self._last = clock()
+		# [rate, tokens]
+		self._bytes = [None, 0.0]
+		self._rows = [None, 0.0]
+		self.bytes_per_second = bytes_per_second
+		self.rows_per_second = rows_per_second
+
+	def _refill(self):
+		now = self.clock()
+		elapsed = now - self._last
+		self._last = now
+		for b in (self._bytes, self._rows):
+			if b[0] is not None:
+				b[1] = min(b[0] * self.burst, b[1] + b[0] * elapsed)
+
+	def _set_rate(self, bucket, rate):
+		if rate is not None and not rate > 0:
+			raise ValueError("rate must be positive or None, not " + repr(rate))
+		with self._lock:
+			self._refill()
+			if rate is not None and bucket[0] is None:
+				# Start with a full bucket.
+				bucket[1] = rate * self.burst
+			elif rate is not None:
+				bucket[1] = min(bucket[1], rate * self.burst)
+			bucket[0] = rate
+
+	@property
+	def bytes_per_second(self):
+		return self._bytes[0]
+
+	@bytes_per_second.setter
+	def bytes_per_second(self, rate):
+		self._set_rate(self._bytes, rate)
+
+	@property
+	def rows_per_second(self):
+		return self._rows[0]
+
+	@rows_per_second.setter
+	def rows_per_second(self, rate):
+		self._set_rate(self._rows, rate)
+
+	def __call__(self, bytes = 0, rows = 0):
+		"""
+		Take the tokens for the data, waiting until the rates allow it to pass.
+		Returns the number of seconds waited.
+		"""
+		wait = 0.0
+		with self._lock:
+			self._refill()
+			for b, n in ((self._bytes, bytes), (self._rows, rows)):
+				if b[0] is not None:
+					b[1] -= n
+					if b[1] < 0:
+						wait = max(wait, -b[1] / b[0])
+			if wait:
+				self.throttled += wait
+		if wait:
+			self.sleep(wait)
+		return wait
+
+	def chunks(self, chunks, size = None):
+		"""
+		Throttle an iterable of chunks of COPY lines or of parameter tuples, as
+		given to ``load_chunks``. The bytes of parameter tuples are estimated
+		by `size`, a callable given a tuple, which defaults to `tuple_size`;
+		they are only estimated while `bytes_per_second` is set.
+		"""
+		if size is None:
+			size = tuple_size
+		for c in chunks:
+			if c and c[0].__class__ in (bytes, bytearray, memoryview):
+				self(sum(map(len, c)), len(c))
+			elif self._bytes[0] is not None:
+				self(sum(map(size, c)), len(c))
+			else:
+				self(0, len(c))
+			yield c
+
+	def rows(self, rows, chunksize = 256, size = None):
+		"""
+		Throttle an iterable of rows, as given to ``load_rows``, in chunks of
+		`chunksize`. `size` is given to `chunks`.
+		"""
+		for c in self.chunks(chunk(rows, chunksize), size = size):
+			yield from c
+
 class Fitting(Element):
 	_e_label = 'FITTING'
 
+	#: The `Throttle` limiting the data read from the producer or given to the
+	#: receiver.
+	throttle = None
+
 	def _e_metas(self):
 		yield None, '[' + self.state + ']'
 
@@ -283,6 +648,14 @@ class Producer(Fitting, Iterator):
 		self.total_messages = 0
 		self.total_bytes = 0
 
+	@property
+	def total_rows(self):
+		"""
+		The number of rows produced; the number of messages unless a message can
+		hold more than one row.
+		"""
+		return self.total_messages
+
 	@abstractmethod
 	def realign(self):
 		"""
@@ -528,6 +901,110 @@ class StatementProducer(ProtocolProducer):
 					db._pq_complete()
 		super().__exit__(typ, val, tb)
 
+class FileProducer(Producer):
+	"""
+	Produce the COPY lines of a file as PQv3 CopyData messages.
+
+	The file is memory-mapped, and the message bodies are views of the map that
+	end on line boundaries; the data is not copied into Python objects. The
+	header of each message is produced separately from its body, so at most
+	`buffer_size` bytes of the file are referenced by the receivers at once
+	unless a single line is larger.
+
+	The file is read from `offset`, which must be at the start of a line.
+	"""
+	_e_factors = ('file',)
+	protocol = PROTOCOL_PQv3
+	# Lines produced; a message holds many.
+	total_rows = 0
+
+	@property
+	def state(self):
+		if self._map is None:
+			return 'created' if self.position == self.offset else 'finished'
+		return 'producing'
+
+	def __init__(self, file, buffer_size = 1024 * 1024, offset = 0):
+		super().__init__()
+		self.file = file
+		self.buffer_size = buffer_size
+		self.offset = offset
+		self.position = offset
+		self._map = None
+		self._view = None
+		self._fileobj = None
+		# Body of the message whose header was produced.
+		self._body = None
+		self._finished = False
+
+	def __enter__(self):
+		super().__enter__()
+		if self._map is not None:
+			raise RuntimeError("producer already used")
+		if isinstance(self.file, (str, bytes)):
+			f = self._fileobj = open(self.file, 'rb')
+		else:
+			f = self.file
+		if os.fstat(f.fileno()).st_size:
+			self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+			self._view = memoryview(self._map)
+		else:
+			self._view = memoryview(b'')
+
+	def __exit__(self, typ, val, tb):
+		if self._view is not None:
+			self._view.release()
+			self._view = None
+		if self._map is not None:
+			try:
+				self._map.close()
+			except BufferError:
+				# Receivers still hold views; the map is closed
+				# when they are released.
+				pass
+			self._map = None
+		if self._fileobj is not None:
+			self._fileobj.close()
+			self._fileobj = None
+		super().__exit__(typ, val, tb)
+
+	def realign(self):
+		# Only the body of a message whose header was produced is needed.
+		self._finished = True
+
+	def __next__(self, lpack = ulong_pack, lines = re.compile(b'\n').findall):
+		body = self._body
+		if body is not None:
+			self._body = None
+			return body
+
+		view = self._view
+		start = self.position
+		end = len(view)
+		if start >= end or self._finished:
+			raise StopIteration
+		stop = start + self.buffer_size
+		if stop < end:
+			nl = self._map.rfind(b'\n', start, stop)
+			if nl == -1:
+				# Line longer than the buffer.
+				nl = self._map.find(b'\n', stop)
+			stop = end if nl == -1 else nl + 1
+		else:
+			stop = end
+
+		self.position = stop
+		self._body = body = view[start:stop]
+		# Count the lines in place; slicing the map would copy them.
+		rows = len(lines(body))
+		if stop == end and self._map[end-1] != 0x0A:
+			# The last line is not terminated.
+			rows += 1
+		self.total_rows += rows
+		self.total_messages += 1
+		self.total_bytes += stop - start + 5
+		return b'd' + lpack(stop - start + 4)
+
 class NullReceiver(Receiver):
 	_e_factors = ()
 	protocol = PROTOCOL_NULL
@@ -654,15 +1131,648 @@ class CallReceiver(Receiver):
 	def accept(self, lines):
 		self.lines = lines
 
+class FileReceiver(Receiver):
+	"""
+	Write the received COPY lines to a file.
+
+	The lines are written using ``os.writev`` once at least `buffer_size` bytes
+	have been received, so the number of system calls does not depend on the
+	number of lines.
+	"""
+	_e_factors = ('file',)
+	protocol = PROTOCOL_CHUNKS
+
+	#: Maximum number of buffers given to a single ``os.writev`` call.
+	iov_max = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') \
+		and 'SC_IOV_MAX' in getattr(os, 'sysconf_names', ()) else 1024
+
+	def __init__(self, file, mode = 'wb', buffer_size = 1024 * 1024):
+		super().__init__()
+		self.file = file
+		self.mode = mode
+		self.buffer_size = buffer_size
+		self.lines = None
+		self.pending = []
+		self.pending_bytes = 0
+		self.total_bytes = 0
+		self._fileobj = None
+		self._fd = None
+
+	def __enter__(self):
+		super().__enter__()
+		if isinstance(self.file, (str, bytes)):
+			f = self._fileobj = open(self.file, self.mode)
+		else:
+			f = self.file
+			# Data written through the file object must precede the COPY data.
+			f.flush()
+		self._fd = f.fileno()
+
+	def __exit__(self, typ, val, tb):
+		try:
+			if typ is None:
+				self.flush()
+		finally:
+			if self._fileobj is not None:
+				self._fileobj.close()
+				self._fileobj = None
+		super().__exit__(typ, val, tb)
+
+	def flush(self, writev = getattr(os, 'writev', None), len = len):
+		"""
+		Write the pending lines to the file.
+		"""
+		buffers = self.pending
+		fd = self._fd
+		iov_max = self.iov_max
+		while buffers:
+			batch = buffers[:iov_max]
+			if writev is None:
+				n = os.write(fd, b''.join(batch))
+			else:
+				n = writev(fd, batch)
+			self.pending_bytes -= n
+			self.total_bytes += n
+			# Skip the completely written buffers.
+			i = 0
+			for x in batch:
+				l = len(x)
+				if n < l:
+					break
+				n -= l
+				i += 1
+			del buffers[:i]
+			if n:
+				buffers[0] = memoryview(buffers[0])[n:]
+
+	def transmit(self):
+		if self.lines is not None:
+			self.pending.extend(self.lines)
+			self.pending_bytes += sum(map(len, self.lines))
+			self.lines = None
+		if self.pending_bytes >= self.buffer_size:
+			self.flush()
+
+	def accept(self, lines):
+		self.lines = lines
+
+class Checkpoint(object):
+	"""
+	Record of the data committed by `BatchReceiver` instances, kept in a JSON
+	file so that an interrupted transfer can be resumed by `resume_transfer`.
+
+	Each receiver's entry is a dictionary of the ``rows`` and ``bytes``
+	committed and the text of the ``key`` of the last committed row. The
+	receivers of a transfer must share the same `Checkpoint` instance.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self._lock = threading.Lock()
+		if os.path.exists(path):
+			with open(path) as f:
+				self.state = json.load(f)
+		else:
+			self.state = {}
+
+	def get(self, name):
+		"""
+		The entry recorded for `name`; nothing committed if there is none.
+		"""
+		with self._lock:
+			x = self.state.get(name)
+		return dict(x) if x is not None else {'rows' : 0, 'bytes' : 0, 'key' : None}
+
+	def record(self, name, rows, bytes, key = None):
+		"""
+		Record the totals committed by `name`. The file is replaced atomically
+		once the new state is synchronized to disk.
+		"""
+		with self._lock:
+			self.state[name] = {'rows' : rows, 'bytes' : bytes, 'key' : key}
+			tmp = self.path + '.tmp'
+			with open(tmp, 'w') as f:
+				json.dump(self.state, f, sort_keys = True)
+				f.flush()
+				os.fsync(f.fileno())
+			os.replace(tmp, self.path)
+
+class BatchReceiver(Receiver):
+	"""
+	Load the received COPY lines using `statement`, a ``COPY ... FROM STDIN``
+	statement, in batches of at least `batch_size` bytes that are each committed
+	in their own transaction.
+
+	After each commit, the totals are recorded in the `checkpoint` under `name`,
+	and when the receiver is created, they are read back so that
+	`resume_transfer` can skip the data that was committed. If `key_column` is
+	given, the text of that column in the last committed row is recorded too; it
+	is converted using `key_type` when read back.
+
+	A crash between a commit and its record loads that batch again on resume.
+	"""
+	_e_factors = ('statement', 'name')
+	protocol = PROTOCOL_CHUNKS
+
+	#: Bytes loaded by each transaction.
+	batch_size = 1024 * 1024 * 16
+
+	@property
+	def state(self):
+		return str(self.rows) + ' rows committed'
+
+	def __init__(self, statement,
+		checkpoint = None,
+		name = None,
+		batch_size = None,
+		key_column = None,
+		key_type = int,
+		delimiter = b'\t',
+		null = b'\\N',
+	):
+		super().__init__()
+		if checkpoint is not None and name is None:
+			raise ValueError("a name is required to record checkpoints")
+		self.statement = statement
+		self.checkpoint = checkpoint
+		self.name = name
+		if batch_size is not None:
+			self.batch_size = batch_size
+		self.key_column = key_column
+		self.key_type = key_type
+		self.delimiter = delimiter
+		self.null = null
+
+		state = checkpoint.get(name) if checkpoint is not None else {}
+		self.rows = state.get('rows', 0)
+		self.bytes = state.get('bytes', 0)
+		self._key_text = state.get('key')
+		self.last_key = None if self._key_text is None else key_type(self._key_text)
+
+		# Offset of the next data received in the stream.
+		self.position = self.bytes
+		# Rows up to this key are skipped; set by resume_after.
+		self._skip_key = None
+		self.lines = None
+		self.pending = []
+		self.pending_bytes = 0
+
+	def resume(self, offset):
+		"""
+		Receive a stream starting at byte `offset`; the data up to the
+		committed `bytes` is discarded.
+		"""
+		self.position = offset
+
+	def resume_after(self, key):
+		"""
+		Receive the rows whose keys are greater than `key`, in key order; the
+		rows up to the committed `last_key` are discarded.
+		"""
+		if self.last_key is not None and (key is None or self.last_key > key):
+			self._skip_key = self.last_key
+
+	def _key(self, row):
+		field = text_fields(row, self.delimiter, self.null)[self.key_column]
+		return None if field is None else field.decode('utf-8')
+
+	def _skip_bytes(self, lines):
+		remaining = self.bytes - self.position
+		for i, x in enumerate(lines):
+			n = len(x)
+			if n > remaining:
+				self.position += remaining
+				return [x[remaining:]] + list(lines[i+1:])
+			self.position += n
+			remaining -= n
+		return []
+
+	def _skip_keys(self, lines):
+		rows = b''.join(lines).splitlines(True)
+		key_type = self.key_type
+		skip = self._skip_key
+		for i, x in enumerate(rows):
+			if key_type(self._key(x)) > skip:
+				self._skip_key = None
+				return rows[i:]
+		return []
+
+	def commit(self):
+		"""
+		Load and commit the pending lines, and record the new totals.
+		"""
+		pending = self.pending
+		if not pending:
+			return
+		with self.statement.database.xact():
+			self.statement.load_chunks([pending])
+
+		self.rows += sum(
+			(bytes(x) if x.__class__ is memoryview else x).count(b'\n')
+			for x in pending
+		)
+		self.bytes += self.pending_bytes
+		if self.key_column is not None:
+			last = bytes(pending[-1])
+			row = last[last.rfind(b'\n', 0, len(last) - 1) + 1:]
+			self._key_text = self._key(row)
+			self.last_key = self.key_type(self._key_text)
+		self.pending = []
+		self.pending_bytes = 0
+		if self.checkpoint is not None:
+			self.checkpoint.record(self.name, self.rows, self.bytes, self._key_text)
+
+	def transmit(self):
+		lines = self.lines
+		if lines is not None:
+			self.lines = None
+			if self.position < self.bytes:
+				lines = self._skip_bytes(lines)
+			elif self._skip_key is not None:
+				lines = self._skip_keys(lines)
+			if lines:
+				size = _data_size(lines)
+				self.pending.extend(lines)
+				self.pending_bytes += size
+				self.position += size
+		if self.pending_bytes >= self.batch_size:
+			self.commit()
+
+	def accept(self, lines):
+		self.lines = lines
+
+	def __exit__(self, typ, val, tb):
+		if typ is None:
+			self.commit()
+		super().__exit__(typ, val, tb)
+
+##
+# Compressed archives of COPY data.
+#
+# An archive starts with `archive_magic`, followed by the length and the name
+# of the codec. Each block is framed by its number of lines, its size, and its
+# compressed size, and the archive ends with a frame of zeros. The blocks end on
+# line boundaries and are compressed independently, so they can be restored in
+# any order.
+archive_magic = b'PGCOPYZ\n'
+
+#: The ``(compress, decompress)`` functions of the archive codecs.
+#: ``compress`` is given the data and the compression level, or `None`.
+archive_codecs = {
+	'gzip' : (
+		lambda data, level: gzip.compress(data, 6 if level is None else level),
+		gzip.decompress,
+	),
+}
+if bz2 is not None:
+	archive_codecs['bz2'] = (
+		lambda data, level: bz2.compress(data, 9 if level is None else level),
+		bz2.decompress,
+	)
+if lzma is not None:
+	archive_codecs['lzma'] = (
+		lambda data, level: lzma.compress(data, preset = level),
+		lzma.decompress,
+	)
+
+def _archive_codec(f):
+	"""
+	Read the header of the archive, returning the name of its codec.
+	"""
+	magic = f.read(len(archive_magic))
+	if magic != archive_magic:
+		raise ValueError("not a COPY archive")
+	size = f.read(1)
+	name = f.read(size[0]).decode('ascii') if size else ''
+	if name not in archive_codecs:
+		raise ValueError("unsupported COPY archive codec: " + repr(name))
+	return name
+
+def _archive_frames(f, unpack = ulong_unpack):
+	"""
+	Produce the ``(lines, size, compressed)`` blocks of the archive after its
+	header.
+	"""
+	while True:
+		frame = f.read(12)
+		if len(frame) < 12:
+			raise ValueError("COPY archive is truncated")
+		lines = unpack(frame[0:4])
+		size = unpack(frame[4:8])
+		csize = unpack(frame[8:12])
+		if not csize:
+			break
+		data = f.read(csize)
+		if len(data) < csize:
+			raise ValueError("COPY archive is truncated")
+		yield (lines, size, data)
+
+class ArchiveReceiver(Receiver):
+	"""
+	Write the received COPY lines to a compressed archive read by
+	`ArchiveProducer` and `parallel_restore`.
+
+	The lines are collected into blocks of at least `block_size` bytes, and each
+	block is compressed by one of `workers` threads using the `codec` at the
+	given `level`. Once `backlog` blocks per worker are being compressed, the
+	receiver waits for the oldest, so the data held is bounded.
+	"""
+	_e_factors = ('file', 'codec')
+	protocol = PROTOCOL_CHUNKS
+
+	def __init__(self, file,
+		codec = 'gzip',
+		level = None,
+		block_size = 1024 * 1024 * 4,
+		workers = 1,
+		backlog = 2,
+		mode = 'wb',
+	):
+		super().__init__()
+		if codec not in archive_codecs:
+			raise ValueError("unsupported COPY archive codec: " + repr(codec))
+		self.file = file
+		self.codec = codec
+		self.level = level
+		self.block_size = block_size
+		self.workers = workers
+		self.backlog = backlog
+		self.mode = mode
+		self.lines = None
+		self.pending = []
+		self.pending_bytes = 0
+		self.blocks = 0
+		self.total_bytes = 0
+		self.compressed_bytes = 0
+		self._fileobj = None
+		self._f = None
+		self._executor = None
+		# (lines, size, future) of the blocks being compressed.
+		self._futures = deque()
+
+	def __enter__(self):
+		super().__enter__()
+		if isinstance(self.file, (str, bytes)):
+			f = self._f = self._fileobj = open(self.file, self.mode)
+		else:
+			f = self._f = self.file
+		name = self.codec.encode('ascii')
+		f.write(archive_magic + bytes((len(name),)) + name)
+		self._executor = ThreadPoolExecutor(self.workers)
+
+	def __exit__(self, typ, val, tb):
+		try:
+			if typ is None and self._executor is not None:
+				if self.pending:
+					self._submit()
+				while self._futures:
+					self._write()
+				self._f.write(ulong_pack(0) * 3)
+				self._f.flush()
+		finally:
+			for x in self._futures:
+				x[2].cancel()
+			self._futures.clear()
+			if self._executor is not None:
+				self._executor.shutdown()
+				self._executor = None
+			if self._fileobj is not None:
+				self._fileobj.close()
+				self._fileobj = None
+		super().__exit__(typ, val, tb)
+
+	def _submit(self):
+		data = b''.join(self.pending)
+		# A received body may hold many lines.
+		lines = data.count(b'\n')
+		self.pending = []
+		self.pending_bytes = 0
+		while len(self._futures) >= self.workers * self.backlog:
+			self._write()
+		compress = archive_codecs[self.codec][0]
+		self._futures.append(
+			(lines, len(data), self._executor.submit(compress, data, self.level))
+		)
+
+	def _write(self, pack = ulong_pack):
+		"""
+		Write the oldest block, waiting for its compression.
+		"""
+		lines, size, future = self._futures[0]
+		data = future.result()
+		self._futures.popleft()
+		self._f.write(pack(lines) + pack(size) + pack(len(data)) + data)
+		self.blocks += 1
+		self.total_bytes += size
+		self.compressed_bytes += len(data)
+
+	def transmit(self):
+		if self.lines is not None:
+			self.pending.extend(self.lines)
+			self.pending_bytes += _data_size(self.lines)
+			self.lines = None
+		if self.pending_bytes >= self.block_size:
+			self._submit()
+		futures = self._futures
+		while futures and futures[0][2].done():
+			self._write()
+
+	def accept(self, lines):
+		self.lines = lines
+
+class ArchiveProducer(Producer):
+	"""
+	Produce the COPY lines of an archive written by `ArchiveReceiver`.
+
+	Each block is produced as a single chunk. The blocks following the one
+	being produced are decompressed by `workers` threads, at most `backlog`
+	blocks per worker ahead.
+	"""
+	_e_factors = ('file',)
+	protocol = PROTOCOL_CHUNKS
+
+	def __init__(self, file, workers = 1, backlog = 2):
+		super().__init__()
+		self.file = file
+		self.workers = workers
+		self.backlog = backlog
+		self.codec = None
+		self._fileobj = None
+		self._frames = None
+		self._executor = None
+		self._futures = deque()
+
+	def __enter__(self):
+		super().__enter__()
+		if isinstance(self.file, (str, bytes)):
+			f = self._fileobj = open(self.file, 'rb')
+		else:
+			f = self.file
+		self.codec = _archive_codec(f)
+		self._frames = _archive_frames(f)
+		self._executor = ThreadPoolExecutor(self.workers)
+
+	def __exit__(self, typ, val, tb):
+		for x in self._futures:
+			x[2].cancel()
+		self._futures.clear()
+		if self._executor is not None:
+			self._executor.shutdown()
+			self._executor = None
+		if self._fileobj is not None:
+			self._fileobj.close()
+			self._fileobj = None
+		super().__exit__(typ, val, tb)
+
+	def realign(self):
+		# Never needs to realign; blocks end on line boundaries.
+		pass
+
+	def __next__(self):
+		futures = self._futures
+		frames = self._frames
+		if frames is not None:
+			decompress = archive_codecs[self.codec][1]
+			limit = self.workers * self.backlog
+			while len(futures) < limit:
+				x = next(frames, None)
+				if x is None:
+					self._frames = None
+					break
+				futures.append((x[0], x[1], self._executor.submit(decompress, x[2])))
+		if not futures:
+			raise StopIteration
+
+		lines, size, future = futures[0]
+		data = future.result()
+		futures.popleft()
+		if len(data) != size:
+			raise ValueError("COPY archive block is corrupt")
+		self.total_messages += lines
+		self.total_bytes += size
+		return [data]
+
+def _data_size(data):
+	"""
+	The number of bytes in the data given to a receiver.
+	"""
+	if data is None:
+		return 0
+	if data.__class__ in (bytes, bytearray, memoryview):
+		return len(data)
+	return sum(map(len, data))
+
+class FittingMetrics(object):
+	"""
+	Counters of a producer or a receiver.
+
+	`bytes` and `rows` are the data read from the producer or given to the
+	receiver, and `blocked` is the number of seconds spent reading from the
+	producer or transmitting to the receiver. `throttled` is the number of
+	seconds spent waiting for the fitting's `Throttle`. `high_water` is the
+	largest read from the producer or, for receivers, the most data buffered by
+	the manager.
+	"""
+	__slots__ = ('bytes', 'rows', 'blocked', 'throttled', 'high_water', 'faults')
+
+	def __init__(self):
+		self.bytes = 0
+		self.rows = 0
+		self.blocked = 0.0
+		self.throttled = 0.0
+		self.high_water = 0
+		self.faults = 0
+
+	def statistics(self, elapsed):
+		return {
+			'bytes' : self.bytes,
+			'rows' : self.rows,
+			'blocked' : self.blocked,
+			'throttled' : self.throttled,
+			'high_water' : self.high_water,
+			'faults' : self.faults,
+			'throughput' : self.bytes / elapsed if elapsed else 0.0,
+		}
+
+class CopyMetrics(object):
+	"""
+	The metrics of a COPY operation managed by a `CopyManager`.
+	"""
+
+	def __init__(self, clock = time.perf_counter):
+		self.clock = clock
+		self.started = None
+		self.finished = None
+		self.producer = FittingMetrics()
+		self.receivers = {}
+
+	def receiver(self, r):
+		"""
+		The `FittingMetrics` of the receiver.
+		"""
+		m = self.receivers.get(r)
+		if m is None:
+			m = self.receivers[r] = FittingMetrics()
+		return m
+
+	@property
+	def elapsed(self):
+		if self.started is None:
+			return 0.0
+		return (self.finished or self.clock()) - self.started
+
+	@property
+	def bottleneck(self):
+		"""
+		The fitting that the most time was spent waiting on; the producer or one
+		of the receivers.
+		"""
+		fitting = 'producer'
+		blocked = self.producer.blocked
+		for r, m in self.receivers.items():
+			if m.blocked > blocked:
+				fitting = r
+				blocked = m.blocked
+		return fitting
+
+	def statistics(self):
+		"""
+		A dictionary of the metrics; ``throughput`` is in bytes per second.
+		"""
+		elapsed = self.elapsed
+		return {
+			'elapsed' : elapsed,
+			'producer' : self.producer.statistics(elapsed),
+			'receivers' : [
+				dict(m.statistics(elapsed), receiver = r)
+				for r, m in self.receivers.items()
+			],
+		}
+
 class CopyManager(Element, Iterator):
 	"""
 	A class for managing COPY operations.
 
-	Connects the producer to the receivers.
+	Connects the producer to the receivers. If `transform` is given, it is
+	called with the list of COPY lines read from the producer and returns the
+	list of lines given to the receivers.
+
+	Lines given to protocol receivers are joined into CopyData messages holding
+	at least `message_size` bytes of lines. Lines that do not fill a message
+	are held across reads for up to `flush_delay` seconds, and are given to the
+	receivers when the producer is exhausted.
 	"""
 	_e_label = 'COPY'
 	_e_factors = ('producer', 'receivers',)
 
+	#: Bytes of COPY lines joined into each CopyData message given to protocol
+	#: receivers; zero gives a message for each line.
+	message_size = 1024 * 128
+
+	#: Seconds lines that do not fill a CopyData message are held for;
+	#: `None` holds them until the message is filled or the producer is
+	#: exhausted.
+	flush_delay = 1.0
+
 	def _e_metas(self):
 		yield None, '[' + self.state + ']'
 
@@ -672,11 +1782,24 @@ class CopyManager(Element, Iterator):
 			return 'initialized'
 		return str(self.producer.total_messages) + ' messages transferred'
 
-	def __init__(self, producer, *receivers):
+	def __init__(self, producer, *receivers, transform = None, message_size = None,
+		flush_delay = None,
+	):
 		self.producer = producer
+		self.transform = transform
+		if message_size is not None:
+			self.message_size = message_size
+		if flush_delay is not None:
+			self.flush_delay = flush_delay
 		self.transformer = None
 		self.receivers = ElementSet(receivers)
 		self._seen_stop_iteration = False
+		self.metrics = CopyMetrics()
+		for x in self.receivers:
+			self.metrics.receiver(x)
+		# Rows and bytes per protocol of the last read.
+		self._rows = 0
+		self._sizes = {}
 		rp = set()
 		add = rp.add
 		for x in self.receivers:
@@ -687,7 +1810,12 @@ class CopyManager(Element, Iterator):
 		if self.transformer:
 			raise RuntimeError("copy already started")
 		self._stats = (0, 0)
-		self.transformer = CopyTransformer(self.producer.protocol, self.protocols)
+		self.transformer = CopyTransformer(
+			self.producer.protocol, self.protocols, self.transform,
+			message_size = self.message_size,
+			flush_delay = self.flush_delay,
+		)
+		self.metrics.started = self.metrics.clock()
 		self.producer.__enter__()
 		try:
 			for x in self.receivers:
@@ -703,6 +1831,7 @@ class CopyManager(Element, Iterator):
 		# In cases of failure, re-alignment may need to happen
 		# for when the receivers are not on a message boundary.
 		##
+		self.metrics.finished = self.metrics.clock()
 		if typ is not None and not issubclass(typ, Exception):
 			# Don't bother, it's an interrupt or sufficient resources.
 			return
@@ -761,51 +1890,133 @@ class CopyManager(Element, Iterator):
 		# Okay, add it back.
 		self.receivers.add(r)
 
-	def _service_producer(self):
-		# Setup current data.
-		if not self.receivers:
-			# No receivers to take the data.
-			raise StopIteration
-
+	def _read(self, perf_counter = time.perf_counter):
+		"""
+		Get the next data from the producer, recording the producer's metrics.
+		"""
+		producer = self.producer
+		m = self.metrics.producer
+		rows = producer.total_rows
+		bytes = producer.total_bytes
+		start = perf_counter()
 		try:
-			nextdata = next(self.producer)
+			nextdata = next(producer)
 		except StopIteration:
+			if self.transformer.flush():
+				return _flushed
 			# Should be over.
 			self._seen_stop_iteration = True
 			raise
 		except Exception:
+			m.faults += 1
 			raise ProducerFault(self)
+		finally:
+			m.blocked += perf_counter() - start
+
+		m.rows = producer.total_rows
+		m.bytes = producer.total_bytes
+		self._rows = m.rows - rows
+		if m.bytes - bytes > m.high_water:
+			m.high_water = m.bytes - bytes
+		if producer.throttle is not None:
+			m.throttled += producer.throttle(m.bytes - bytes, self._rows)
+		return nextdata
+
+	def _transform(self, data):
+		transformer = self.transformer
+		if data is _flushed:
+			# Only the stage's lines are new rows.
+			self._rows = transformer.rows
+		else:
+			transformer(data)
+			if transformer.stage is not None:
+				self._rows = transformer.rows
+		self._sizes = {
+			x : _data_size(transformer.get(x)) for x in transformer.transformers
+		}
+
+	def _accepted(self, x, throttle = True):
+		"""
+		Record the data of the last read as given to the receiver, and wait for
+		the receiver's throttle unless `throttle` is `False`.
+		"""
+		m = self.metrics.receiver(x)
+		size = self._sizes[x.protocol]
+		m.bytes += size
+		m.rows += self._rows
+		if throttle and x.throttle is not None:
+			m.throttled += x.throttle(size, self._rows)
+		return m
+
+	def _service_producer(self):
+		# Setup current data.
+		if not self.receivers:
+			# No receivers to take the data.
+			raise StopIteration
 
-		self.transformer(nextdata)
+		self._transform(self._read())
 
 		# Distribute data to receivers.
 		for x in self.receivers:
 			x.accept(self.transformer.get(x.protocol))
+			self._accepted(x)
 
-	def _service_receivers(self):
+	def _service_receivers(self, perf_counter = time.perf_counter):
 		faults = {}
+		receiver = self.metrics.receiver
 		for x in self.receivers:
 			# Process all the receivers.
+			m = receiver(x)
+			start = perf_counter()
 			try:
 				x.transmit()
 			except Exception as e:
 				faults[x] = e
+				m.faults += 1
+			m.blocked += perf_counter() - start
 		if faults:
 			# The CopyManager is eager to continue the operation.
 			for x in faults:
 				self.receivers.discard(x)
 			raise ReceiverFault(self, faults)
 
-	# Run the COPY to completion.
-	def run(self):
+	def run(self,
+		progress : "called with the `metrics` as the COPY progresses" = None,
+		interval : "seconds between calls to `progress`" = 1.0,
+		byte_interval : "bytes read between calls to `progress`" = None,
+		clock = time.monotonic,
+	):
+		"""
+		Run the COPY to completion.
+
+		`progress` is called every `interval` seconds or `byte_interval` bytes,
+		whichever comes first, and once more when the COPY is complete.
+		"""
 		with self:
 			try:
-				while True:
-					self._service_producer()
-					self._service_receivers()
+				if progress is None:
+					while True:
+						self._service_producer()
+						self._service_receivers()
+				else:
+					producer = self.metrics.producer
+					next_time = None if interval is None else clock() + interval
+					next_bytes = byte_interval
+					while True:
+						self._service_producer()
+						self._service_receivers()
+						if (next_time is not None and clock() >= next_time) \
+						or (next_bytes is not None and producer.bytes >= next_bytes):
+							progress(self.metrics)
+							if next_time is not None:
+								next_time = clock() + interval
+							if next_bytes is not None:
+								next_bytes = producer.bytes + byte_interval
 			except StopIteration:
 				# It's done.
 				pass
+		if progress is not None:
+			progress(self.metrics)
 
 	def __iter__(self):
 		return self
@@ -826,16 +2037,615 @@ class CopyManager(Element, Iterator):
 		self._stats = (0, 0)
 		return current_stats
 
-def transfer(producer, *receivers):
+class _Outbox(object):
+	"""
+	Data pending for a receiver's socket.
+	"""
+	__slots__ = (
+		'receiver', 'socket', 'timeout', 'buffers', 'size', 'registered', 'metrics'
+	)
+
+	def __init__(self, receiver, socket, metrics):
+		self.receiver = receiver
+		self.socket = socket
+		self.metrics = metrics
+		self.timeout = socket.gettimeout()
+		self.buffers = deque()
+		self.size = 0
+		self.registered = False
+
+class FanOutCopyManager(CopyManager):
+	"""
+	A CopyManager that writes to the sockets of its protocol receivers, such as
+	`StatementReceiver` instances, without blocking.
+
+	The data for each of these receivers is buffered, and it is sent whenever
+	the receiver's socket is writable, so a slow receiver does not delay the
+	others until it has more than `buffer_limit` bytes pending. Then, the manager
+	waits for it while continuing to write to the other receivers, or, if
+	`drop_lagging` is `True`, the lagging receiver's connection is closed and the
+	receiver is added to `dropped`.
+
+	Other receivers are serviced as they are by `CopyManager`.
+	"""
+	#: Bytes that may be pending for a receiver before it is waited on or dropped.
+	buffer_limit = 1024 * 1024 * 4
+
+	def __init__(self, producer, *receivers,
+		buffer_limit = None, drop_lagging = False, **kw
+	):
+		super().__init__(producer, *receivers, **kw)
+		if buffer_limit is not None:
+			self.buffer_limit = buffer_limit
+		self.drop_lagging = drop_lagging
+		self.dropped = []
+		self._outboxes = {}
+		self._selector = None
+		self._exiting = False
+
+	def __enter__(self):
+		super().__enter__()
+		self._selector = selectors.DefaultSelector()
+		for x in self.receivers:
+			sock = getattr(getattr(x, 'send', None), '__self__', None)
+			if isinstance(sock, socket.socket):
+				o = _Outbox(x, sock, self.metrics.receiver(x))
+				sock.setblocking(False)
+				self._outboxes[x] = o
+		return self
+
+	def _send(self, o, would_block = _would_block, len = len, perf_counter = time.perf_counter):
+		"""
+		Send the pending data of the outbox until the socket would block.
+		"""
+		buffers = o.buffers
+		send = o.socket.send
+		start = perf_counter()
+		while buffers:
+			b = buffers[0]
+			try:
+				n = send(b)
+			except would_block:
+				break
+			o.size -= n
+			if n == len(b):
+				buffers.popleft()
+			else:
+				buffers[0] = memoryview(b)[n:]
+		o.metrics.blocked += perf_counter() - start
+		if buffers:
+			if not o.registered:
+				self._selector.register(o.socket, selectors.EVENT_WRITE, o)
+				o.registered = True
+		elif o.registered:
+			self._selector.unregister(o.socket)
+			o.registered = False
+
+	def _forget(self, o):
+		self.receivers.discard(o.receiver)
+		if o.registered:
+			self._selector.unregister(o.socket)
+			o.registered = False
+
+	def _drop(self, o):
+		self._forget(o)
+		del self._outboxes[o.receiver]
+		self.dropped.append(o.receiver)
+		# The receiver's COPY cannot be completed as the data may have been
+		# interrupted in the middle of a message.
+		try:
+			if isinstance(o.receiver, StatementReceiver):
+				o.receiver.statement.database.close()
+			else:
+				o.socket.close()
+		except Exception:
+			pass
+
+	def _wait(self, faults, lagging = (), perf_counter = time.perf_counter):
+		"""
+		Send to the writable sockets; the exceptions are added to `faults`.
+		The time spent waiting is attributed to the `lagging` outboxes.
+		"""
+		start = perf_counter()
+		ready = self._selector.select()
+		waited = perf_counter() - start
+		for o in lagging:
+			o.metrics.blocked += waited
+		for key, events in ready:
+			o = key.data
+			try:
+				self._send(o)
+			except Exception as err:
+				faults[o.receiver] = err
+				o.metrics.faults += 1
+				self._forget(o)
+
+	def _service_producer(self):
+		if not self.receivers:
+			raise StopIteration
+
+		# Pending data may refer to the producer's buffer after the next read.
+		self._transform(_detach(self.producer, self._read()))
+
+		outboxes = self._outboxes
+		for x in self.receivers:
+			data = self.transformer.get(x.protocol)
+			m = self._accepted(x)
+			o = outboxes.get(x)
+			if o is None or self._exiting:
+				x.accept(data)
+			elif data:
+				o.buffers.append(data)
+				o.size += len(data)
+				if o.size > m.high_water:
+					m.high_water = o.size
+
+	def _service_receivers(self, perf_counter = time.perf_counter):
+		faults = {}
+		outboxes = self._outboxes
+		receiver = self.metrics.receiver
+		for x in list(self.receivers):
+			o = outboxes.get(x)
+			try:
+				if o is None:
+					m = receiver(x)
+					start = perf_counter()
+					try:
+						x.transmit()
+					finally:
+						m.blocked += perf_counter() - start
+				else:
+					self._send(o)
+			except Exception as err:
+				faults[x] = err
+				receiver(x).faults += 1
+				if o is not None:
+					self._forget(o)
+
+		limit = self.buffer_limit
+		while True:
+			lagging = [
+				o for o in outboxes.values()
+				if o.size > limit and o.receiver in self.receivers
+			]
+			if not lagging:
+				break
+			if self.drop_lagging:
+				for o in lagging:
+					self._drop(o)
+				break
+			self._wait(faults, lagging)
+
+		if faults:
+			for x in faults:
+				self.receivers.discard(x)
+			raise ReceiverFault(self, faults)
+
+	def __exit__(self, typ, val, tb):
+		if self._selector is None:
+			# A receiver failed to enter.
+			return super().__exit__(typ, val, tb)
+		faults = {}
+		try:
+			if typ is None or issubclass(typ, Exception):
+				# Send the pending data before the receivers are finished.
+				while any(
+					o.buffers for o in self._outboxes.values()
+					if o.receiver in self.receivers
+				):
+					self._wait(faults)
+		finally:
+			self._exiting = True
+			for o in self._outboxes.values():
+				try:
+					o.socket.settimeout(o.timeout)
+				except Exception:
+					pass
+			self._selector.close()
+		if faults and typ is None:
+			for x in faults:
+				self.receivers.discard(x)
+			val = ReceiverFault(self, faults)
+			typ = ReceiverFault
+		return super().__exit__(typ, val, tb)
+
+	def reconcile(self, r):
+		super().reconcile(r)
+		o = self._outboxes.get(r)
+		if o is not None:
+			self._send(o)
+
+class ThreadedCopyManager(CopyManager):
+	"""
+	A CopyManager that transmits to each receiver on its own thread.
+
+	The producer is serviced by the thread using the manager, and the data is
+	given to the receivers' threads through queues of at most `queue_size`
+	entries, so reading from the producer overlaps with the transmissions.
+	Receiver faults are raised by the manager's thread once they are noticed,
+	and faulted receivers may be reconciled as with `CopyManager`; data that was
+	queued for a faulted receiver is transmitted after it is reconciled.
+	"""
+	#: Entries queued for each receiver.
+	queue_size = 8
+
+	def __init__(self, producer, *receivers, queue_size = None, **kw):
+		super().__init__(producer, *receivers, **kw)
+		if queue_size is not None:
+			self.queue_size = queue_size
+		self._lock = threading.Lock()
+		# receiver -> (queue, thread)
+		self._threads = {}
+		self._faults = {}
+		# receiver -> entry that could not be queued as it faulted
+		self._pending = {}
+
+	def _receive(self, receiver, queue, perf_counter = time.perf_counter):
+		get = queue.get
+		m = self.metrics.receiver(receiver)
+		try:
+			while True:
+				x = get()
+				if x is None:
+					break
+				data, rows = x
+				if receiver.throttle is not None:
+					m.throttled += receiver.throttle(_data_size(data), rows)
+				start = perf_counter()
+				try:
+					receiver.accept(data)
+					receiver.transmit()
+				finally:
+					m.blocked += perf_counter() - start
+		except Exception as err:
+			m.faults += 1
+			with self._lock:
+				self._faults[receiver] = err
+
+	def _start(self, receiver, queue):
+		t = threading.Thread(target = self._receive, args = (receiver, queue))
+		t.daemon = True
+		self._threads[receiver] = (queue, t)
+		t.start()
+
+	def _put(self, entry, data):
+		"""
+		Queue the data for a receiver's thread; `False` if the thread exited.
+		"""
+		queue, thread = entry
+		while True:
+			try:
+				queue.put(data, timeout = 0.1)
+				return True
+			except Full:
+				if not thread.is_alive():
+					return False
+
+	def _stop(self):
+		"""
+		Wait for the receivers' threads to transmit the queued data and exit.
+		"""
+		threads = self._threads
+		self._threads = {}
+		for entry in threads.values():
+			if entry[1].is_alive():
+				self._put(entry, None)
+		for queue, thread in threads.values():
+			thread.join()
+
+	def __enter__(self):
+		super().__enter__()
+		for x in self.receivers:
+			self._start(x, Queue(self.queue_size))
+		return self
+
+	def __exit__(self, typ, val, tb):
+		self._stop()
+		with self._lock:
+			faults = self._faults
+			self._faults = {}
+		if faults and typ is None:
+			for x in faults:
+				self.receivers.discard(x)
+			val = ReceiverFault(self, faults)
+			typ = ReceiverFault
+		return super().__exit__(typ, val, tb)
+
+	def reconcile(self, r):
+		entry = self._threads.get(r)
+		super().reconcile(r)
+		if entry is not None:
+			# Continue with the data queued while it was faulted, followed by
+			# the entry that did not fit in the queue when it faulted.
+			self._start(r, entry[0])
+			data = self._pending.pop(r, None)
+			if data is not None and not self._put(self._threads[r], data):
+				self._pending[r] = data
+
+	def _service_producer(self):
+		if not self.receivers:
+			raise StopIteration
+
+		# The producer's buffer is reused by the next read.
+		self._transform(_detach(self.producer, self._read()))
+
+		threads = self._threads
+		for x in self.receivers:
+			entry = threads.get(x)
+			# Throttled receivers wait on their own thread.
+			m = self._accepted(x, throttle = entry is None)
+			if entry is None:
+				x.accept(self.transformer.get(x.protocol))
+			else:
+				# A False return means the receiver faulted; the fault is
+				# raised by _service_receivers, and the entry is held
+				# until the receiver is reconciled.
+				data = (self.transformer.get(x.protocol), self._rows)
+				if not self._put(entry, data):
+					self._pending[x] = data
+				queued = entry[0].qsize()
+				if queued > m.high_water:
+					m.high_water = queued
+
+	def _service_receivers(self):
+		with self._lock:
+			faults = self._faults
+			self._faults = {}
+		if faults:
+			for x in faults:
+				self.receivers.discard(x)
+			raise ReceiverFault(self, faults)
+
+def transfer(producer, *receivers,
+	threaded = False, transform = None, throttle = None,
+	progress = None, interval = 1.0, byte_interval = None,
+):
 	"""
 	Perform a COPY operation using the given statements::
 
 		>>> import copyman
 		>>> copyman.transfer(src.prepare("COPY table TO STDOUT"), dst.prepare("COPY table FROM STDIN"))
+
+	If `threaded` is `True`, a `ThreadedCopyManager` is used so that reading
+	from the source overlaps with writing to the destinations. `transform` is
+	the manager's transform stage, such as a `TextTransform`, and `throttle` is
+	a `Throttle` limiting the rate the source is read at. `progress`,
+	`interval`, and `byte_interval` are given to `CopyManager.run`.
 	"""
-	cm = CopyManager(
-		StatementProducer(producer),
-		*[x if isinstance(x, Receiver) else StatementReceiver(x) for x in receivers]
+	sp = StatementProducer(producer)
+	sp.throttle = throttle
+	cm = (ThreadedCopyManager if threaded else CopyManager)(
+		sp,
+		*[x if isinstance(x, Receiver) else StatementReceiver(x) for x in receivers],
+		transform = transform
 	)
-	cm.run()
+	cm.run(progress = progress, interval = interval, byte_interval = byte_interval)
 	return (cm.producer.total_messages, cm.producer.total_bytes)
+
+def resume_transfer(source, *receivers,
+	buffer_size = 1024 * 1024,
+	threaded = False, progress = None, interval = 1.0, byte_interval = None,
+):
+	"""
+	Transfer the COPY data of `source` to the `BatchReceiver` instances, skipping
+	the data that each of them committed in an earlier run.
+
+	If `source` is a file path or a file object, it is read by a `FileProducer`
+	with the given `buffer_size` starting at the smallest offset committed by
+	the receivers, and each receiver discards the bytes before its own offset.
+	The file must not change between runs.
+
+	Otherwise, `source` is called with the smallest `last_key` of the receivers,
+	or `None` if one of them has not committed a row, and it must return a
+	``COPY ... TO STDOUT`` statement producing the text format rows with greater
+	keys in key order::
+
+		>>> copyman.resume_transfer(
+		...  lambda k: src.prepare(
+		...   "COPY (SELECT * FROM t WHERE id > %d ORDER BY id) TO STDOUT" %(
+		...    -1 if k is None else k,
+		...   )
+		...  ),
+		...  copyman.BatchReceiver(dst.prepare("COPY t FROM STDIN"),
+		...   checkpoint = cp, name = 'dst', key_column = 0),
+		... )
+
+	The receivers must have a `key_column`, and each discards the rows up to its
+	own `last_key`. `threaded`, `progress`, `interval`, and `byte_interval` are
+	used as they are by `transfer`.
+	"""
+	if isinstance(source, (str, bytes)) or hasattr(source, 'fileno'):
+		offset = min(x.bytes for x in receivers)
+		for x in receivers:
+			x.resume(offset)
+		producer = FileProducer(source, buffer_size = buffer_size, offset = offset)
+	else:
+		keys = [x.last_key for x in receivers]
+		key = None if None in keys else min(keys)
+		for x in receivers:
+			x.resume_after(key)
+		producer = StatementProducer(source(key))
+
+	cm = (ThreadedCopyManager if threaded else CopyManager)(producer, *receivers)
+	cm.run(progress = progress, interval = interval, byte_interval = byte_interval)
+	return (producer.total_messages, producer.total_bytes)
+
+def ctid_ranges(db, table, count):
+	"""
+	Divide the pages of `table` into at most `count` ranges, returning a list of
+	predicates selecting the rows of each range by ``ctid``.
+
+	The last range has no upper bound so that it includes the pages that are
+	added after the size of the table is read.
+	"""
+	blocks = db.sys.relation_blocks(table)
+	if blocks < 1 or count < 2:
+		return ['true']
+	step = -(-blocks // count)
+	bounds = list(range(step, blocks, step))
+	ranges = []
+	low = None
+	for high in bounds:
+		if low is None:
+			ranges.append("ctid < '(%d,0)'::tid" %(high,))
+		else:
+			ranges.append("ctid >= '(%d,0)'::tid AND ctid < '(%d,0)'::tid" %(low, high))
+		low = high
+	ranges.append("ctid >= '(%d,0)'::tid" %(low or 0,))
+	return ranges
+
+def _export_worker(connector, snapshot, work, receiver, results, failures):
+	db = connector()
+	try:
+		db.connect()
+		with db.xact(isolation = 'REPEATABLE READ', mode = 'READ ONLY'):
+			db.execute("SET TRANSACTION SNAPSHOT " + quote_literal(snapshot))
+			while not failures:
+				try:
+					index, predicate, sql = work.get_nowait()
+				except Empty:
+					break
+				r = receiver(index, predicate)
+				if not isinstance(r, Receiver):
+					r = CallReceiver(r)
+				results[index] = transfer(db.prepare(sql), r)
+	except BaseException as err:
+		failures.append(err)
+	finally:
+		db.close()
+
+def parallel_export(
+	connector : "`postgresql.api.Connector` used to establish the connections",
+	table : "the SQL name of the table",
+	ranges : "sequence of predicates dividing the rows of the table",
+	receiver : "callable returning the receiver of a range",
+	workers : "number of connections reading the ranges" = 4,
+	columns : "SQL select list" = '*',
+	options : "options given to COPY, e.g. ``'WITH BINARY'``" = '',
+	snapshot : "identifier of an exported snapshot" = None,
+):
+	"""
+	Export the rows of `table` using `workers` connections that read the same
+	snapshot, so the data of all the ranges is consistent.
+
+	Each of the `ranges` is an SQL predicate, such as those returned by
+	`ctid_ranges`, and the rows satisfying it are copied to the object returned
+	by ``receiver(index, predicate)``: a `Receiver`, or a callable that is given
+	lists of COPY lines. The ranges are taken by the connections as they finish
+	their previous range.
+
+	If `snapshot` is `None`, a connection holds a transaction open during the
+	export and its snapshot is exported using ``pg_export_snapshot()``.
+
+	Returns a list of the ``(messages, bytes)`` transferred for each range.
+	"""
+	if snapshot is None:
+		db = connector()
+		try:
+			db.connect()
+			with db.xact(isolation = 'REPEATABLE READ', mode = 'READ ONLY'):
+				return parallel_export(
+					connector, table, ranges, receiver,
+					workers = workers, columns = columns, options = options,
+					snapshot = db.sys.export_snapshot(),
+				)
+		finally:
+			db.close()
+
+	ranges = list(ranges)
+	work = Queue()
+	for index, predicate in enumerate(ranges):
+		work.put((index, predicate,
+			'COPY (SELECT %s FROM %s WHERE %s) TO STDOUT %s' %(
+				columns, table, predicate, options
+			)
+		))
+	results = [None] * len(ranges)
+	failures = []
+	threads = [
+		threading.Thread(
+			target = _export_worker,
+			args = (connector, snapshot, work, receiver, results, failures)
+		)
+		for x in range(min(workers, len(ranges)))
+	]
+	for x in threads:
+		x.start()
+	for x in threads:
+		x.join()
+	if failures:
+		raise failures[0]
+	return results
+
+def _restore_worker(connector, sql, decompress, work, totals, failures):
+	db = None
+	try:
+		db = connector()
+		db.connect()
+		ps = db.prepare(sql)
+		while True:
+			x = work.get()
+			if x is None:
+				break
+			if failures:
+				# Discard the remaining blocks.
+				continue
+			lines, size, data = x
+			ps.load_chunks([[decompress(data)]])
+			totals.append((lines, size))
+	except BaseException as err:
+		failures.append(err)
+		# Take the remaining blocks so the reader is not blocked.
+		while work.get() is not None:
+			pass
+	finally:
+		if db is not None:
+			db.close()
+
+def parallel_restore(
+	connector : "`postgresql.api.Connector` used to establish the connections",
+	archive : "path or binary file object of an archive written by `ArchiveReceiver`",
+	sql : "``COPY ... FROM STDIN`` statement loading the data",
+	workers : "number of connections loading the blocks" = 4,
+):
+	"""
+	Load the blocks of a COPY archive using `workers` connections at once.
+
+	Each block is decompressed by the thread of the connection that takes it
+	and loaded by its own execution of `sql`, so the blocks are committed
+	separately and the rows are not loaded in the order of the archive. The
+	archive must hold text or CSV data; binary data can only be restored using
+	an `ArchiveProducer`.
+
+	Returns the ``(lines, bytes)`` that were loaded.
+	"""
+	if isinstance(archive, (str, bytes)):
+		with open(archive, 'rb') as f:
+			return parallel_restore(connector, f, sql, workers = workers)
+
+	decompress = archive_codecs[_archive_codec(archive)][1]
+	work = Queue(workers * 2)
+	totals = []
+	failures = []
+	threads = [
+		threading.Thread(
+			target = _restore_worker,
+			args = (connector, sql, decompress, work, totals, failures)
+		)
+		for x in range(workers)
+	]
+	for x in threads:
+		x.start()
+	try:
+		for x in _archive_frames(archive):
+			if failures:
+				break
+			work.put(x)
+	finally:
+		for x in threads:
+			work.put(None)
+		for x in threads:
+			x.join()
+	if failures:
+		raise failures[0]
+	return (sum(x[0] for x in totals), sum(x[1] for x in totals))
@@ -10,6 +10,7 @@ apilevel = '2.0'
 
 from operator import itemgetter
 from functools import partial
+from collections import OrderedDict
 import datetime
 import time
 import re
@@ -18,6 +19,7 @@ from .. import clientparameters as pg_param
 from .. import driver as pg_driver
 from .. import types as pg_type
 from .. import string as pg_str
+from ..python.itertools import chunk
 from .pq3 import Connection
 
 ##
@@ -41,6 +43,7 @@ from postgresql.exceptions import \
 	SEARVError as ProgrammingError, \
 	IRError as OperationalError, \
 	DriverError as InterfaceError, \
+	FeatureError, \
 	Warning
 DatabaseError = Error
 class NotSupportedError(DatabaseError):
@@ -110,6 +113,12 @@ class Portal(object):
 		self.buf = []
 		return r
 
+	def close(self):
+		# A streaming portal outside of a transaction block
+		# commits its transaction when closed.
+		if getattr(self.chunks, 'closed', True) is False:
+			self.chunks.close()
+
 	def read(self, amount):
 		try:
 			while (len(self.buf) - self.pos) < amount:
@@ -128,6 +137,8 @@ class Cursor(object):
 	rowcount = -1
 	arraysize = 1
 	description = None
+	#: The number of executions sent per Sync by `executemany`.
+	executemany_chunksize = 256
 
 	def __init__(self, C):
 		self.database = self.connection = C
@@ -153,9 +164,10 @@ class Cursor(object):
 					source = 'CLIENT', creator = self.database
 				)
 			try:
-				del self.__portals[0]
+				p = self.__portals.pop(0)
 			except IndexError:
 				raise InterfaceError("no portal on stack")
+			p.close()
 		return locals()
 	_portal = property(**_portal())
 
@@ -174,11 +186,12 @@ class Cursor(object):
 			raise Error("cursor is closed",
 				source = 'CLIENT', creator = self.database)
 
-		p = self.database.prepare("SELECT %s(%s)" %(
+		sql = "SELECT %s(%s)" %(
 			proname, ','.join([
 				'$' + str(x) for x in range(1, len(args) + 1)
 			])
-		))
+		)
+		p = self.database._prepare_cached(sql, lambda x: (x, tuple, len(args)))[0]
 		self.__portals.insert(0, Portal(p.chunks(*args)))
 		return args
 
@@ -261,54 +274,90 @@ class Cursor(object):
 			raise Error("cursor is closed",
 				source = 'CLIENT', creator = self.database)
 
-		sql, pxf, nparams = self._convert_query(statement)
+		ps, pxf, nparams = self.database._prepare_cached(
+			statement, self._convert_query
+		)
 		if nparams != -1 and len(parameters) != nparams:
 			raise TypeError(
 				"statement require %d parameters, given %d" %(
 					nparams, len(parameters)
 				)
 			)
-		ps = self.database.prepare(sql)
-		c = ps.chunks(*pxf(parameters))
-		if ps._output is not None and len(ps._output) > 0:
-			# name, relationId, columnNumber, typeId, typlen, typmod, format
+		try:
+			c = ps.chunks(*pxf(parameters))
+			if ps._output is not None and len(ps._output) > 0:
+				# name, relationId, columnNumber, typeId, typlen, typmod, format
+				self.rowcount = -1
+				self.description = tuple([
+					(self.database.typio.decode(x[0]), dbapi_type(x[3]),
+					None, None, None, None, None)
+					for x in ps._output
+				])
+				self.__portals.insert(0, Portal(c))
+			else:
+				self.rowcount = c.count()
+				if self.rowcount is None:
+					self.rowcount = -1
+				self.description = None
+				# execute bumps any current portal
+				if self.__portals:
+					del self._portal
+		except FeatureError:
+			# Likely, "cached plan must not change result type";
+			# prepare the statement again next time.
+			self.database._uncache(statement)
+			raise
+		return self
+
+	def executemany(self, statement, parameters):
+		if self.__portals is None:
+			raise Error("cursor is closed",
+				source = 'CLIENT', creator = self.database)
+
+		ps, pxf, nparams = self.database._prepare_cached(
+			statement, self._convert_query
+		)
+		try:
+			if not ps._input:
+				# COPY FROM STDIN, or no parameters at all.
+				ps.load_rows(parameters)
+				self.rowcount = -1
+				return self
+
+			counts, rows = ps._execute_chunks(
+				chunk(map(pxf, parameters), self.executemany_chunksize)
+			)
+		except FeatureError:
+			# As with execute, prepare the statement again next time.
+			self.database._uncache(statement)
+			raise
+		if None in counts:
 			self.rowcount = -1
+		else:
+			self.rowcount = sum(counts)
+		if ps._output is not None and len(ps._output) > 0:
+			# RETURNING rows of all the executions.
 			self.description = tuple([
 				(self.database.typio.decode(x[0]), dbapi_type(x[3]),
 				None, None, None, None, None)
 				for x in ps._output
 			])
-			self.__portals.insert(0, Portal(c))
+			self.__portals.insert(0, Portal(iter((rows,))))
 		else:
-			self.rowcount = c.count()
-			if self.rowcount is None:
-				self.rowcount = -1
 			self.description = None
-			# execute bumps any current portal
 			if self.__portals:
 				del self._portal
 		return self
 
-	def executemany(self, statement, parameters):
-		if self.__portals is None:
-			raise Error("cursor is closed",
-				source = 'CLIENT', creator = self.database)
-
-		sql, pxf, nparams = self._convert_query(statement)
-		ps = self.database.prepare(sql)
-		if ps._input is not None:
-			ps.load_rows(map(pxf, parameters))
-		else:
-			ps.load_rows(parameters)
-		self.rowcount = -1
-		return self
-
 	def close(self):
 		if self.__portals is None:
 			raise Error("cursor is closed",
 				source = 'CLIENT', creator = self.database)
 		self.description = None
+		portals = self.__portals
 		self.__portals = None
+		for p in portals:
+			p.close()
 
 class Connection(Connection):
 	"""
@@ -324,6 +373,55 @@ class Connection(Connection):
 	DatabaseError = DatabaseError
 	NotSupportedError = NotSupportedError
 
+	# In autocommit mode, stream results in a transaction block
+	# instead of materializing a WITH HOLD cursor.
+	hold_cursors = False
+
+	#: The number of query strings whose converted SQL and prepared statement
+	#: are kept by the connection. Zero disables the cache.
+	statement_cache_size = 100
+	_statement_cache = None
+
+	def _prepare_cached(self, statement, convert):
+		"""
+		Get the prepared statement, parameter transformer, and parameter count
+		of the given DB-API query string.
+
+		The entries are kept in least recently used order. The eviction only
+		drops the reference, so the server-side statement is closed once any
+		cursors using it are gone.
+		"""
+		cache = self._statement_cache
+		if cache is not None:
+			entry = cache.get(statement)
+			if entry is not None:
+				if entry[0].closed is False:
+					cache.move_to_end(statement)
+					return entry
+				del cache[statement]
+
+		sql, pxf, nparams = convert(statement)
+		entry = (self.prepare(sql), pxf, nparams)
+
+		size = self.statement_cache_size
+		if size > 0:
+			if cache is None:
+				cache = self._statement_cache = OrderedDict()
+			cache[statement] = entry
+			while len(cache) > size:
+				cache.popitem(last = False)
+		return entry
+
+	def _uncache(self, statement):
+		if self._statement_cache is not None:
+			self._statement_cache.pop(statement, None)
+
+	def clear_statement_cache(self):
+		"""
+		Forget the cached statements.
+		"""
+		self._statement_cache = None
+
 	def autocommit_set(self, val):
 		if val:
 			# already in autocommit mode.
@@ -351,6 +449,7 @@ class Connection(Connection):
 	del autocommit_set, autocommit_get, autocommit_del
 
 	def connect(self, *args, **kw):
+		self._statement_cache = None
 		super().connect(*args, **kw)
 		self._xact = self.xact()
 		self._xact.start()
@@ -362,6 +461,7 @@ class Connection(Connection):
 				source = 'CLIENT',
 				creator = self
 			)
+		self._statement_cache = None
 		super().close()
 
 	def cursor(self):
@@ -5,8 +5,15 @@
 PG-API interface for PostgreSQL using PQ version 3.0.
 """
 import os
+import re
+import sys
+import struct
 import weakref
 import socket
+import mmap
+import tempfile
+from array import array
+from collections.abc import Sequence, Mapping
 from traceback import format_exception
 from itertools import repeat, chain, count
 from functools import partial
@@ -28,8 +35,9 @@ from .. import message as pg_msg
 from ..encodings.aliases import get_python_name
 from ..string import quote_ident
 
-from ..python.itertools import interlace, chunk
+from ..python.itertools import interlace, chunk, coalesce
 from ..python.socket import SocketFactory
+from ..python.structlib import ulong_pack, ulong_unpack, short_pack, null_sequence
 from ..python.functools import process_tuple, process_chunk
 from ..python.functools import Composition as compose
 
@@ -96,6 +104,28 @@ def declare_statement_string(
 		s += ' WITHOUT HOLD'
 	return s + ' FOR ' + statement_string
 
+# A plain, single table INSERT whose values are exactly the parameters.
+# load_rows(..., copy = True) routes these through COPY.
+_ident = r'(?:"(?:[^"]|"")+"|[^\W\d][\w$]*)'
+insert_values_re = re.compile(
+	r'^\s*INSERT\s+INTO\s+(?P<table>{0}(?:\s*\.\s*{0})?)\s*'
+	r'(?P<columns>\(\s*{0}(?:\s*,\s*{0})*\s*\))?\s*'
+	r'VALUES\s*\((?P<values>\s*\$\d+(?:\s*,\s*\$\d+)*\s*)\)\s*;?\s*$'.format(_ident),
+	re.IGNORECASE
+)
+del _ident
+
+##
+# Parameter packers that can be applied to a whole column at once by struct:
+# (struct format code, size, array typecodes with the same representation)
+column_pack_formats = {
+	io_lib.short_pack : ('h', 2, 'h'),
+	io_lib.long_pack : ('l', 4, 'il'),
+	io_lib.longlong_pack : ('q', 8, 'lq'),
+	io_lib.float_pack : ('f', 4, 'f'),
+	io_lib.double_pack : ('d', 8, 'd'),
+}
+
 def direction_str_to_bool(str):
 	s = str.upper()
 	if s == 'FORWARD':
@@ -1037,6 +1067,57 @@ class MultiXactInsideBlock(MultiXactStream):
 		return self._pq_xp_execute(self.chunksize) + \
 			(element.SynchronizeMessage,)
 
+##
+# The cursor is streamed to the client on demand inside of a
+# transaction block started by the driver for the purpose.
+#
+# Used outside of transaction blocks when the connection's
+# hold_cursors is False. DECLARE ... WITH HOLD materializes the entire
+# result at commit, so the first row is not seen until the last row
+# is produced. The transaction is committed once the cursor is
+# exhausted or closed.
+class MultiXactDriverBlock(MultiXactInsideBlock):
+	_block = False
+
+	def _bind(self):
+		self._block = True
+		return (
+			element.Parse(b'', b'BEGIN', ()),
+			element.Bind(b'', b'', (), (), ()),
+			element.Execute(b'', 1),
+		) + self._pq_xp_bind()
+
+	def __next__(self):
+		try:
+			return super().__next__()
+		except StopIteration:
+			raise
+		except:
+			if not self.database.closed:
+				self.close()
+			raise
+
+	def close(self):
+		if self._block is not True:
+			return super().close()
+		self._block = False
+		self.closed = True
+		db = self.database
+		# The end of the transaction closes the portal,
+		# so don't send a Close for it as well.
+		db.pq.cursors.pop(self._pq_cursor_id, None)
+		if db.pq.xact is not None and db.pq.xact is self._xact:
+			# Unread rows; there is no interest in them or their errors.
+			db.pq.complete()
+		self._xact = None
+		if db.closed:
+			return
+		state = db.pq.state
+		if state == b'T':
+			db.execute('COMMIT')
+		elif state == b'E':
+			db.execute('ROLLBACK')
+
 ##
 # The cursor is streamed to the client on demand *outside* of
 # a single SQL transaction block. [DECLARE ... WITH HOLD]
@@ -1056,10 +1137,19 @@ class MultiXactOutsideBlock(MultiXactStream):
 
 ##
 # Cursor is used to manage scrollable cursors.
+#
+# next() and small reads are served from a read-ahead window of `chunksize`
+# rows. While the window holds unread rows, the server-side position is ahead
+# of the position seen by the user; _discard_window() produces the MOVE needed
+# to bring the server back before any other operation is performed.
 class Cursor(Output, pg_api.Cursor):
+	#: Number of rows fetched at once to serve ``next()`` and ``read()``
+	#: calls requesting fewer rows. Values less than two disable read-ahead.
+	chunksize = 256
 	_process_tuple = Output._process_tuple_chunk_Row
 	def _e_metas(self):
 		yield ('direction', 'FORWARD' if self.direction else 'BACKWORD')
+		yield ('chunksize', self.chunksize)
 		yield ('type', 'Cursor')
 
 	def clone(self):
@@ -1070,6 +1160,7 @@ class Cursor(Output, pg_api.Cursor):
 		self.statement = statement
 		self.parameters = parameters
 		self.__dict__['direction'] = True
+		self._reset_window()
 		if self.statement is None:
 			self._e_factors = ('database', 'cursor_id')
 		Output.__init__(self, cursor_id or ID(self))
@@ -1127,8 +1218,71 @@ class Cursor(Output, pg_api.Cursor):
 						x or typio.decode for x in self._output_io
 					])
 
+	def close(self):
+		self._reset_window()
+		super().close()
+
+	def _reset_window(self):
+		"""
+		Forget the read-ahead window without adjusting the server-side
+		position. Used when the position is about to be set absolutely or
+		when the server's position already matches the user's.
+		"""
+		self._window = ()
+		self._window_offset = 0
+		self._window_direction = None
+		self._window_exhausted = False
+
+	def _discard_window(self):
+		"""
+		Forget the read-ahead window and return the commands that move the
+		server-side position back to the last row given to the user.
+		"""
+		distance = len(self._window) - self._window_offset
+		if self._window_exhausted:
+			# The FETCH ran off the end of the cursor, so the server
+			# is positioned one past the last row in the window.
+			distance += 1
+		direction = self._window_direction
+		self._reset_window()
+		if distance:
+			return self._pq_xp_move(
+				str(distance).encode('ascii'),
+				b'BACKWARD' if direction else b'FORWARD'
+			)
+		return ()
+
+	def _read_window(self, direction, quantity):
+		"""
+		Read `quantity` rows in the given `direction` using the read-ahead
+		window, refilling it as needed.
+		"""
+		r = []
+		while len(r) < quantity:
+			if self._window_direction is not direction or (
+				self._window_offset == len(self._window) and \
+				not self._window_exhausted
+			):
+				# Direction changed or the window was fully consumed.
+				rows = self._fetch(direction, self.chunksize)
+				self._window = rows
+				self._window_direction = direction
+				self._window_exhausted = len(rows) < self.chunksize
+			offset = self._window_offset
+			rows = self._window[offset:offset + quantity - len(r)]
+			if not rows:
+				# End of the cursor; the server is past the last row as well.
+				self._reset_window()
+				break
+			self._window_offset = offset + len(rows)
+			r.extend(rows)
+		return r
+
 	def __next__(self):
-		result = self._fetch(self.direction, 1)
+		if self.chunksize > 1:
+			result = self._read_window(self.direction, 1)
+		else:
+			result = self._fetch(self.direction, 1)
 		if not result:
 			raise StopIteration
 		else:
@@ -1138,10 +1292,25 @@ class Cursor(Output, pg_api.Cursor):
 		if quantity == 0:
 			return []
 		dir = self._which_way(direction)
+		if quantity is not None and quantity < self.chunksize:
+			return self._read_window(dir, quantity)
+
+		if dir is self._window_direction:
+			# Large read in the window's direction; the server is already
+			# positioned at the end of the window, so take what's left of it
+			# and continue from there.
+			head = list(self._window[self._window_offset:])
+			self._reset_window()
+			if quantity is not None:
+				quantity -= len(head)
+				if quantity == 0:
+					return head
+			return head + self._fetch(dir, quantity)
 		return self._fetch(dir, quantity)
 
 	def _fetch(self, direction, quantity):
 		x = self._ins(
+			self._discard_window() + \
 			self._pq_xp_fetch(direction, quantity) + \
 			(element.SynchronizeMessage,)
 		)
@@ -1151,6 +1320,22 @@ class Cursor(Output, pg_api.Cursor):
 			y for y in x.messages_received() if y.__class__ is tuple
 		))
 
+	def _seek_window(self, distance, count):
+		"""
+		Reposition inside the read-ahead window when the row `distance` rows
+		away(server direction) is held by the window. Returns `count` on
+		success and `None` when the window cannot satisfy the seek.
+		"""
+		if not distance or self._window_direction is None:
+			return None
+		if self._window_direction is False:
+			distance = -distance
+		position = self._window_offset - 1 + distance
+		if 0 <= position < len(self._window):
+			self._window_offset = position + 1
+			return count
+		return None
+
 	def seek(self, offset, whence = 'ABSOLUTE'):
 		rwhence = self._seek_whence_map.get(whence, whence)
 		if rwhence is None or rwhence.upper() not in \
@@ -1180,6 +1365,18 @@ class Cursor(Output, pg_api.Cursor):
 						rwhence = 'ABSOLUTE'
 
 		if rwhence in ('RELATIVE', 'BACKWARD', 'FORWARD'):
+			if offset != 'ALL':
+				# Try to stay inside the read-ahead window.
+				# The counts mirror the ones the MOVE would report.
+				if rwhence == 'BACKWARD':
+					count = self._seek_window(-offset, offset)
+				elif rwhence == 'FORWARD' or offset < 0:
+					count = self._seek_window(offset, abs(offset))
+				else:
+					count = self._seek_window(offset, 1)
+				if count is not None:
+					return count
+
 			if offset == 'ALL':
 				cmd = self._pq_xp_move(
 					str(offset).encode('ascii'), str(rwhence).encode('ascii')
@@ -1193,29 +1390,231 @@ class Cursor(Output, pg_api.Cursor):
 					cmd = self._pq_xp_move(
 						str(offset).encode('ascii'), str(rwhence).encode('ascii')
 					)
+			# Relative to the user's position, not the window's end.
+			correction = self._discard_window()
 		elif rwhence == 'ABSOLUTE':
 			cmd = self._pq_xp_move(str(offset).encode('ascii'), b'ABSOLUTE')
+			correction = ()
+			self._reset_window()
 		else:
 			# move to last record, then consume it to put the position at
 			# the very end of the cursor.
 			cmd = self._pq_xp_move(b'', b'LAST') + \
 				self._pq_xp_move(b'', b'NEXT') + \
 				self._pq_xp_move(str(offset).encode('ascii'), b'BACKWARD')
+			correction = ()
+			self._reset_window()
 
-		x = self._ins(cmd + (element.SynchronizeMessage,),)
+		x = self._ins(correction + cmd + (element.SynchronizeMessage,),)
 		self.database._pq_push(x, self)
 		self.database._pq_complete()
 
 		count = None
+		# Skip the completion of the correcting MOVE, if any.
+		skip = 1 if correction else 0
 		complete = element.Complete.type
 		for cm in x.messages_received():
 			if getattr(cm, 'type', None) == complete:
+				if skip:
+					skip -= 1
+					continue
 				count = cm.extract_count()
 				break
 
 		# XXX: Raise if count is None?
 		return count
 
+##
+# SpooledRows - Result of Statement.__call__() that exceeded spool_threshold.
+#
+# Raw tuple data is written to a temporary file in the DataRow field format;
+# [ulong length or 0xFFFFFFFF][data]. The offset of every `stride`th row is
+# kept so that indexing only has to scan a few rows of the memory map.
+class SpooledRows(Sequence):
+	"""
+	Sequence of rows held in a temporary file. Rows are decoded on access.
+
+	Created by `Statement.__call__` when the raw size of the result exceeds the
+	statement's ``spool_threshold``.
+	"""
+	stride = 64
+
+	def __init__(self, unpack_row, ncolumns, threshold):
+		self._unpack_row = unpack_row
+		self._columns = range(ncolumns)
+		self.threshold = threshold
+		self._chunks = []
+		self._size = 0
+		self._count = 0
+		self._file = None
+		self._map = None
+		self._position = 0
+		self._offsets = array('Q')
+		self.closed = False
+
+	def __len__(self):
+		return self._count
+
+	def _view(self):
+		if self.closed:
+			raise RuntimeError("cannot read rows from a closed spool")
+		return memoryview(self._map)
+
+	def __repr__(self):
+		return '<{mod}.{name} {count} rows, {size} bytes>'.format(
+			mod = type(self).__module__,
+			name = type(self).__name__,
+			count = self._count,
+			size = self._position,
+		)
+
+	def _write(self, chunk,
+		ulong_pack = ulong_pack,
+		null_sequence = null_sequence,
+		len = len,
+	):
+		parts = []
+		append = parts.append
+		position = self._position
+		stride = self.stride
+		offsets = self._offsets
+		i = self._count
+		for row in chunk:
+			if not i % stride:
+				offsets.append(position)
+			i += 1
+			for v in row:
+				if v is None:
+					append(null_sequence)
+					position += 4
+				else:
+					append(ulong_pack(len(v)))
+					append(v)
+					position += 4 + len(v)
+		self._file.write(b''.join(parts))
+		self._position = position
+		self._count = i
+
+	def extend(self, chunk,
+		sum = sum, map = map, len = len, filter = filter,
+		from_iterable = chain.from_iterable,
+	):
+		"""
+		Add a chunk of raw tuples(tuples of `bytes` or `None`) to the spool.
+		"""
+		if self._map is not None:
+			raise RuntimeError("cannot extend a finished spool")
+		if self._file is not None:
+			self._write(chunk)
+			return
+		self._chunks.append(chunk)
+		self._size += sum(map(len, filter(None, from_iterable(chunk))))
+		if self._size > self.threshold:
+			# Too large for memory; move everything to disk.
+			self._file = tempfile.TemporaryFile()
+			for x in self._chunks:
+				self._write(x)
+			del self._chunks[:]
+
+	def finish(self):
+		"""
+		Complete the spool. If the threshold was never exceeded, a `list` of
+		the decoded rows is returned; otherwise, the spool itself.
+		"""
+		if self._file is None:
+			unpack_row = self._unpack_row
+			return [unpack_row(x) for x in chain.from_iterable(self._chunks)]
+		self._file.flush()
+		self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+		return self
+
+	def close(self):
+		"""
+		Release the memory map and the temporary file. The rows can no longer be
+		read.
+		"""
+		self.closed = True
+		if self._map is not None:
+			self._map.close()
+			self._map = None
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+		self._count = 0
+
+	def _read_row(self, view, position,
+		ulong_unpack = ulong_unpack,
+		null_field = 0xFFFFFFFF,
+	):
+		# Read one raw row at `position`; return it with the next position.
+		r = []
+		append = r.append
+		for x in self._columns:
+			l = ulong_unpack(view[position:position+4])
+			position += 4
+			if l == null_field:
+				append(None)
+			else:
+				append(view[position:position+l].tobytes())
+				position += l
+		return tuple(r), position
+
+	def _skip_row(self, view, position,
+		ulong_unpack = ulong_unpack,
+		null_field = 0xFFFFFFFF,
+	):
+		for x in self._columns:
+			l = ulong_unpack(view[position:position+4])
+			position += 4
+			if l != null_field:
+				position += l
+		return position
+
+	def __iter__(self):
+		view = self._view()
+		try:
+			position = 0
+			read_row = self._read_row
+			unpack_row = self._unpack_row
+			for x in range(self._count):
+				raw, position = read_row(view, position)
+				yield unpack_row(raw)
+		finally:
+			view.release()
+
+	def __getitem__(self, index):
+		if self.closed:
+			raise RuntimeError("cannot read rows from a closed spool")
+		if index.__class__ is slice:
+			return [self[i] for i in range(*index.indices(self._count))]
+		if index < 0:
+			index += self._count
+		if not 0 <= index < self._count:
+			raise IndexError("spooled row index out of range")
+		base, skip = divmod(index, self.stride)
+		view = self._view()
+		try:
+			position = self._offsets[base]
+			for x in range(skip):
+				position = self._skip_row(view, position)
+			raw, position = self._read_row(view, position)
+		finally:
+			view.release()
+		return self._unpack_row(raw)
+
+	def __eq__(self, ob):
+		if isinstance(ob, (list, tuple, SpooledRows)):
+			return len(self) == len(ob) and all(
+				x == y for x, y in zip(self, ob)
+			)
+		return NotImplemented
+
+	def __ne__(self, ob):
+		r = self.__eq__(ob)
+		return r if r is NotImplemented else not r
+
+	__hash__ = None
+
 class SingleExecution(pg_api.Execution):
 	database = None
 	def __init__(self, database):
@@ -1249,6 +1648,18 @@ class Statement(pg_api.Statement):
 	string = None
 	database = None
 	statement_id = None
+	#: Raw byte size beyond which `__call__` spools the result to a temporary
+	#: file and returns `SpooledRows` instead of a `list`. `None` disables.
+	spool_threshold = None
+	#: Bytes of COPY lines joined into each CopyData message sent by
+	#: `load_chunks`. `None` sends a message for each line.
+	copy_message_size = 1024 * 128
+	#: Seconds COPY lines are held for a CopyData message before it is sent
+	#: regardless of its size. `None` holds the lines until the size is reached.
+	copy_flush_delay = 1.0
+	# COPY statement used by load_chunks(..., copy = True);
+	# `None` when unchecked, `False` when the statement is not eligible.
+	_copy = None
 	_input = None
 	_output = None
 	_output_io = None
@@ -1577,12 +1988,26 @@ class Statement(pg_api.Statement):
 			cmd = c.command()
 			if cmd is not None:
 				return (cmd, c.count())
+
+		if self.spool_threshold is not None and self._output_io:
+			# Keep the raw tuples; the spool decodes them.
+			c._process_chunk = tuple
+			r = SpooledRows(self._unpack_row, len(self._output_io), self.spool_threshold)
+			for x in c:
+				r.extend(x)
+			return r.finish()
+
 		# Returns rows, accumulate in a list.
 		r = []
 		for x in c:
 			r.extend(x)
 		return r
 
+	def _unpack_row(self, raw, process_tuple = process_tuple):
+		return self._row_constructor(
+			process_tuple(self._output_io, raw, self._raise_column_tuple_error)
+		)
+
 	def declare(self, *parameters):
 		if self.closed is None:
 			self._fini()
@@ -1613,6 +2038,10 @@ class Statement(pg_api.Statement):
 			# It's *probably* a COPY.
 			return SingleXactCopy(self, parameters)
 		if self.database.pq.state == b'I':
+			if not self.database.hold_cursors:
+				# Stream the rows inside a transaction block
+				# managed by the cursor.
+				return MultiXactDriverBlock(self, parameters, None)
 			# Currently, *not* in a Transaction block, so
 			# DECLARE the statement WITH HOLD in order to allow
 			# access across transactions.
@@ -1760,6 +2189,8 @@ class Statement(pg_api.Statement):
 			))
 			self.database.typio.raise_client_error(x.error_message, creator = self)
 
+		if self.copy_message_size is not None:
+			chunks = coalesce(chunks, self.copy_message_size, self.copy_flush_delay)
 		for chunk in chunks:
 			x.messages = list(chunk)
 			while x.messages is not x.CopyFailSequence:
@@ -1772,13 +2203,36 @@ class Statement(pg_api.Statement):
 		self.database._pq_complete()
 		self.database.pq.synchronize()
 
-	def _load_tuple_chunks(self, chunks, tuple=tuple):
+	def _load_tuple_chunks(self, chunks, collect = None, tuple=tuple):
 		pte = self._raise_parameter_tuple_error
+		io = self._input_io
+		return self._load_packed_chunks((
+				[process_tuple(io, tuple(t), pte) for t in chunk]
+				for chunk in chunks
+			), collect = collect
+		)
+
+	def _load_packed_chunks(self, chunks, collect = None):
+		"""
+		Execute the statement for each sequence of packed parameters in the
+		chunks produced by the iterable.
+
+		If `collect` is not `None`, it is called with the protocol transaction
+		of each chunk once it is complete, and all the rows produced by each
+		execution are requested.
+		"""
 		last = (element.SynchronizeMessage,)
 
 		Bind = element.Bind
 		Instruction = xact.Instruction
 		Execute = element.Execute
+		if collect is None:
+			limit = 1
+			formats = ()
+		else:
+			limit = 0xFFFFFFFF
+			formats = self._output_formats or ()
+		previous = None
 
 		try:
 			for chunk in chunks:
@@ -1788,24 +2242,26 @@ class Statement(pg_api.Statement):
 							b'',
 							self._pq_statement_id,
 							self._input_formats,
-							process_tuple(
-								self._input_io, tuple(t), pte
-							),
-							(),
+							t, formats,
 						),
-						Execute(b'', 1),
+						Execute(b'', limit),
 					)
 					for t in chunk
 				]
 				bindings.append(last)
-				self.database._pq_push(
-					Instruction(
-						chain.from_iterable(bindings),
-						asynchook = self.database._receive_async
-					),
-					self
+				x = Instruction(
+					chain.from_iterable(bindings),
+					asynchook = self.database._receive_async
 				)
+				# Pushing completes the previous chunk's transaction.
+				self.database._pq_push(x, self)
+				if collect is not None:
+					if previous is not None:
+						collect(previous)
+					previous = x
 			self.database._pq_complete()
+			if previous is not None:
+				collect(previous)
 		except:
 			##
 			# In cases where row packing errors or occur,
@@ -1820,22 +2276,220 @@ class Statement(pg_api.Statement):
 			self.database.pq.synchronize()
 			raise
 
-	def load_chunks(self, chunks, *parameters):
+	def _execute_chunks(self, chunks, tuple = tuple):
+		"""
+		Execute the statement for each parameter tuple in the chunks; return
+		the command count of each execution and the rows produced by them.
+
+		The executions of a chunk are sent with one Sync, as they are by
+		`load_chunks`.
+		"""
+		if self.closed is None:
+			self._fini()
+		counts = []
+		rows = []
+		complete = element.Complete.type
+		def collect(x):
+			for m in x.messages_received():
+				if m.__class__ is tuple:
+					rows.append(m)
+				elif getattr(m, 'type', None) == complete:
+					counts.append(m.extract_count())
+		self._load_tuple_chunks(chunks, collect = collect)
+
+		if self._output_io and rows:
+			rc = self._row_constructor
+			rows = [
+				rc(x) for x in process_chunk(
+					self._output_io, rows, self._raise_column_tuple_error
+				)
+			]
+		return counts, rows
+
+	def _copy_statement(self, match = insert_values_re.match):
+		"""
+		Return a ``COPY ... FROM STDIN WITH BINARY`` statement equivalent to
+		the statement, or `None` if the statement is not a plain INSERT of its
+		parameters into a table that COPY loads the same way.
+		"""
+		if self._copy is None:
+			self._copy = False
+			m = match(str(self.string)) if self.string is not None else None
+			if m is not None:
+				values = [int(x.strip()[1:]) for x in m.group('values').split(',')]
+				target = self.database.sys.copy_target(m.group('table'))
+				if values == list(range(1, len(self._input) + 1)) \
+				and target['copyable'] \
+				and (m.group('columns') or target['natts'] == len(values)):
+					self._copy = self.database.prepare(
+						'COPY ' + m.group('table') + ' ' + (m.group('columns') or '') + \
+						' FROM STDIN WITH BINARY'
+					)
+		return self._copy or None
+
+	def _binary_copy_data(self, chunks, tuple = tuple):
+		"""
+		Generate chunks of COPY BINARY data from the row chunks using the
+		parameter packers; one CopyData message per chunk.
+		"""
+		pte = self._raise_parameter_tuple_error
+		io = self._input_io
+		return self._binary_copy_packed(
+			(process_tuple(io, tuple(t), pte) for t in chunk)
+			for chunk in chunks
+		)
+
+	def _binary_copy_packed(self, chunks,
+		header = b'PGCOPY\n\xff\r\n\x00' + (b'\x00' * 8),
+		trailer = b'\xff\xff',
+		ulong_pack = ulong_pack,
+		null_sequence = null_sequence,
+		len = len,
+	):
+		"""
+		Generate chunks of COPY BINARY data from chunks of packed parameters.
+		"""
+		field_count = short_pack(len(self._input_io))
+		parts = [header]
+		for chunk in chunks:
+			append = parts.append
+			for t in chunk:
+				append(field_count)
+				for v in t:
+					if v is None:
+						append(null_sequence)
+					else:
+						append(ulong_pack(len(v)))
+						append(v)
+			if parts:
+				yield (b''.join(parts),)
+				parts = []
+		parts.append(trailer)
+		yield (b''.join(parts),)
+
+	def _load_binary_copy_chunks(self, copy, data):
+		try:
+			copy._load_copy_chunks(data)
+		except:
+			##
+			# Same as _load_tuple_chunks; finish the COPY (CopyFail)
+			# and raise the original error.
+			self.database.pq.synchronize()
+			raise
+
+	def load_chunks(self, chunks, *parameters, copy = False):
 		"""
 		Execute the query for each row-parameter set in `iterable`.
 
 		In cases of ``COPY ... FROM STDIN``, iterable must be an iterable of
 		sequences of `bytes`.
+
+		If `copy` is `True` and the statement is a plain ``INSERT INTO table
+		[(columns)] VALUES ($1, ..., $n)``, the rows are sent using
+		``COPY ... FROM STDIN WITH BINARY``. Otherwise, `copy` is ignored.
 		"""
 		if self.closed is None:
 			self._fini()
 		if not self._input or parameters:
 			return self._load_copy_chunks(chunks)
-		else:
-			return self._load_tuple_chunks(chunks)
+		if copy:
+			cs = self._copy_statement()
+			if cs is not None:
+				return self._load_binary_copy_chunks(cs, self._binary_copy_data(chunks))
+		return self._load_tuple_chunks(chunks)
+
+	def load_rows(self, rows, chunksize = 256, copy = False):
+		return self.load_chunks(chunk(rows, chunksize), copy = copy)
+
+	def _pack_column(self, index, columns, start, stop,
+		formats = column_pack_formats,
+		array = array,
+		Struct = struct.Struct,
+		swap = (sys.byteorder == 'little'),
+	):
+		"""
+		Pack the `start`:`stop` slice of the parameter column at `index`.
+		"""
+		pack = self._input_io[index]
+		values = columns[index][start:stop]
+		fmt = formats.get(pack)
+		if fmt is not None:
+			code, size, typecodes = fmt
+			try:
+				if values.__class__ is array:
+					if values.typecode in typecodes and values.itemsize == size:
+						# Slices of arrays are copies, so swap in place.
+						if swap:
+							values.byteswap()
+						data = values.tobytes()
+					else:
+						data = Struct('!%d%s' %(len(values), code)).pack(*values)
+				elif None in values:
+					data = None
+				else:
+					data = Struct('!%d%s' %(len(values), code)).pack(*values)
+			except (struct.error, TypeError, OverflowError):
+				# Let the parameter's packer identify the failure.
+				data = None
+			if data is not None:
+				return [data[x:x+size] for x in range(0, len(data), size)]
+
+		try:
+			return [None if v is None else pack(v) for v in values]
+		except Exception:
+			pass
+		for offset, v in enumerate(values):
+			if v is not None:
+				try:
+					pack(v)
+				except Exception as err:
+					row = tuple([c[start + offset] for c in columns])
+					self._raise_parameter_tuple_error(err, self._input_io, row, index)
+		raise RuntimeError("failed to identify the parameter that could not be packed")
+
+	def _column_chunks(self, columns, chunksize):
+		nrows = len(columns[0]) if columns else 0
+		for c in columns:
+			if len(c) != nrows:
+				raise ValueError("columns must have the same length")
+		pack = self._pack_column
+		indexes = range(len(columns))
+		for start in range(0, nrows, chunksize):
+			stop = start + chunksize
+			yield zip(*[pack(i, columns, start, stop) for i in indexes])
+
+	def load_columns(self, columns, chunksize = 256, copy = False):
+		"""
+		Execute the statement for each row of the given parameter columns.
+
+		`columns` is a sequence of columns, or a mapping of parameter indexes to
+		columns. The columns are sequences of equal length; `array.array`
+		instances, memoryviews, or lists.
 
-	def load_rows(self, rows, chunksize = 256):
-		return self.load_chunks(chunk(rows, chunksize))
+		The columns are packed in bulk, `chunksize` rows at a time, rather
+		than row by row. `copy` has the same meaning as it has for
+		`load_chunks`.
+		"""
+		if self.closed is None:
+			self._fini()
+		if self._input is None:
+			raise TypeError(
+				"load_columns requires the statement's parameter descriptions"
+			)
+		if isinstance(columns, Mapping):
+			columns = [columns[i] for i in range(len(self._input))]
+		else:
+			columns = list(columns)
+		if len(columns) != len(self._input):
+			raise TypeError("statement requires %d parameter columns, given %d" %(
+				len(self._input), len(columns)
+			))
+		chunks = self._column_chunks(columns, chunksize)
+		if copy:
+			cs = self._copy_statement()
+			if cs is not None:
+				return self._load_binary_copy_chunks(cs, self._binary_copy_packed(chunks))
+		return self._load_packed_chunks(chunks)
 PreparedStatement = Statement
 
 class StoredProcedure(pg_api.StoredProcedure):
@@ -2259,6 +2913,12 @@ class Connection(pg_api.Connection):
 	# Replaced with instances on connection instantiation.
 	settings = Settings
 
+	#: Whether chunks(), rows(), and column() used outside of a transaction
+	#: block DECLARE a cursor WITH HOLD. When `False`, the rows are streamed
+	#: inside a transaction block that is committed when the cursor is
+	#: exhausted or closed.
+	hold_cursors = True
+
 	def _e_metas(self):
 		yield (None, '[' + self.state + ']')
 		if self.client_address is not None:
@@ -2595,6 +3255,10 @@ class Connection(pg_api.Connection):
 				self.typio.raise_error(x.error_message)
 		if controller is not None:
 			self._controller = controller
+		if self._pq_watchers:
+			# Messages may be read beyond the results of the transaction.
+			for x in self._pq_watchers:
+				x._queried.add(self)
 		self.pq.push(xact)
 
 	# Complete the current protocol transaction.
@@ -2622,6 +3286,25 @@ class Connection(pg_api.Connection):
 					self.typio.raise_error(x.error_message, cause = getattr(x, 'exception', None))
 				del self._controller
 
+	# Process the asynchronous messages that have arrived without sending a
+	# query; received NOTIFYs are appended to _notifies.
+	def _pq_drain(self):
+		pq = self.pq
+		x = pq.xact
+		if x is not None:
+			pq.complete()
+			if x.fatal is not None:
+				self.typio.raise_error(x.error_message, cause = getattr(x, 'exception', None))
+		x = xact.Asynchronous(self._receive_async)
+		pq.drain(x)
+		if x.fatal is not None:
+			self.typio.raise_error(x.error_message, cause = getattr(x, 'exception', None))
+
+	# Whether messages have been received, but not processed.
+	def _pq_pending(self):
+		pq = self.pq
+		return bool(pq.read) or pq.message_buffer.has_message()
+
 	def _receive_async(self,
 		msg, controller = None,
 		showoption = element.ShowOption.type,
@@ -2716,6 +3399,8 @@ class Connection(pg_api.Connection):
 		self.connector = connector
 		# raw notify messages
 		self._notifies = []
+		# NotificationManagers to tell when a protocol transaction is started.
+		self._pq_watchers = weakref.WeakSet()
 		self.fileno = -1
 		self.typio = self.connector.driver.typio(self)
 		self.typio.set_encoding('ascii')
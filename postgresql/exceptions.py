@@ -111,6 +111,9 @@ class InsecurityError(DriverError, Disconnection):
 class ConnectTimeoutError(DriverError, Disconnection):
 	'Client was unable to esablish a connection in the given time'
 	code = '--TOE'
+class PoolTimeoutError(DriverError):
+	'Client was unable to acquire a pooled connection in the given time'
+	code = '--PTO'
 
 class TypeIOError(DriverError):
 	"""
@@ -251,6 +251,29 @@ SELECT SUM(pg_catalog.pg_database_size(datname))::bigint FROM pg_database
 [sizeof_relation::first]
 SELECT pg_catalog.pg_relation_size($1::text)::bigint
 
+[copy_target::first]
+-- Whether COPY FROM has the same effect as INSERT on the relation.
+SELECT
+ c.relkind IN ('r', 'p') AND NOT c.relhasrules AS copyable,
+ (
+  SELECT COUNT(*) FROM pg_catalog.pg_attribute a
+  WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+ )::int AS natts
+FROM pg_catalog.pg_class c
+WHERE c.oid = $1::text::regclass
+
+[relation_blocks::first]
+SELECT
+ (pg_catalog.pg_relation_size($1::text) /
+  pg_catalog.current_setting('block_size')::int)::bigint
+
+[export_snapshot:transient:first]
+SELECT pg_catalog.pg_export_snapshot()
+
+[is_in_recovery:transient:first]
+-- Whether the server is a standby.
+SELECT pg_catalog.pg_is_in_recovery()
+
 [pg_reload_conf:transient:]
 SELECT pg_reload_conf()
 
@@ -20,8 +20,8 @@ iterator for a NOTIFY event loop against a set of connections.
 	...   ...
 """
 from time import time
-from select import select
 from itertools import chain
+from selectors import DefaultSelector, EVENT_READ
 
 class NotificationManager(object):
 	"""
@@ -32,6 +32,11 @@ class NotificationManager(object):
 	received by the connections being watched. There is no thread safety, so
 	when a connection is being managed, it should not be used concurrently in
 	other threads while being managed.
+
+	The connections are watched using the platform's most efficient selector,
+	epoll or kqueue where available, so large sets can be managed. When a
+	connection is readable, the messages that have arrived are parsed without
+	sending a query.
 	"""
 	__slots__ = (
 		'connections',
@@ -40,6 +45,10 @@ class NotificationManager(object):
 		'timeout',
 		'_last_time',
 		'_pulled',
+		'_selector',
+		'_registered',
+		'_queried',
+		'__weakref__',
 	)
 
 	def __init__(self, *connections, timeout = None):
@@ -52,9 +61,39 @@ class NotificationManager(object):
 		self._last_time = None
 		# connection -> sequence of NOTIFYs
 		self._pulled = dict()
+		# Connections registered with the selector.
+		self._selector = DefaultSelector()
+		self._registered = set()
+		# Registered connections that started a query since the last wait.
+		self._queried = set()
+
+	# Keep the selector's registrations consistent with the connections set.
+	def _register(self, check):
+		selector = self._selector
+		registered = self._registered
+		queried = self._queried
+		for db in registered - check:
+			try:
+				selector.unregister(db)
+			except (KeyError, ValueError):
+				pass
+			db._pq_watchers.discard(self)
+			queried.discard(db)
+		registered.intersection_update(check)
+		for db in check - registered:
+			try:
+				selector.register(db, EVENT_READ)
+			except (KeyError, ValueError, OSError):
+				# Closed, or not a usable file descriptor.
+				self.trash((db,))
+			else:
+				registered.add(db)
+				db._pq_watchers.add(self)
+				# Queries may have been run before it was registered.
+				queried.add(db)
 
 	# Check the wire *and* wait for new messages.
-	def _wait_on_wires(self, time = time, select = select):
+	def _wait_on_wires(self, time = time):
 		if self.timeout == 0:
 			# We're polling.
 			max_duration = 0
@@ -76,16 +115,23 @@ class NotificationManager(object):
 				self.connections.remove(db)
 				self.garbage.add(db)
 		check = self.connections - self.garbage
+		self._register(check)
+
+		# Messages may have been read from the socket along with the results
+		# of the last query; they will not make the socket readable. Only the
+		# connections that started a query since the last wait are checked.
+		ready = [db for db in self._queried if db._pq_pending()]
+		self._queried.clear()
+		if ready:
+			max_duration = 0
+		ready.extend([key.fileobj for key, events in self._selector.select(max_duration)])
 
-		r, w, x = select(check, (), check, max_duration)
-		# Make sure the connection's _notifies get filled.
-		for db in r:
-			# Collect any pending events.
+		x = []
+		for db in set(ready):
+			# Parse the messages that have arrived into db._notifies.
+			# Nothing is sent, so no round trip is made to collect them.
 			try:
-				# Even if db is in a failed transaction, this
-				# 'null' command will succeed.
-				# (only connection failures blow up)
-				db.execute('')
+				db._pq_drain()
 			except Exception:
 				# failed to collect notifies; put in exception list.
 				# It is very unlikely that this is *not* a FATAL error.
@@ -0,0 +1,375 @@
+##
+# .pool - Connection pooling
+##
+"""
+Thread-safe pools of connections established by a `postgresql.api.Connector`::
+
+	>>> import postgresql
+	>>> from postgresql.pool import Pool
+	>>> pool = Pool(postgresql.open('&pq://user@localhost/database'), maxsize = 8)
+	>>> with pool.connection() as db:
+	...  db.prepare("SELECT 1").first()
+	1
+
+Connections are reset when they are returned to the pool, so session state does
+not leak from one user of a connection to the next.
+"""
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from .python import element
+from . import exceptions as pg_exc
+
+__all__ = [
+	'Pool',
+]
+
+class Pool(element.Element):
+	"""
+	A pool of connections created using `connector`.
+
+	At most `maxsize` connections are open at once; `acquire` waits for a
+	connection to be released when all of them are in use. Idle connections
+	beyond `minsize` are closed once they have been idle for `max_idle`
+	seconds, and connections are closed after `max_lifetime` seconds of use.
+	Connections that have been idle for more than `check_after` seconds are
+	checked with an empty query before they are given out.
+
+	The `reset` statement is executed on connections returned to the pool
+	after any open transaction has been aborted. ``DISCARD ALL`` should not be
+	used as it deallocates the statements prepared by the driver;
+	``DISCARD TEMP`` or ``DISCARD PLANS`` can be combined with ``RESET ALL``.
+
+	The pool is fork-aware. When used in a child process, the connections of
+	the parent are abandoned, not closed, and new connections are established.
+	"""
+	_e_label = 'POOL'
+	_e_factors = ('connector',)
+
+	def _e_metas(self):
+		yield (None, '%d/%d connections, %d idle' %(
+			self._size, self.maxsize, len(self._idle)
+		))
+
+	def __init__(self,
+		connector : "`postgresql.api.Connector` used to create connections",
+		minsize : "connections that are not closed for being idle" = 0,
+		maxsize : "maximum number of connections" = 10,
+		timeout : "default seconds to wait in `acquire`" = None,
+		reset : "statement used to reset returned connections" = 'RESET ALL',
+		max_lifetime : "seconds before a connection is retired" = None,
+		max_idle : "seconds before an idle connection is closed" = 600,
+		check_after : "idle seconds before a liveness check" = 30,
+		clock = time.time,
+	):
+		if maxsize < 1:
+			raise ValueError("maxsize must be at least one")
+		if minsize > maxsize:
+			raise ValueError("minsize cannot exceed maxsize")
+		self.connector = connector
+		self.minsize = minsize
+		self.maxsize = maxsize
+		self.timeout = timeout
+		self.reset = reset
+		self.max_lifetime = max_lifetime
+		self.max_idle = max_idle
+		self.check_after = check_after
+		self._clock = clock
+
+		self.closed = False
+		self._cv = threading.Condition(threading.Lock())
+		self._pid = os.getpid()
+		# (connection, created, idle since); the most recently
+		# used connections are at the end.
+		self._idle = deque()
+		# id(connection) -> (connection, created)
+		self._used = {}
+		# All connections, including the ones being established.
+		self._size = 0
+		self._waiting = 0
+
+		self.acquisitions = 0
+		self.timeouts = 0
+		self.created = 0
+		self.discarded = 0
+		self.wait_time = 0.0
+		self.max_wait_time = 0.0
+
+	def _check_fork(self):
+		# Called with the lock held.
+		pid = os.getpid()
+		if pid != self._pid:
+			# The sockets are shared with the parent; closing the connections
+			# here would terminate the parent's sessions.
+			self._pid = pid
+			self._idle.clear()
+			self._used.clear()
+			self._size = 0
+			self._waiting = 0
+
+	def _expired(self, created, idle_since, now):
+		if self.max_lifetime is not None and now - created >= self.max_lifetime:
+			return True
+		return self.max_idle is not None and now - idle_since >= self.max_idle
+
+	def _reap(self, now):
+		# Called with the lock held; return the connections to close.
+		# The least recently used connections are at the front.
+		closing = []
+		idle = self._idle
+		while idle and self._size > self.minsize:
+			db, created, idle_since = idle[0]
+			if not self._expired(created, idle_since, now):
+				break
+			idle.popleft()
+			closing.append(db)
+			self._size -= 1
+		self.discarded += len(closing)
+		return closing
+
+	def _close_all(self, connections):
+		for db in connections:
+			try:
+				db.close()
+			except Exception:
+				pass
+
+	def _connect(self):
+		db = self.connector()
+		db.connect()
+		return db
+
+	def _ready(self, db, idle_since, now):
+		"""
+		Whether the idle connection can be given out.
+		"""
+		if db.closed:
+			return False
+		if self.check_after is not None and now - idle_since >= self.check_after:
+			try:
+				db.execute('')
+			except Exception:
+				return False
+		return True
+
+	def acquire(self, timeout = None):
+		"""
+		Get a connection from the pool, establishing a new one if all the
+		connections are in use and there are less than `maxsize`.
+
+		If `maxsize` connections are in use, wait `timeout` seconds, or the
+		pool's default, for one to be released.
+		`postgresql.exceptions.PoolTimeoutError` is raised if none is.
+		"""
+		if timeout is None:
+			timeout = self.timeout
+		clock = self._clock
+		start = clock()
+		deadline = None if timeout is None else start + timeout
+
+		while True:
+			closing = []
+			db = None
+			create = False
+			with self._cv:
+				self._check_fork()
+				while True:
+					if self.closed:
+						raise pg_exc.OperationError("pool is closed", creator = self)
+					now = clock()
+					closing.extend(self._reap(now))
+					if self._idle:
+						db, created, idle_since = self._idle.pop()
+						if self.max_lifetime is not None \
+						and now - created >= self.max_lifetime:
+							closing.append(db)
+							self._size -= 1
+							self.discarded += 1
+							db = None
+							continue
+						break
+					if self._size < self.maxsize:
+						self._size += 1
+						create = True
+						break
+					if deadline is not None:
+						remaining = deadline - now
+						if remaining <= 0:
+							self.timeouts += 1
+							raise pg_exc.PoolTimeoutError(
+								"no connection was released within %r seconds" %(timeout,),
+								creator = self
+							)
+					else:
+						remaining = None
+					self._waiting += 1
+					try:
+						self._cv.wait(remaining)
+					finally:
+						self._waiting -= 1
+			self._close_all(closing)
+
+			if create:
+				try:
+					db = self._connect()
+				except:
+					with self._cv:
+						self._size -= 1
+						self._cv.notify()
+					raise
+				created = clock()
+				with self._cv:
+					self.created += 1
+			elif not self._ready(db, idle_since, clock()):
+				self._close_all((db,))
+				with self._cv:
+					self._size -= 1
+					self.discarded += 1
+				continue
+
+			waited = clock() - start
+			with self._cv:
+				self._used[id(db)] = (db, created)
+				self.acquisitions += 1
+				self.wait_time += waited
+				if waited > self.max_wait_time:
+					self.max_wait_time = waited
+			return db
+
+	def release(self, db, discard = False):
+		"""
+		Return a connection acquired from the pool. If `discard` is `True`, or
+		the connection cannot be reset, the connection is closed.
+		"""
+		with self._cv:
+			self._check_fork()
+			entry = self._used.pop(id(db), None)
+		if entry is None:
+			# Not from this pool, or acquired before a fork.
+			return
+		created = entry[1]
+		now = self._clock()
+		if not discard and not self.closed and not db.closed:
+			if self.max_lifetime is not None and now - created >= self.max_lifetime:
+				discard = True
+			else:
+				try:
+					if db.pq.state != b'I':
+						db.execute('ABORT')
+					if self.reset:
+						db.execute(self.reset)
+				except Exception:
+					discard = True
+		else:
+			discard = True
+
+		if discard:
+			self._close_all((db,))
+		with self._cv:
+			if discard or self.closed or self._pid != os.getpid():
+				if self._pid == os.getpid():
+					self._size -= 1
+					self.discarded += 1
+			else:
+				self._idle.append((db, created, now))
+			self._cv.notify()
+
+	@contextmanager
+	def connection(self, timeout = None):
+		"""
+		Context manager acquiring a connection and releasing it on exit.
+		The connection is discarded if the block raised a disconnection.
+		"""
+		db = self.acquire(timeout = timeout)
+		try:
+			yield db
+		except pg_exc.Disconnection:
+			self.release(db, discard = True)
+			raise
+		except:
+			self.release(db)
+			raise
+		else:
+			self.release(db)
+
+	def fill(self):
+		"""
+		Establish connections until the pool has `minsize` connections.
+		"""
+		while True:
+			with self._cv:
+				self._check_fork()
+				if self.closed or self._size >= self.minsize:
+					return
+				self._size += 1
+			try:
+				db = self._connect()
+			except:
+				with self._cv:
+					self._size -= 1
+					self._cv.notify()
+				raise
+			now = self._clock()
+			with self._cv:
+				self.created += 1
+				self._idle.appendleft((db, now, now))
+				self._cv.notify()
+
+	def reap(self):
+		"""
+		Close the idle connections that have exceeded `max_idle` or
+		`max_lifetime`, keeping at least `minsize` connections.
+		"""
+		with self._cv:
+			self._check_fork()
+			closing = self._reap(self._clock())
+		self._close_all(closing)
+
+	def close(self):
+		"""
+		Close the idle connections and any connection released afterwards.
+		Waiting `acquire` calls raise `postgresql.exceptions.OperationError`.
+		"""
+		with self._cv:
+			self._check_fork()
+			self.closed = True
+			closing = [x[0] for x in self._idle]
+			self._size -= len(closing)
+			self._idle.clear()
+			self._cv.notify_all()
+		self._close_all(closing)
+
+	def statistics(self):
+		"""
+		A dictionary describing the use of the pool.
+
+		``utilization`` is the fraction of `maxsize` connections in use.
+		``wait_time`` is the total seconds spent in `acquire`, and
+		``mean_wait_time`` is the average per acquisition.
+		"""
+		with self._cv:
+			used = len(self._used)
+			return {
+				'size' : self._size,
+				'idle' : len(self._idle),
+				'in_use' : used,
+				'waiting' : self._waiting,
+				'utilization' : used / self.maxsize,
+				'acquisitions' : self.acquisitions,
+				'timeouts' : self.timeouts,
+				'created' : self.created,
+				'discarded' : self.discarded,
+				'wait_time' : self.wait_time,
+				'max_wait_time' : self.max_wait_time,
+				'mean_wait_time' : (
+					self.wait_time / self.acquisitions if self.acquisitions else 0.0
+				),
+			}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, typ, val, tb):
+		self.close()
@@ -0,0 +1,365 @@
+/*
+ * .port.optimized - .copyformat optimizations
+ */
+#define include_copyformat_functions \
+	mFUNC(text_fields, METH_VARARGS, "split a text format COPY line into a list of unescaped fields and None for NULLs") \
+	mFUNC(csv_fields, METH_VARARGS, "split a CSV format COPY line into a list of unquoted fields and None for NULLs") \
+
+static int
+hex_digit(char c)
+{
+	if (c >= '0' && c <= '9')
+		return(c - '0');
+	if (c >= 'a' && c <= 'f')
+		return(c - 'a' + 10);
+	if (c >= 'A' && c <= 'F')
+		return(c - 'A' + 10);
+	return(-1);
+}
+
+/*
+ * Unescape the text format field into a new bytes object.
+ * The unescaped field is never larger than the escaped field.
+ */
+static PyObject *
+_text_unescape(const char *field, Py_ssize_t size)
+{
+	PyObject *rob;
+	char *out, *pos;
+	const char *end = field + size;
+	int d;
+
+	rob = PyBytes_FromStringAndSize(NULL, size);
+	if (rob == NULL)
+		return(NULL);
+	out = pos = PyBytes_AS_STRING(rob);
+
+	while (field < end)
+	{
+		char c = *field++;
+
+		if (c != '\\' || field == end)
+		{
+			*pos++ = c;
+			continue;
+		}
+
+		c = *field++;
+		switch (c)
+		{
+			case 'b':
+				*pos++ = '\b';
+			break;
+			case 'f':
+				*pos++ = '\f';
+			break;
+			case 'n':
+				*pos++ = '\n';
+			break;
+			case 'r':
+				*pos++ = '\r';
+			break;
+			case 't':
+				*pos++ = '\t';
+			break;
+			case 'v':
+				*pos++ = '\v';
+			break;
+
+			case '0': case '1': case '2': case '3':
+			case '4': case '5': case '6': case '7':
+			{
+				int v = c - '0';
+				if (field < end && *field >= '0' && *field <= '7')
+				{
+					v = (v << 3) + (*field++ - '0');
+					if (field < end && *field >= '0' && *field <= '7')
+						v = (v << 3) + (*field++ - '0');
+				}
+				*pos++ = (char) (v & 0xFF);
+			}
+			break;
+
+			case 'x':
+				if (field < end && (d = hex_digit(*field)) >= 0)
+				{
+					int v = d;
+					++field;
+					if (field < end && (d = hex_digit(*field)) >= 0)
+					{
+						v = (v << 4) + d;
+						++field;
+					}
+					*pos++ = (char) v;
+				}
+				else
+					*pos++ = c;
+			break;
+
+			default:
+				*pos++ = c;
+			break;
+		}
+	}
+
+	if (_PyBytes_Resize(&rob, pos - out) < 0)
+		return(NULL);
+	return(rob);
+}
+
+/*
+ * text_fields(line, delimiter = b'\t', null = b'\\N')
+ *
+ * Split the line at the unescaped delimiters. A trailing line ending is
+ * ignored, and fields whose raw form is equal to `null` are None.
+ */
+static PyObject *
+text_fields(PyObject *self, PyObject *args)
+{
+	Py_buffer line, delim, null;
+	const char *data, *start, *end;
+	PyObject *rob = NULL, *field;
+	char delimiter = '\t';
+	const char *nulls = "\\N";
+	Py_ssize_t nullsize = 2;
+	int has_escape = 0;
+
+	delim.obj = NULL;
+	null.obj = NULL;
+	if (!PyArg_ParseTuple(args, "y*|y*y*", &line, &delim, &null))
+		return(NULL);
+
+	if (delim.obj != NULL)
+	{
+		if (delim.len != 1)
+		{
+			PyErr_SetString(PyExc_ValueError, "delimiter must be a single byte");
+			goto cleanup;
+		}
+		delimiter = ((const char *) delim.buf)[0];
+	}
+	if (null.obj != NULL)
+	{
+		nulls = (const char *) null.buf;
+		nullsize = null.len;
+	}
+
+	data = (const char *) line.buf;
+	end = data + line.len;
+	if (end > data && end[-1] == '\n')
+	{
+		--end;
+		if (end > data && end[-1] == '\r')
+			--end;
+	}
+
+	rob = PyList_New(0);
+	if (rob == NULL)
+		goto cleanup;
+
+	start = data;
+	while (1)
+	{
+		if (data == end || *data == delimiter)
+		{
+			Py_ssize_t size = data - start;
+
+			if (size == nullsize && memcmp(start, nulls, size) == 0)
+			{
+				Py_INCREF(Py_None);
+				field = Py_None;
+			}
+			else if (has_escape)
+				field = _text_unescape(start, size);
+			else
+				field = PyBytes_FromStringAndSize(start, size);
+
+			if (field == NULL || PyList_Append(rob, field) < 0)
+			{
+				Py_XDECREF(field);
+				Py_DECREF(rob);
+				rob = NULL;
+				goto cleanup;
+			}
+			Py_DECREF(field);
+
+			if (data == end)
+				break;
+			start = ++data;
+			has_escape = 0;
+		}
+		else if (*data == '\\')
+		{
+			has_escape = 1;
+			/* The escaped character is never a delimiter. */
+			data = (data + 1 < end) ? data + 2 : end;
+		}
+		else
+			++data;
+	}
+
+cleanup:
+	PyBuffer_Release(&line);
+	if (delim.obj != NULL)
+		PyBuffer_Release(&delim);
+	if (null.obj != NULL)
+		PyBuffer_Release(&null);
+	return(rob);
+}
+
+/*
+ * Get the single byte of an optional argument.
+ */
+static int
+_single_byte(Py_buffer *buf, char *c, const char *name)
+{
+	if (buf->obj == NULL)
+		return(0);
+	if (buf->len != 1)
+	{
+		PyErr_Format(PyExc_ValueError, "%s must be a single byte", name);
+		return(-1);
+	}
+	*c = ((const char *) buf->buf)[0];
+	return(0);
+}
+
+/*
+ * csv_fields(line, delimiter = b',', quote = b'"', null = b'')
+ *
+ * Split the line at the delimiters outside of quotes. Quotes inside quoted
+ * sections are escaped by doubling them. Fields whose raw form is equal to
+ * `null` and that were not quoted are None.
+ */
+static PyObject *
+csv_fields(PyObject *self, PyObject *args)
+{
+	Py_buffer line, delim, quot, null;
+	const char *data, *start, *end;
+	char *scratch = NULL, *out;
+	PyObject *rob = NULL, *field;
+	char delimiter = ',', quote = '"';
+	const char *nulls = "";
+	Py_ssize_t nullsize = 0;
+	int quoted;
+
+	delim.obj = NULL;
+	quot.obj = NULL;
+	null.obj = NULL;
+	if (!PyArg_ParseTuple(args, "y*|y*y*y*", &line, &delim, &quot, &null))
+		return(NULL);
+
+	if (_single_byte(&delim, &delimiter, "delimiter") < 0
+			|| _single_byte(&quot, &quote, "quote") < 0)
+		goto cleanup;
+	if (null.obj != NULL)
+	{
+		nulls = (const char *) null.buf;
+		nullsize = null.len;
+	}
+
+	data = (const char *) line.buf;
+	end = data + line.len;
+	if (end > data && end[-1] == '\n')
+	{
+		--end;
+		if (end > data && end[-1] == '\r')
+			--end;
+	}
+
+	/* Unquoted fields are never larger than the line. */
+	scratch = PyMem_Malloc((end - data) + 1);
+	if (scratch == NULL)
+	{
+		PyErr_NoMemory();
+		goto cleanup;
+	}
+
+	rob = PyList_New(0);
+	if (rob == NULL)
+		goto cleanup;
+
+	while (1)
+	{
+		start = data;
+		out = scratch;
+		quoted = 0;
+
+		while (data < end && *data != delimiter)
+		{
+			if (*data != quote)
+			{
+				*out++ = *data++;
+				continue;
+			}
+
+			quoted = 1;
+			++data;
+			while (1)
+			{
+				if (data == end)
+				{
+					PyErr_SetString(PyExc_ValueError, "unterminated quoted CSV field");
+					goto fail;
+				}
+				if (*data == quote)
+				{
+					if (data + 1 < end && data[1] == quote)
+					{
+						*out++ = quote;
+						data += 2;
+						continue;
+					}
+					++data;
+					break;
+				}
+				*out++ = *data++;
+			}
+		}
+
+		if (!quoted)
+		{
+			Py_ssize_t size = data - start;
+
+			if (size == nullsize && memcmp(start, nulls, size) == 0)
+			{
+				Py_INCREF(Py_None);
+				field = Py_None;
+			}
+			else
+				field = PyBytes_FromStringAndSize(start, size);
+		}
+		else
+			field = PyBytes_FromStringAndSize(scratch, out - scratch);
+
+		if (field == NULL || PyList_Append(rob, field) < 0)
+		{
+			Py_XDECREF(field);
+			goto fail;
+		}
+		Py_DECREF(field);
+
+		if (data == end)
+			break;
+		++data;
+	}
+	goto cleanup;
+
+fail:
+	Py_DECREF(rob);
+	rob = NULL;
+cleanup:
+	if (scratch != NULL)
+		PyMem_Free(scratch);
+	PyBuffer_Release(&line);
+	if (delim.obj != NULL)
+		PyBuffer_Release(&delim);
+	if (quot.obj != NULL)
+		PyBuffer_Release(&quot);
+	if (null.obj != NULL)
+		PyBuffer_Release(&null);
+	return(rob);
+}
+/*
+ * vim: ts=3:sw=3:noet:
+ */
@@ -43,6 +43,7 @@ static short (*local_ntohs)(short) = NULL;
 #include "buffer.c"
 #include "wirestate.c"
 #include "element3.c"
+#include "copyformat.c"
 
 
 /* cpp abuse, read up on X-Macros if you don't understand  */
@@ -52,6 +53,7 @@ static PyMethodDef optimized_methods[] = {
 	include_element3_functions
 	include_structlib_functions
 	include_functools_functions
+	include_copyformat_functions
 	{NULL}
 };
 #undef mFUNC
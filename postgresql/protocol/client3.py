@@ -5,6 +5,7 @@
 Protocol version 3.0 client and tools.
 """
 import os
+import ssl
 import weakref
 from .buffer import pq_message_stream
 from . import element3 as element
@@ -474,6 +475,58 @@ class Connection(object):
 			# only remove the transaction if it's *not* fatal
 			self.xact = None
 
+	def drain(self, x,
+		would_block = (BlockingIOError, ssl.SSLWantReadError),
+	):
+		"""
+		Give the messages that can be read without blocking to the transaction,
+		normally a `xact.Asynchronous` instance; there must be no transaction in
+		progress.
+
+		Nothing is sent, so this is used to receive the asynchronous messages of
+		an idle connection when its socket is readable. The transaction is
+		complete when this returns.
+		"""
+		self.xact = x
+		sock = self.socket
+		timeout = sock.gettimeout()
+		sock.settimeout(0)
+		try:
+			while x.state is not xact.Complete:
+				if self.read:
+					self.read = self.read[x.state[1](self.read):]
+					continue
+				if self.message_buffer.has_message():
+					self.read = self.message_buffer.read()
+					continue
+				try:
+					data = sock.recv(self.recvsize)
+				except would_block:
+					break
+				except self.socket_factory.fatal_exception as e:
+					msg = self.socket_factory.fatal_exception_message(e)
+					if msg is None:
+						break
+					x.fatal = True
+					x.exception = e
+					x.error_message = element.ClientError((
+						(b'S', 'FATAL'),
+						(b'C', '08006'),
+						(b'M', msg),
+					))
+					break
+				if data == b'':
+					x.fatal = True
+					x.error_message = eof_error
+					break
+				self.message_buffer.write(data)
+		finally:
+			if self.socket is sock:
+				sock.settimeout(timeout)
+		x.state = xact.Complete
+		if x.fatal is not True:
+			self.xact = None
+
 	def register_cursor(self, cursor, pq_cursor_id):
 		trash = self.trash_cursor
 		self.cursors[pq_cursor_id] = weakref.ref(cursor, lambda ref: trash(pq_cursor_id))
@@ -80,6 +80,56 @@ class Closing(Transaction):
 		self.messages = (element.DisconnectMessage,)
 		self.state = (Sending, self.sent)
 
+class Asynchronous(Transaction):
+	"""
+	Process the messages received while no request is in progress.
+
+	Only asynchronous messages are expected; they are parsed and given to the
+	`asynchook`. Any other message completes the transaction as fatal: the server
+	only sends an Error outside of a request when it is terminating the session.
+	"""
+	def __init__(self, asynchook = return_arg):
+		self.asynchook = asynchook
+		self.received = []
+		self.state = (Receiving, self.put)
+
+	def messages_received(self):
+		return self.received
+
+	def put(self, messages,
+		ERROR_TYPE = element.Error.type,
+		ERROR_PARSE = element.Error.parse,
+		AsynchronousMap = AsynchronousMap,
+	):
+		count = 0
+		for x in messages:
+			count += 1
+			parse = AsynchronousMap.get(x[0])
+			if parse is None:
+				self.fatal = True
+				if x[0] == ERROR_TYPE:
+					self.error_message = ERROR_PARSE(x[1])
+				else:
+					self.error_message = element.ClientError((
+						(b'S', 'FATAL'),
+						(b'C', '08P01'),
+						(b'M', message_expectation(
+							expected = tuple(AsynchronousMap.keys()),
+							received = x[0]
+						)),
+					))
+				self.state = Complete
+				break
+			msg = parse(x[1])
+			self.received.append(msg)
+			try:
+				self.asynchook(msg)
+			except Exception as err:
+				# exception thrown by async message handler?
+				# notify the user, but continue...
+				sys.excepthook(*sys.exc_info())
+		return count
+
 class Negotiation(Transaction):
 	"""
 	Negotiation is a protocol transaction used to manage the initial stage of a
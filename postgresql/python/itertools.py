@@ -4,6 +4,7 @@
 """
 itertools extensions
 """
+import time
 import collections
 from itertools import cycle, islice
 
@@ -38,6 +39,51 @@ def chunk(iterable, chunksize = 256):
 		lastsize = len(last)
 		yield last
 
+def coalesce(chunks, size = 1024 * 128, delay = None, clock = time.monotonic):
+	"""
+	Given an iterable of chunks of `bytes`, produce chunks of `bytes` objects
+	joining at least `size` bytes of the data each.
+
+	The joined data is produced once `size` bytes are pending, once `delay`
+	seconds have passed since the oldest pending data was taken, or when the
+	iterable is exhausted. The delay is checked as chunks are taken, so data
+	is not produced while the iterable is blocked.
+
+	coalesce([[b'a', b'b'], [b'c']], size = 2) -> [
+		[b'ab'],
+		[b'c'],
+	]
+	"""
+	parts = []
+	pending = 0
+	started = None
+	for c in chunks:
+		joined = []
+		for x in c:
+			if not x:
+				# Nothing to join; never produce empty data.
+				continue
+			parts.append(x)
+			pending += len(x)
+			if pending >= size:
+				joined.append(b''.join(parts))
+				parts = []
+				pending = 0
+				started = None
+		if parts and delay is not None:
+			now = clock()
+			if started is None:
+				started = now
+			elif now - started >= delay:
+				joined.append(b''.join(parts))
+				parts = []
+				pending = 0
+				started = None
+		if joined:
+			yield joined
+	if parts:
+		yield [b''.join(parts)]
+
 def find(iterable, selector):
 	"""
 	Return the first item in the `iterable` that causes the `selector` to return
@@ -0,0 +1,267 @@
+##
+# .routing - Read/write routing over multiple hosts
+##
+"""
+Route sessions to the primary or the standbys of a set of servers::
+
+	>>> import postgresql
+	>>> from postgresql.routing import Router
+	>>> router = Router([
+	...  postgresql.open('&pq://user@primary/database'),
+	...  postgresql.open('&pq://user@standby1/database'),
+	...  postgresql.open('&pq://user@standby2/database'),
+	... ])
+	>>> with router.connection(mode = 'read only') as db:
+	...  db.prepare("SELECT count(*) FROM emp").first()
+	>>> with router.xact(mode = 'read write') as db:
+	...  db.prepare("INSERT INTO emp VALUES ($1)")('Jane')
+
+The role of each server is identified using ``pg_is_in_recovery()`` once a
+connection to it is established, and it is cached for `Router.role_ttl`
+seconds. Connections are pooled per server using `postgresql.pool.Pool`.
+"""
+import time
+import random
+import threading
+from contextlib import contextmanager
+from .python import element
+from . import exceptions as pg_exc
+from .pool import Pool
+
+__all__ = [
+	'Router',
+	'PRIMARY',
+	'STANDBY',
+]
+
+PRIMARY = 'primary'
+STANDBY = 'standby'
+
+class Router(element.Element):
+	"""
+	Route connections to the servers reached by `connectors`.
+
+	Sessions requesting ``mode = 'read write'`` are given connections to the
+	primary. Sessions requesting ``mode = 'read only'`` are given connections
+	to a standby selected by `balance`: ``'least-connections'`` selects the
+	standby with the fewest connections in use, and ``'random'`` selects one at
+	random. If no standby is available, read-only sessions use the primary
+	unless `fallback` is `False`. Sessions without a mode may use any server.
+
+	Servers that cannot be reached are not considered again for `role_ttl`
+	seconds. The remaining keywords are given to the `postgresql.pool.Pool`
+	of each server.
+	"""
+	_e_label = 'ROUTER'
+	_e_factors = ('connectors',)
+
+	#: Seconds the role of a server is trusted before it is checked again.
+	role_ttl = 30
+
+	def _e_metas(self):
+		for connector, pool in zip(self.connectors, self.pools):
+			role = self._roles.get(id(pool), (None,))[0]
+			yield (None, '%s: %s' %(role or 'unknown', connector._pq_iri))
+
+	def __init__(self,
+		connectors,
+		balance : "'least-connections' or 'random'" = 'least-connections',
+		fallback : "use the primary when no standby is available" = True,
+		role_ttl = None,
+		clock = time.time,
+		Pool = Pool,
+		**pool_parameters
+	):
+		if balance not in ('least-connections', 'random'):
+			raise ValueError("unknown balance method: " + repr(balance))
+		self.connectors = tuple(connectors)
+		if not self.connectors:
+			raise ValueError("at least one connector must be given")
+		self.balance = balance
+		self.fallback = fallback
+		if role_ttl is not None:
+			self.role_ttl = role_ttl
+		self._clock = clock
+		self.pools = tuple([
+			Pool(x, **pool_parameters) for x in self.connectors
+		])
+		# id(pool) -> (role, checked at); role is None for unreachable servers.
+		self._roles = {}
+		# id(connection) -> pool
+		self._owners = {}
+		self._lock = threading.Lock()
+
+	def _role(self, pool, db):
+		return STANDBY if db.sys.is_in_recovery() else PRIMARY
+
+	def _known(self, now):
+		"""
+		The pools whose role is cached, and the pools that need a check.
+		"""
+		ttl = self.role_ttl
+		known = []
+		unknown = []
+		with self._lock:
+			for pool in self.pools:
+				r = self._roles.get(id(pool))
+				if r is None or now - r[1] >= ttl:
+					unknown.append(pool)
+				else:
+					known.append((pool, r[0]))
+		return known, unknown
+
+	def _set_role(self, pool, role):
+		with self._lock:
+			self._roles[id(pool)] = (role, self._clock())
+
+	def invalidate(self, pool = None):
+		"""
+		Forget the cached role of the server of `pool`, or of all the servers.
+		"""
+		with self._lock:
+			if pool is None:
+				self._roles.clear()
+			else:
+				self._roles.pop(id(pool), None)
+
+	def _wanted(self, mode):
+		if mode is None:
+			return (PRIMARY, STANDBY)
+		mode = mode.lower()
+		if mode == 'read write':
+			return (PRIMARY,)
+		elif mode == 'read only':
+			return (STANDBY, PRIMARY) if self.fallback else (STANDBY,)
+		raise ValueError("unknown transaction mode: " + repr(mode))
+
+	def _select(self, pools):
+		if self.balance == 'random':
+			return random.choice(pools)
+		return min(pools, key = lambda x: x.statistics()['in_use'])
+
+	def acquire(self, mode = None, timeout = None):
+		"""
+		Get a connection to a server appropriate for `mode`; ``'read write'``,
+		``'read only'``, or `None`. The connection must be given to `release`.
+		"""
+		wanted = self._wanted(mode)
+		known, unknown = self._known(self._clock())
+		failures = []
+
+		# Check the servers whose role is not known. The connection used
+		# for the check is kept if the server is the one needed.
+		for pool in unknown:
+			try:
+				db = pool.acquire(timeout = timeout)
+			except pg_exc.PoolTimeoutError:
+				# Busy, but alive.
+				continue
+			except Exception as err:
+				failures.append(err)
+				self._set_role(pool, None)
+				continue
+			try:
+				role = self._role(pool, db)
+			except Exception as err:
+				failures.append(err)
+				self._set_role(pool, None)
+				pool.release(db, discard = True)
+				continue
+			self._set_role(pool, role)
+			known.append((pool, role))
+			if mode is None or role == wanted[0]:
+				return self._track(pool, db)
+			pool.release(db)
+
+		for role in wanted:
+			candidates = [pool for pool, r in known if r == role]
+			while candidates:
+				pool = self._select(candidates)
+				try:
+					return self._track(pool, pool.acquire(timeout = timeout))
+				except pg_exc.PoolTimeoutError:
+					raise
+				except Exception as err:
+					failures.append(err)
+					self._set_role(pool, None)
+					candidates.remove(pool)
+			if role == STANDBY and mode is not None and not self.fallback:
+				break
+
+		err = pg_exc.ClientCannotConnectError(
+			"no %s server is available" %(' or '.join(wanted),),
+			creator = self
+		)
+		if failures:
+			raise err from failures[-1]
+		raise err
+
+	def _track(self, pool, db):
+		with self._lock:
+			self._owners[id(db)] = pool
+		return db
+
+	def release(self, db, discard = False):
+		"""
+		Return a connection acquired from the router.
+		"""
+		with self._lock:
+			pool = self._owners.pop(id(db), None)
+		if pool is not None:
+			pool.release(db, discard = discard)
+
+	@contextmanager
+	def connection(self, mode = None, timeout = None):
+		"""
+		Context manager acquiring a connection for the given `mode`.
+		"""
+		db = self.acquire(mode = mode, timeout = timeout)
+		try:
+			yield db
+		except pg_exc.Disconnection:
+			self.release(db, discard = True)
+			raise
+		except pg_exc.ReadOnlyTransactionError:
+			# The primary changed; check the roles again.
+			self.invalidate()
+			self.release(db)
+			raise
+		except:
+			self.release(db)
+			raise
+		else:
+			self.release(db)
+
+	@contextmanager
+	def xact(self, isolation = None, mode = 'read write', timeout = None):
+		"""
+		Context manager acquiring a connection for `mode` and running the block
+		in a transaction with the given `isolation` and `mode`.
+		"""
+		with self.connection(mode = mode, timeout = timeout) as db:
+			with db.xact(isolation = isolation, mode = mode):
+				yield db
+
+	def statistics(self):
+		"""
+		The cached role and pool statistics of each server.
+		"""
+		with self._lock:
+			roles = dict(self._roles)
+		return [
+			dict(pool.statistics(), role = roles.get(id(pool), (None,))[0])
+			for pool in self.pools
+		]
+
+	def close(self):
+		"""
+		Close the pools of all the servers.
+		"""
+		for pool in self.pools:
+			pool.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, typ, val, tb):
+		self.close()
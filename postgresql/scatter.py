@@ -0,0 +1,444 @@
+##
+# .scatter - Run statements on many connections concurrently
+##
+"""
+Execute the same statement on a set of connections at once::
+
+	>>> import postgresql
+	>>> from postgresql.scatter import Scatter
+	>>> shards = Scatter([
+	...  postgresql.open('&pq://user@host/shard%d' %(i,)) for i in range(64)
+	... ])
+	>>> ps = shards.prepare("SELECT id, name FROM emp WHERE name LIKE $1 ORDER BY id")
+	>>> for row in ps.rows('J%', key = 'id'):
+	...  print(row)
+
+Each connection is operated by its own thread. The results of the connections
+are streamed back through bounded queues; when a `key` is given, they are
+merged in key order.
+
+`parallel_map` distributes many executions of a statement over a set of
+connections::
+
+	>>> from postgresql.scatter import parallel_map
+	>>> totals = parallel_map(
+	...  postgresql.open('&pq://user@host/database'),
+	...  "SELECT sum(amount) FROM orders WHERE customer = $1",
+	...  ((x,) for x in customer_ids),
+	...  workers = 8, first = True,
+	... )
+"""
+import heapq
+import threading
+from queue import Queue, Empty
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
+from .python import element
+from .python.itertools import chunk
+from . import api as pg_api
+
+__all__ = [
+	'Scatter',
+	'ScatterStatement',
+	'merge',
+	'parallel_map',
+]
+
+class _Descending(object):
+	__slots__ = ('key',)
+
+	def __init__(self, key):
+		self.key = key
+
+	def __lt__(self, ob):
+		return ob.key < self.key
+
+	def __eq__(self, ob):
+		return self.key == ob.key
+
+def merge(iterables, key = None, reverse = False, heapify = heapq.heapify, heapreplace = heapq.heapreplace, heappop = heapq.heappop):
+	"""
+	Merge the sorted `iterables` into a single sorted iterator.
+
+	Items with equal keys are produced in the order of the iterables that
+	produced them. If `reverse` is `True`, the iterables are sorted in
+	descending order.
+	"""
+	heap = []
+	for index, it in enumerate(iterables):
+		it = iter(it)
+		for item in it:
+			k = item if key is None else key(item)
+			heap.append([_Descending(k) if reverse else k, index, item, it])
+			break
+	heapify(heap)
+
+	while heap:
+		entry = heap[0]
+		yield entry[2]
+		it = entry[3]
+		for item in it:
+			k = item if key is None else key(item)
+			entry[0] = _Descending(k) if reverse else k
+			entry[2] = item
+			heapreplace(heap, entry)
+			break
+		else:
+			heappop(heap)
+
+def _produce(ps, parameters, queue, stop, rows):
+	"""
+	Put the chunks of the statement's results on the queue followed by `None`,
+	or the exception that interrupted the execution.
+	"""
+	try:
+		c = ps.chunks(*parameters)
+		if rows and c._output_io:
+			c._process_chunk = c._process_tuple_chunk_Row
+		try:
+			put = queue.put
+			for x in c:
+				if stop.is_set():
+					break
+				put(x)
+		finally:
+			c.close()
+	except BaseException as err:
+		queue.put(err)
+	else:
+		queue.put(None)
+
+def _source(queue):
+	get = queue.get
+	while True:
+		x = get()
+		if x is None:
+			return
+		if isinstance(x, BaseException):
+			raise x
+		yield from x
+
+def _abort(stop, futures, queues):
+	"""
+	Stop the producers, draining the queues they may be blocked on.
+	"""
+	stop.set()
+	queues = list(set(queues))
+	for f in futures:
+		while not f.done():
+			for q in queues:
+				try:
+					while True:
+						q.get_nowait()
+				except Empty:
+					pass
+			try:
+				f.result(timeout = 0.01)
+			except Exception:
+				pass
+
+class ScatterStatement(element.Element):
+	"""
+	A statement prepared on each connection of a `Scatter`.
+	"""
+	_e_label = 'SCATTER STATEMENT'
+	_e_factors = ('string',)
+
+	def _e_metas(self):
+		yield (None, '%d connections' %(len(self.statements),))
+
+	def __init__(self, scatter, string, statements):
+		self.scatter = scatter
+		self.string = string
+		self.statements = tuple(statements)
+
+	@property
+	def column_names(self):
+		return self.statements[0].column_names
+
+	def _key(self, key):
+		if key is None or callable(key):
+			return key
+		names = list(self.column_names)
+		if isinstance(key, str):
+			key = (key,)
+		return itemgetter(*[
+			x if isinstance(x, int) else names.index(x) for x in key
+		])
+
+	def _stream(self, parameters, queues, rows):
+		stop = threading.Event()
+		submit = self.scatter._executor.submit
+		futures = [
+			submit(_produce, ps, parameters, q, stop, rows)
+			for ps, q in zip(self.statements, queues)
+		]
+		return stop, futures
+
+	def __call__(self, *parameters):
+		"""
+		Execute the statement on all the connections; the results are returned
+		in a list in the order of the connections.
+		"""
+		return self.scatter._map(lambda ps: ps(*parameters), self.statements)
+
+	def first(self, *parameters):
+		"""
+		The `first` of the statement on each connection.
+		"""
+		return self.scatter._map(lambda ps: ps.first(*parameters), self.statements)
+
+	def _chunks(self, parameters, rows):
+		n = len(self.statements)
+		q = Queue(self.scatter.queue_size * n)
+		stop, futures = self._stream(parameters, (q,) * n, rows)
+		try:
+			get = q.get
+			while n:
+				x = get()
+				if x is None:
+					n -= 1
+				elif isinstance(x, BaseException):
+					raise x
+				else:
+					yield x
+		finally:
+			_abort(stop, futures, (q,))
+
+	def chunks(self, *parameters):
+		"""
+		Stream the chunks of all the connections in the order they are received.
+		"""
+		return self._chunks(parameters, False)
+
+	def rows(self, *parameters, key = None, reverse = False):
+		"""
+		Stream the rows of all the connections.
+
+		If `key` is given, the rows of the connections must be sorted by it, as
+		with an ``ORDER BY`` clause, and they are merged in key order. The key
+		may be a function, or a column name, index, or a sequence of them.
+		Use `reverse` when the rows are sorted in descending order.
+		"""
+		key = self._key(key)
+		if key is None:
+			c = self._chunks(parameters, True)
+			try:
+				for x in c:
+					yield from x
+			finally:
+				c.close()
+			return
+		queues = [Queue(self.scatter.queue_size) for x in self.statements]
+		stop, futures = self._stream(parameters, queues, True)
+		try:
+			yield from merge(map(_source, queues), key = key, reverse = reverse)
+		finally:
+			_abort(stop, futures, queues)
+	__iter__ = rows
+
+	def close(self):
+		for x in self.statements:
+			x.close()
+
+class Scatter(element.Element):
+	"""
+	A set of connections that statements are executed on concurrently.
+
+	`targets` is a sequence of connections, or of `postgresql.api.Connector`
+	instances that are used to establish connections owned by the Scatter and
+	closed by `close`.
+	"""
+	_e_label = 'SCATTER'
+	_e_factors = ()
+
+	#: Number of chunks queued for each connection while streaming.
+	queue_size = 4
+
+	def _e_metas(self):
+		yield (None, '%d connections' %(len(self.connections),))
+
+	def __init__(self, targets, queue_size = None):
+		targets = list(targets)
+		if not targets:
+			raise ValueError("at least one connection or connector must be given")
+		if queue_size is not None:
+			self.queue_size = queue_size
+		self._executor = ThreadPoolExecutor(len(targets))
+		self._owned = []
+		try:
+			self.connections = tuple(self._map(self._connect, targets))
+		except:
+			self.close()
+			raise
+
+	def _connect(self, target):
+		if not isinstance(target, pg_api.Connector):
+			return target
+		db = target()
+		self._owned.append(db)
+		db.connect()
+		return db
+
+	def _map(self, f, items):
+		"""
+		Call `f` with each of `items` concurrently, returning the results in
+		order. All the calls are finished before an exception is raised.
+		"""
+		futures = [self._executor.submit(f, x) for x in items]
+		results = []
+		error = None
+		for x in futures:
+			try:
+				results.append(x.result())
+			except BaseException as err:
+				if error is None:
+					error = err
+		if error is not None:
+			raise error
+		return results
+
+	def prepare(self, sql):
+		"""
+		Prepare the statement on all the connections.
+		"""
+		return ScatterStatement(self, sql, self._map(lambda db: db.prepare(sql), self.connections))
+
+	def execute(self, sql):
+		"""
+		Execute the SQL on all the connections using `execute`.
+		"""
+		self._map(lambda db: db.execute(sql), self.connections)
+
+	def close(self):
+		"""
+		Stop the threads and close the connections established by the Scatter.
+		"""
+		self._executor.shutdown()
+		for db in self._owned:
+			try:
+				db.close()
+			except Exception:
+				pass
+		del self._owned[:]
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, typ, val, tb):
+		self.close()
+
+def _map_worker(connector, sql, first, work, done):
+	"""
+	Execute the batches of parameters taken from `work` until `None` is
+	received, putting the results on `done`.
+	"""
+	db = None
+	try:
+		db = connector()
+		db.connect()
+		ps = db.prepare(sql)
+		call = ps.first if first else ps
+		get = work.get
+		put = done.put
+		while True:
+			x = get()
+			if x is None:
+				break
+			index, batch = x
+			try:
+				put((index, [call(*p) for p in batch]))
+			except BaseException as err:
+				put((index, err))
+	except BaseException as err:
+		done.put((None, err))
+	finally:
+		if db is not None:
+			try:
+				db.close()
+			except Exception:
+				pass
+
+def parallel_map(
+	connector : "`postgresql.api.Connector` used to establish the connections",
+	sql : "the statement executed for each parameter tuple",
+	parameters : "iterable of parameter tuples",
+	workers : "number of connections" = 4,
+	batchsize : "parameter tuples given to a connection at once" = 64,
+	ordered : "produce the results in the order of `parameters`" = True,
+	first : "use the statement's `first` instead of calling it" = False,
+	backlog : "batches in progress per connection" = 2,
+):
+	"""
+	Execute the statement for each parameter tuple using `workers` connections.
+
+	The statement is prepared once on each connection. Batches of `batchsize`
+	parameter tuples are queued and taken by the connections as they become
+	idle, so a connection that gets slow batches does not hold up the others.
+
+	If `ordered` is `True`, the result of each execution is produced in the
+	order of `parameters`. Otherwise, ``(parameters, result)`` pairs are
+	produced as the batches complete.
+
+	`parameters` is read as the results are consumed; at most
+	``workers * backlog`` batches are read ahead, and their results held, at any
+	time.
+	"""
+	if workers < 1:
+		raise ValueError("at least one worker is required")
+	limit = workers * backlog
+	work = Queue()
+	done = Queue()
+	threads = [
+		threading.Thread(
+			target = _map_worker,
+			args = (connector, sql, first, work, done),
+			daemon = True,
+		)
+		for x in range(workers)
+	]
+	for x in threads:
+		x.start()
+
+	batches = chunk(parameters, batchsize)
+	# Batches given out, but not yet produced.
+	outstanding = {}
+	finished = {}
+	submitted = 0
+	produced = 0
+	try:
+		while True:
+			while len(outstanding) < limit:
+				batch = next(batches, None)
+				if batch is None:
+					break
+				outstanding[submitted] = batch
+				work.put((submitted, batch))
+				submitted += 1
+			if not outstanding:
+				break
+
+			index, results = done.get()
+			if isinstance(results, BaseException):
+				raise results
+
+			if ordered:
+				finished[index] = results
+				while produced in finished:
+					del outstanding[produced]
+					yield from finished.pop(produced)
+					produced += 1
+			else:
+				batch = outstanding.pop(index)
+				yield from zip(batch, results)
+	finally:
+		# Discard the batches that have not been taken.
+		try:
+			while True:
+				work.get_nowait()
+		except Empty:
+			pass
+		for x in threads:
+			work.put(None)
+		for x in threads:
+			x.join()
@@ -0,0 +1,93 @@
+##
+# test.perf_copyman_io - copyman file fittings versus iterators
+##
+"""
+Compare moving COPY data between a file and a table using `FileProducer` and
+`FileReceiver` with the `IteratorProducer` and `CallReceiver` equivalents, and
+`transfer` between connections with and without threads.
+
+Run using pg_python::
+
+	$ python3 -m postgresql.bin.pg_python -h localhost -m postgresql.test.perf_copyman_io
+"""
+import os
+import sys
+import time
+import tempfile
+from .. import copyman
+
+def report(title, size, duration):
+	sys.stderr.write("%s: %f seconds, %f MB per second\n" %(
+		title, duration, size / (1024**2) / duration
+	))
+
+def testSpeed(tuples = 1000000):
+	sqlexec("CREATE TEMP TABLE _copy (i int, t text, ts text)")
+	fd, path = tempfile.mkstemp()
+	os.close(fd)
+	try:
+		sys.stderr.write("preparing data(%d tuples)...\n" %(tuples,))
+		with open(path, 'wb') as f:
+			for x in range(tuples):
+				s = str(x).encode('ascii')
+				f.write(s + b'\t' + s * 4 + b'\t2010-01-01 00:00:00\n')
+		size = os.path.getsize(path)
+		load = prepare("COPY _copy FROM STDIN")
+		dump = prepare("COPY _copy TO STDOUT")
+
+		def lines(chunksize = 256):
+			# The iterator path: lines read from the file in chunks.
+			with open(path, 'rb') as f:
+				chunk = []
+				for line in f:
+					chunk.append(line)
+					if len(chunk) == chunksize:
+						yield chunk
+						chunk = []
+				if chunk:
+					yield chunk
+
+		sqlexec("TRUNCATE _copy")
+		start = time.time()
+		copyman.CopyManager(
+			copyman.IteratorProducer(lines()),
+			copyman.StatementReceiver(load),
+		).run()
+		report("IteratorProducer -> COPY FROM STDIN", size, time.time() - start)
+
+		sqlexec("TRUNCATE _copy")
+		start = time.time()
+		copyman.CopyManager(
+			copyman.FileProducer(path),
+			copyman.StatementReceiver(load),
+		).run()
+		report("FileProducer -> COPY FROM STDIN", size, time.time() - start)
+
+		with open(path, 'wb') as f:
+			start = time.time()
+			copyman.transfer(dump, copyman.CallReceiver(f.writelines))
+			report("COPY TO STDOUT -> CallReceiver(file.writelines)", size, time.time() - start)
+
+		start = time.time()
+		copyman.transfer(dump, copyman.FileReceiver(path))
+		report("COPY TO STDOUT -> FileReceiver", size, time.time() - start)
+
+		# The transfers are between two connections; use a remote or
+		# latency-injected server to see the effect of overlapping I/O.
+		dst = connector()
+		dst.connect()
+		try:
+			dst.execute("CREATE TEMP TABLE _copy (i int, t text, ts text)")
+			for threaded in (False, True):
+				dst.execute("TRUNCATE _copy")
+				start = time.time()
+				copyman.transfer(dump, dst.prepare("COPY _copy FROM STDIN"), threaded = threaded)
+				report("transfer(threaded = %r)" %(threaded,), size, time.time() - start)
+		finally:
+			dst.close()
+	finally:
+		os.remove(path)
+		sqlexec("DROP TABLE _copy")
+
+if __name__ == '__main__':
+	testSpeed()
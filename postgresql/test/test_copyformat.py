@@ -0,0 +1,231 @@
+##
+# .test.test_copyformat - test .copyformat
+##
+import io
+import uuid
+import decimal
+import datetime
+import unittest
+from .. import copyformat
+from ..python.structlib import long_pack, long_unpack, short_pack
+from ..temporal import pg_tmp
+from .. import types as pg_types
+
+def binary_copy(rows):
+	"""
+	Build COPY BINARY data for rows of (int4, text) columns.
+	"""
+	parts = [copyformat.binary_signature, b'\x00' * 8]
+	for i, t in rows:
+		parts.append(short_pack(2))
+		parts.append(long_pack(4) + long_pack(i))
+		if t is None:
+			parts.append(long_pack(-1))
+		else:
+			t = t.encode('utf-8')
+			parts.append(long_pack(len(t)) + t)
+	parts.append(short_pack(-1))
+	return b''.join(parts)
+
+sample = [(i, None if i % 3 == 0 else 'row' * i) for i in range(100)]
+
+# (line, delimiter, null, fields)
+text_samples = [
+	(b'\n', b'\t', b'\\N', [b'']),
+	(b'1\tone\n', b'\t', b'\\N', [b'1', b'one']),
+	(b'1\t\\N\r\n', b'\t', b'\\N', [b'1', None]),
+	(b'\\\\N\t\\N', b'\t', b'\\N', [b'\\N', None]),
+	(b'a\\tb\\nc\\\\', b'\t', b'\\N', [b'a\tb\nc\\']),
+	(b'\\b\\f\\r\\v\\q', b'\t', b'\\N', [b'\b\f\r\vq']),
+	(b'\\101\\0\\7777\\x41\\x4g\\xg', b'\t', b'\\N', [b'A\x00\xff7A\x04gxg']),
+	(b'a\\,b,,c', b',', b'', [b'a,b', None, b'c']),
+	(b'\\', b'\t', b'\\N', [b'\\']),
+]
+
+# (line, delimiter, quote, null, fields)
+csv_samples = [
+	(b'\n', b',', b'"', b'', [None]),
+	(b'""\n', b',', b'"', b'', [b'']),
+	(b'1,,"",a\r\n', b',', b'"', b'', [b'1', None, b'', b'a']),
+	(b'"a,b","c""d","e\nf"', b',', b'"', b'', [b'a,b', b'c"d', b'e\nf']),
+	(b'a"b,c"d,e', b',', b'"', b'', [b'ab,cd', b'e']),
+	(b"'x';NULL;'NULL'", b';', b"'", b'NULL', [b'x', None, b'NULL']),
+]
+
+class FakeTypIO(object):
+	def encode(self, x):
+		return x.encode('utf-8')
+
+	def decode(self, x):
+		return x.decode('utf-8')
+
+class test_copyformat(unittest.TestCase):
+	def decoder(self):
+		return copyformat.BinaryDecoder((long_unpack, bytes.decode))
+
+	def testDecodeWhole(self):
+		d = self.decoder()
+		self.assertEqual(d.decode(binary_copy(sample)), sample)
+		d.close()
+
+	def testDecodeSplit(self):
+		data = binary_copy(sample)
+		for size in (1, 2, 3, 7, 19, 64, 1000):
+			d = self.decoder()
+			rows = []
+			for x in range(0, len(data), size * 2):
+				rows.extend(d((data[x:x+size], data[x+size:x+size*2])))
+			d.close()
+			self.assertEqual(rows, sample)
+
+	def testRowConstructor(self):
+		d = copyformat.BinaryDecoder((long_unpack, bytes.decode), row_constructor = list)
+		self.assertEqual(d.decode(binary_copy(sample[:2])), [[0, None], [1, 'row']])
+
+	def testIncomplete(self):
+		d = self.decoder()
+		d.decode(binary_copy(sample)[:-2])
+		self.assertRaises(ValueError, d.close)
+
+	def testInvalid(self):
+		d = self.decoder()
+		self.assertRaises(ValueError, d.decode, b'PGCOPY\n\xff\r\n\x01' + b'\x00' * 8)
+		d = self.decoder()
+		self.assertRaises(ValueError, d.decode, binary_copy(sample) + b'\x00')
+		# wrong number of fields
+		d = copyformat.BinaryDecoder((long_unpack,))
+		self.assertRaises(ValueError, d.decode, binary_copy(sample))
+
+	def testRecordChunks(self):
+		data = ''.join('%d\trow %d\n' %(i, i) for i in range(1000)).encode('ascii')
+		for size in (1, 10, 1000, len(data) * 2):
+			for buffer_size in (1, 7, 4096):
+				chunks = list(copyformat.record_chunks(
+					io.BytesIO(data), size, buffer_size = buffer_size
+				))
+				offset = 0
+				for o, pieces in chunks:
+					c = b''.join(pieces)
+					self.assertEqual(o, offset)
+					self.assertTrue(c.endswith(b'\n'))
+					self.assertTrue(len(c) >= size or o + len(c) == len(data))
+					offset += len(c)
+				self.assertEqual(offset, len(data))
+				# The same chunks regardless of the read size.
+				self.assertEqual(
+					[x[0] for x in chunks],
+					[x[0] for x in copyformat.record_chunks(io.BytesIO(data), size)]
+				)
+
+	def testRecordChunksQuoted(self):
+		records = [b'1,"a\nb"\n', b'2,"""\n"""\n', b'3,c\n', b'4,"\n\n,"\n']
+		data = b''.join(records)
+		for buffer_size in (1, 3, 4096):
+			chunks = copyformat.record_chunks(
+				io.BytesIO(data), 1, quote = b'"', buffer_size = buffer_size
+			)
+			self.assertEqual([b''.join(x[1]) for x in chunks], records)
+		# The final record may lack a newline.
+		chunks = copyformat.record_chunks(io.BytesIO(b'1\n2'), 1)
+		self.assertEqual([b''.join(x[1]) for x in chunks], [b'1\n', b'2'])
+
+	def testTextFields(self):
+		for line, delimiter, null, fields in text_samples:
+			self.assertEqual(copyformat.text_fields(line, delimiter, null), fields)
+		self.assertEqual(copyformat.text_fields(memoryview(b'a\tb\n')), [b'a', b'b'])
+		self.assertRaises(ValueError, copyformat.text_fields, b'a', b'ab')
+
+	def testTextLine(self):
+		fields = [b'a\tb', b'c\\N\n', None, b'', b'\r,']
+		line = copyformat.text_line(fields)
+		self.assertEqual(line, b'a\\tb\tc\\\\N\\n\t\\N\t\t\\r,\n')
+		self.assertEqual(copyformat.text_fields(line), fields)
+		line = copyformat.text_line(fields, b',', b'NULL')
+		self.assertEqual(copyformat.text_fields(line, b',', b'NULL'), fields)
+
+	def testCSVFields(self):
+		for line, delimiter, quote, null, fields in csv_samples:
+			self.assertEqual(copyformat.csv_fields(line, delimiter, quote, null), fields)
+		self.assertRaises(ValueError, copyformat.csv_fields, b'"a')
+		self.assertRaises(ValueError, copyformat.csv_fields, b'a', b'ab')
+
+	def testCSVLine(self):
+		fields = [b'a,b', b'', None, b'c"d', b'e\nf', b'\\.', b'g']
+		line = copyformat.csv_line(fields)
+		self.assertEqual(line, b'"a,b","",,"c""d","e\nf","\\.",g\n')
+		self.assertEqual(copyformat.csv_fields(line), fields)
+
+	def testTextCodec(self):
+		typio = FakeTypIO()
+		oids = (
+			pg_types.INT4OID, pg_types.TEXTOID, pg_types.BOOLOID,
+			pg_types.NUMERICOID, pg_types.BYTEAOID, pg_types.UUIDOID,
+			pg_types.FLOAT8OID,
+		)
+		u = uuid.uuid4()
+		rows = [
+			(1, 'one\ttwo\n\\', True, decimal.Decimal('1.50'), b'\x00\\\xff', u, 0.1),
+			(None, '', False, None, b'', None, float('inf')),
+			(-2, 'sm\u00f8rrebr\u00f8d, "quoted"', None, decimal.Decimal('-0'), None, u, None),
+		]
+		for format in ('text', 'csv'):
+			e = copyformat.TextEncoder(typio, format)
+			d = copyformat.TextDecoder.from_oids(typio, oids, format)
+			lines = e(rows)
+			self.assertEqual(d(lines), rows)
+			self.assertEqual([d.row(x) for x in lines], rows)
+			chunks = list(e.chunks(rows, size = 2))
+			self.assertEqual([len(x) for x in chunks], [2, 1])
+			self.assertEqual(
+				list(copyformat.text_rows(chunks, typio, oids, format)), rows
+			)
+
+	def testTextEncoder(self):
+		e = copyformat.TextEncoder()
+		self.assertEqual(e.line((
+			datetime.date(2000, 1, 2),
+			datetime.datetime(2000, 1, 2, 3, 4, 5),
+			datetime.timedelta(days = 1, seconds = 2),
+			float('nan'),
+		)), b'2000-01-02\t2000-01-02T03:04:05\t1 days 2 seconds 0 microseconds\tNaN\n')
+		e = copyformat.TextEncoder(format = 'csv', formatters = {int : hex})
+		self.assertEqual(e.line((10, None, '')), b'0xa,,""\n')
+		self.assertRaises(ValueError, copyformat.TextEncoder, format = 'binary')
+
+	def testTextDecoderErrors(self):
+		d = copyformat.TextDecoder((int,))
+		self.assertRaises(ValueError, d, [b'x\n'])
+		self.assertRaises(TypeError, d, [b'1\t2\n'])
+
+	@pg_tmp
+	def testTextRows(self):
+		sqlexec("CREATE TEMP TABLE t (i int, t text, b bytea, n numeric)")
+		rows = [
+			(i, None if i % 3 == 0 else 'row,\t"%d"\n' %(i,), bytes([i % 256]) * (i % 5), decimal.Decimal(i) / 4)
+			for i in range(300)
+		]
+		oids = (pg_types.INT4OID, pg_types.TEXTOID, pg_types.BYTEAOID, pg_types.NUMERICOID)
+		for format in ('text', 'csv'):
+			sqlexec("TRUNCATE t")
+			copy = prepare("COPY t FROM STDIN WITH (FORMAT " + format + ")")
+			copy.load_chunks(copyformat.TextEncoder(db.typio, format).chunks(rows, size = 64))
+			self.assertEqual(prepare("SELECT * FROM t ORDER BY i")(), rows)
+			copy = prepare("COPY t TO STDOUT WITH (FORMAT " + format + ")")
+			self.assertEqual(
+				sorted(copyformat.text_rows(copy.chunks(), db.typio, oids, format)),
+				rows
+			)
+			d = copyformat.TextDecoder.from_oids(db.typio, oids, format)
+			self.assertEqual(sorted(d(copy())), rows)
+
+	@pg_tmp
+	def testBinaryRows(self):
+		copy = prepare(
+			"COPY (SELECT i, CASE WHEN i % 3 = 0 THEN NULL ELSE repeat('row', i) END " \
+			"FROM generate_series(0, 99) AS g(i)) TO STDOUT WITH BINARY"
+		)
+		rows = copyformat.binary_rows(copy.chunks(), db.typio, (pg_types.INT4OID, pg_types.TEXTOID))
+		self.assertEqual(list(rows), sample)
+
+if __name__ == '__main__':
+	unittest.main()
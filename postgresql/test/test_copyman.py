@@ -1,8 +1,14 @@
 ##
 # .test.test_copyman - test .copyman
 ##
+import os
+import socket
 import unittest
+import tempfile
+import threading
+import time
 from itertools import islice
+from contextlib import contextmanager
 from .. import copyman
 from ..temporal import pg_tmp
 # The asyncs, and alternative termination.
@@ -548,6 +554,976 @@ class test_copyman(unittest.TestCase):
 		self.assertRaises(Exception, sqlexec, 'select 1')
 		self.assertEqual(dst.prepare(dstcount).first(), 0)
 
+	@pg_tmp
+	def testParallelExport(self):
+		db.execute("CREATE TABLE export_source (i int, t text)")
+		try:
+			db.execute("INSERT INTO export_source SELECT i, i::text FROM generate_series(1, 20000) g(i)")
+			ranges = copyman.ctid_ranges(db, 'export_source', 4)
+			self.assertEqual(len(ranges), 4)
+			received = {}
+			def receiver(index, predicate):
+				received[index] = []
+				return received[index].extend
+			results = copyman.parallel_export(
+				db.connector, 'export_source', ranges, receiver, workers = 3
+			)
+			self.assertEqual(sorted(received), [0, 1, 2, 3])
+			self.assertEqual(sum(x[0] for x in results), 20000)
+			lines = [x for i in sorted(received) for x in received[i]]
+			self.assertEqual(sorted(lines), sorted(stditer + [
+				str(i).encode('ascii') + b'\t' + str(i).encode('ascii') + b'\n'
+				for i in range(10001, 20001)
+			]))
+		finally:
+			db.execute("DROP TABLE export_source")
+
+	@pg_tmp
+	def testFileFittings(self):
+		sqlexec(stdsource)
+		dst = new()
+		dst.execute(stddst)
+		fd, path = tempfile.mkstemp()
+		os.close(fd)
+		try:
+			copyman.transfer(prepare(srcsql), copyman.FileReceiver(path))
+			with open(path, 'rb') as f:
+				self.assertEqual(f.read(), b''.join(stditer))
+			copyman.CopyManager(
+				copyman.FileProducer(path, buffer_size = 1000),
+				copyman.StatementReceiver(dst.prepare(dstsql)),
+			).run()
+			self.assertEqual(dst.prepare(dstcount).first(), stdrowcount)
+			self.assertEqual(dst.prepare(grabdst)(), prepare(grabsrc)())
+		finally:
+			os.remove(path)
+
+	@pg_tmp
+	def testThreadedTransfer(self):
+		sqlexec(stdsource)
+		dsts = [new() for x in range(2)]
+		for x in dsts:
+			x.execute(stddst)
+		copyman.transfer(
+			prepare(srcsql), *[x.prepare(dstsql) for x in dsts], threaded = True
+		)
+		for x in dsts:
+			self.assertEqual(x.prepare(grabdst)(), prepare(grabsrc)())
+
+	@pg_tmp
+	def testTransferProgress(self):
+		sqlexec(stdsource)
+		dst = new()
+		dst.execute(stddst)
+		calls = []
+		copyman.transfer(
+			prepare(srcsql), dst.prepare(dstsql),
+			progress = calls.append, byte_interval = 1024 * 16,
+		)
+		self.assertTrue(len(calls) > 1)
+		m = calls[-1]
+		self.assertEqual(m.producer.rows, stdrowcount)
+		self.assertEqual([x.rows for x in m.receivers.values()], [stdrowcount])
+		self.assertEqual(dst.prepare(dstcount).first(), stdrowcount)
+
+	@pg_tmp
+	def testThrottledTransfer(self):
+		sqlexec(stdsource)
+		dst = new()
+		dst.execute(stddst)
+		t = copyman.Throttle(rows_per_second = 20000, burst = 0)
+		copyman.transfer(prepare(srcsql), dst.prepare(dstsql), throttle = t)
+		self.assertTrue(t.throttled > 0.3)
+		self.assertEqual(dst.prepare(grabdst)(), prepare(grabsrc)())
+		t = copyman.Throttle(rows_per_second = 20000, burst = 0)
+		dst.execute("TRUNCATE destination")
+		dst.prepare(dstsql).load_rows(t.rows(stditer))
+		self.assertTrue(t.throttled > 0.3)
+		self.assertEqual(dst.prepare(dstcount).first(), stdrowcount)
+
+	@pg_tmp
+	def testTransform(self):
+		sqlexec(stdsource)
+		dst = new()
+		dst.execute(stddst)
+		copyman.transfer(
+			prepare(srcsql), dst.prepare(dstsql),
+			transform = copyman.TextTransform(
+				functions = {1 : lambda x: b'masked'},
+				predicate = lambda r: int(r[0]) <= 100,
+			),
+		)
+		self.assertEqual(dst.prepare(dstcount).first(), 100)
+		self.assertEqual(
+			dst.prepare(grabdst)(),
+			[(i, 'masked') for i in range(1, 101)]
+		)
+
+	@pg_tmp
+	def testFanOut(self):
+		sqlexec(stdsource)
+		dsts = [new() for x in range(3)]
+		for x in dsts:
+			x.execute(stddst)
+		cm = copyman.FanOutCopyManager(
+			copyman.StatementProducer(prepare(srcsql)),
+			*[copyman.StatementReceiver(x.prepare(dstsql)) for x in dsts],
+			buffer_limit = 1024
+		)
+		cm.run()
+		for x in dsts:
+			self.assertEqual(x.prepare(dstcount).first(), stdrowcount)
+			self.assertEqual(x.prepare(grabdst)(), prepare(grabsrc)())
+			# The connection is usable after the copy.
+			self.assertEqual(x.prepare("SELECT 1").first(), 1)
+
+	@pg_tmp
+	def testResumeTransfer(self):
+		sqlexec(stdsource)
+		dst = new()
+		dst.execute(stddst)
+		fd, path = tempfile.mkstemp()
+		os.close(fd)
+		os.remove(path)
+		def source(key):
+			return prepare(
+				"COPY (SELECT * FROM source WHERE i > %d ORDER BY i) TO STDOUT" %(
+					0 if key is None else key,
+				)
+			)
+		try:
+			# Emulate an interrupted transfer of the first 2500 rows.
+			cp = copyman.Checkpoint(path)
+			copyman.transfer(
+				prepare("COPY (SELECT * FROM source WHERE i <= 2500 ORDER BY i) TO STDOUT"),
+				copyman.BatchReceiver(dst.prepare(dstsql),
+					checkpoint = cp, name = 'dst', batch_size = 1024, key_column = 0),
+			)
+			self.assertEqual(cp.get('dst')['key'], '2500')
+
+			r = copyman.BatchReceiver(dst.prepare(dstsql),
+				checkpoint = copyman.Checkpoint(path), name = 'dst',
+				batch_size = 1024, key_column = 0,
+			)
+			self.assertEqual(r.last_key, 2500)
+			copyman.resume_transfer(source, r)
+			self.assertEqual(dst.prepare(grabdst)(), prepare(grabsrc)())
+			self.assertEqual(r.rows, stdrowcount)
+		finally:
+			for x in (path, path + '.tmp'):
+				if os.path.exists(x):
+					os.remove(x)
+
+	@pg_tmp
+	def testArchive(self):
+		sqlexec(stdsource)
+		# The restoring connections need to see the table.
+		db.execute("CREATE TABLE archive_destination (i int, t text)")
+		fd, path = tempfile.mkstemp()
+		os.close(fd)
+		grab = prepare("SELECT * FROM archive_destination ORDER BY i")
+		try:
+			copyman.transfer(prepare(srcsql),
+				copyman.ArchiveReceiver(path, block_size = 1024 * 8, workers = 2))
+			self.assertEqual(
+				copyman.parallel_restore(db.connector, path,
+					"COPY archive_destination FROM STDIN", workers = 3),
+				(stdrowcount, len(b''.join(stditer)))
+			)
+			self.assertEqual(grab(), prepare(grabsrc)())
+			db.execute("TRUNCATE archive_destination")
+			copyman.CopyManager(
+				copyman.ArchiveProducer(path),
+				copyman.StatementReceiver(prepare("COPY archive_destination FROM STDIN")),
+			).run()
+			self.assertEqual(grab(), prepare(grabsrc)())
+		finally:
+			os.remove(path)
+			db.execute("DROP TABLE archive_destination")
+
+class test_file_fittings(unittest.TestCase):
+	def setUp(self):
+		fd, self.path = tempfile.mkstemp()
+		os.write(fd, b''.join(stditer))
+		os.close(fd)
+
+	def tearDown(self):
+		os.remove(self.path)
+
+	def testFileProducer(self):
+		for size in (1, 100, 4096, 1024 * 1024):
+			lines = []
+			p = copyman.FileProducer(self.path, buffer_size = size)
+			copyman.CopyManager(p, copyman.CallReceiver(lines.extend)).run()
+			self.assertTrue(all(x.endswith(b'\n') for x in lines))
+			self.assertEqual(b''.join(lines), b''.join(stditer))
+			self.assertTrue(all(len(x) <= max(size, 12) for x in lines))
+			self.assertEqual(p.total_messages, len(lines))
+			self.assertEqual(p.total_rows, len(stditer))
+
+	def testRows(self):
+		# The lines of the messages are counted as rows.
+		r = copyman.CallReceiver(lambda x: None)
+		p = copyman.FileProducer(self.path, buffer_size = 16 * 1024)
+		cm = copyman.CopyManager(p, r)
+		cm.run()
+		self.assertTrue(p.total_messages < len(stditer))
+		self.assertEqual(cm.metrics.producer.rows, len(stditer))
+		self.assertEqual(cm.metrics.receiver(r).rows, len(stditer))
+		self.assertEqual(cm.metrics.statistics()['producer']['rows'], len(stditer))
+		# An unterminated last line is a row.
+		with open(self.path, 'ab') as f:
+			f.write(b'10000\tlast')
+		p = copyman.FileProducer(self.path, buffer_size = 16 * 1024)
+		copyman.CopyManager(p, copyman.CallReceiver(lambda x: None)).run()
+		self.assertEqual(p.total_rows, len(stditer) + 1)
+
+	def testEmptyFile(self):
+		with open(self.path, 'wb'):
+			pass
+		lines = []
+		copyman.CopyManager(
+			copyman.FileProducer(self.path), copyman.CallReceiver(lines.extend)
+		).run()
+		self.assertEqual(lines, [])
+
+	def testFileReceiver(self):
+		with tempfile.TemporaryFile() as f:
+			f.write(b'header\n')
+			r = copyman.FileReceiver(f, buffer_size = 100)
+			# Force partial batches.
+			r.iov_max = 7
+			copyman.CopyManager(copyman.IteratorProducer([stditer[:500], stditer[500:]]), r).run()
+			self.assertFalse(f.closed)
+			f.seek(0)
+			self.assertEqual(f.read(), b'header\n' + b''.join(stditer))
+			self.assertEqual(r.total_bytes, len(b''.join(stditer)))
+
+class test_threaded(unittest.TestCase):
+	def chunks(self):
+		return [stditer[i:i+100] for i in range(0, len(stditer), 100)]
+
+	def testRun(self):
+		received = [[], []]
+		cm = copyman.ThreadedCopyManager(
+			copyman.IteratorProducer(self.chunks()),
+			copyman.CallReceiver(received[0].extend),
+			copyman.CallReceiver(received[1].extend),
+			queue_size = 2,
+		)
+		cm.run()
+		self.assertEqual(received, [stditer, stditer])
+
+	def testProtocolConversion(self):
+		# Chunks to PQv3 and back again.
+		received = []
+		cm = copyman.ThreadedCopyManager(
+			copyman.FileProducer(__file__, buffer_size = 128),
+			copyman.CallReceiver(received.extend),
+		)
+		cm.run()
+		with open(__file__, 'rb') as f:
+			self.assertEqual(b''.join(received), f.read())
+
+	def testReconcile(self):
+		received = []
+		failed = [False]
+		def fail_once(lines):
+			if not failed[0] and len(received) >= 5000:
+				failed[0] = True
+				raise ValueError("fault")
+			received.extend(lines)
+		r = copyman.CallReceiver(fail_once)
+		cm = copyman.ThreadedCopyManager(
+			copyman.IteratorProducer(self.chunks()), r, queue_size = 3
+		)
+		faults = 0
+		with cm:
+			while True:
+				try:
+					for x in cm:
+						pass
+					break
+				except copyman.ReceiverFault as rf:
+					faults += 1
+					self.assertTrue(r in rf.faults)
+					self.assertEqual(len(cm.receivers), 0)
+					cm.reconcile(r)
+		self.assertEqual(faults, 1)
+		self.assertEqual(received, stditer)
+
+	def testReconcileFullQueue(self):
+		# The receiver faults while the producer waits on its full queue.
+		lines = [str(i).encode('ascii') + b'\n' for i in range(1000)]
+		received = []
+		failed = [False]
+		def fail_once(data):
+			if not failed[0] and len(received) >= 340:
+				while not cm._threads[r][0].full():
+					time.sleep(0.01)
+				failed[0] = True
+				raise ValueError("fault")
+			received.extend(data)
+		r = copyman.CallReceiver(fail_once)
+		cm = copyman.ThreadedCopyManager(
+			copyman.IteratorProducer([lines[i:i+10] for i in range(0, 1000, 10)]),
+			r, queue_size = 3
+		)
+		faults = 0
+		with cm:
+			while True:
+				try:
+					for x in cm:
+						pass
+					break
+				except copyman.ReceiverFault as rf:
+					faults += 1
+					cm.reconcile(r)
+		self.assertEqual(faults, 1)
+		self.assertEqual(received, lines)
+
+	def testFaultFails(self):
+		def fail(lines):
+			raise ValueError("fault")
+		received = []
+		cm = copyman.ThreadedCopyManager(
+			copyman.IteratorProducer(self.chunks()),
+			copyman.CallReceiver(fail),
+			copyman.CallReceiver(received.extend),
+		)
+		self.assertRaises(copyman.CopyFail, cm.run)
+
+class SocketReceiver(copyman.ProtocolReceiver):
+	_e_factors = ('send',)
+
+class test_fan_out(unittest.TestCase):
+	def chunks(self):
+		return [stditer[i:i+100] for i in range(0, len(stditer), 100)]
+
+	def packed(self, chunks):
+		# The lines are joined across reads; the managers hold them until the
+		# end of the COPY when flush_delay is None.
+		pack = copyman.CopyDataPacker()
+		return b''.join(pack(x) for x in chunks) + pack.flush()
+
+	def reader(self, sock, received):
+		def read():
+			while True:
+				data = sock.recv(4096)
+				if not data:
+					break
+				received.append(data)
+		t = threading.Thread(target = read)
+		t.start()
+		return t
+
+	def testFanOut(self):
+		pairs = [socket.socketpair() for x in range(3)]
+		try:
+			received = [[] for x in pairs]
+			readers = [self.reader(b, r) for (a, b), r in zip(pairs, received)]
+			lines = []
+			receivers = [SocketReceiver(a.send) for a, b in pairs]
+			cm = copyman.FanOutCopyManager(
+				copyman.IteratorProducer(self.chunks()),
+				copyman.CallReceiver(lines.extend),
+				*receivers, buffer_limit = 1024
+			)
+			cm.flush_delay = None
+			cm.run()
+			for a, b in pairs:
+				# Blocking mode is restored.
+				self.assertEqual(a.gettimeout(), None)
+				a.shutdown(socket.SHUT_WR)
+			for x in readers:
+				x.join()
+			self.assertEqual(lines, stditer)
+			expected = self.packed(self.chunks())
+			for x in received:
+				self.assertEqual(b''.join(x), expected)
+			self.assertEqual(cm.dropped, [])
+		finally:
+			for a, b in pairs:
+				a.close()
+				b.close()
+
+	def testDropLagging(self):
+		fast = socket.socketpair()
+		slow = socket.socketpair()
+		try:
+			received = []
+			reader = self.reader(fast[1], received)
+			lagging = SocketReceiver(slow[0].send)
+			cm = copyman.FanOutCopyManager(
+				copyman.IteratorProducer(self.chunks() * 50),
+				SocketReceiver(fast[0].send), lagging,
+				buffer_limit = 1024 * 1024, drop_lagging = True,
+			)
+			cm.flush_delay = None
+			# The slow socket is never read.
+			cm.run()
+			fast[0].shutdown(socket.SHUT_WR)
+			reader.join()
+			self.assertEqual(cm.dropped, [lagging])
+			self.assertEqual(slow[0].fileno(), -1)
+			self.assertEqual(b''.join(received), self.packed(self.chunks() * 50))
+		finally:
+			for x in fast + slow:
+				x.close()
+
+	def testFaultFails(self):
+		a, b = socket.socketpair()
+		try:
+			b.close()
+			cm = copyman.FanOutCopyManager(
+				copyman.IteratorProducer(self.chunks()),
+				SocketReceiver(a.send),
+			)
+			self.assertRaises(copyman.CopyFail, cm.run)
+		finally:
+			a.close()
+
+class test_packer(unittest.TestCase):
+	def messages(self, data):
+		from ..protocol.buffer import pq_message_stream
+		b = pq_message_stream()
+		b.write(data)
+		return b.read()
+
+	def testPacking(self):
+		for size in (1, 100, 4096, 1024 * 1024):
+			pack = copyman.CopyDataPacker(size)
+			data = pack(stditer) + pack.flush()
+			messages = self.messages(data)
+			self.assertTrue(all(x[0] == b'd' for x in messages))
+			self.assertEqual(b''.join(x[1] for x in messages), b''.join(stditer))
+			self.assertTrue(all(len(x[1]) >= size for x in messages[:-1]))
+		self.assertEqual(copyman.CopyDataPacker(0)(stditer), cat_messages(stditer))
+		self.assertEqual(copyman.CopyDataPacker()([]), b'')
+		self.assertEqual(copyman.CopyDataPacker().flush(), b'')
+
+	def testHeld(self):
+		# Lines that do not fill a message are held across lists.
+		pack = copyman.CopyDataPacker(1024)
+		data = b''.join(pack([x]) for x in stditer) + pack.flush()
+		messages = self.messages(data)
+		self.assertEqual(b''.join(x[1] for x in messages), b''.join(stditer))
+		self.assertTrue(all(len(x[1]) >= 1024 for x in messages[:-1]))
+		self.assertTrue(len(messages) < len(stditer) / 50)
+		self.assertEqual(pack.flush(), b'')
+		# Held views are detached from the caller's buffer.
+		buf = bytearray(b'first\n')
+		self.assertEqual(pack([memoryview(buf)]), b'')
+		buf[:] = b'other\n'
+		self.assertEqual(self.messages(pack.flush()), [(b'd', b'first\n')])
+
+	def testDelay(self):
+		time = FakeTime()
+		pack = copyman.CopyDataPacker(1024, delay = 1.0, clock = time.clock)
+		self.assertEqual(pack([b'a\n']), b'')
+		time.now += 0.5
+		self.assertEqual(pack([b'b\n']), b'')
+		# The delay is from the oldest held line.
+		time.now += 0.5
+		self.assertEqual(self.messages(pack([b'c\n'])), [(b'd', b'a\nb\nc\n')])
+		self.assertEqual(pack.flush(), b'')
+
+	def testManager(self):
+		received = []
+		cm = copyman.CopyManager(
+			copyman.IteratorProducer([stditer[:5000], stditer[5000:]]),
+			SocketReceiver(lambda x: received.append(bytes(x)) or len(x)),
+			message_size = 1024,
+		)
+		cm.run()
+		messages = self.messages(b''.join(received))
+		self.assertEqual(b''.join(x[1] for x in messages), b''.join(stditer))
+		self.assertTrue(len(messages) < len(stditer) / 50)
+
+	def testManagerAcrossReads(self):
+		# Reads of single lines are still joined into full messages.
+		received = []
+		cm = copyman.CopyManager(
+			copyman.IteratorProducer([[x] for x in stditer]),
+			SocketReceiver(lambda x: received.append(bytes(x)) or len(x)),
+			message_size = 1024,
+		)
+		cm.flush_delay = None
+		cm.run()
+		messages = self.messages(b''.join(received))
+		self.assertEqual(b''.join(x[1] for x in messages), b''.join(stditer))
+		self.assertTrue(all(len(x[1]) >= 1024 for x in messages[:-1]))
+		self.assertEqual(cm.metrics.producer.rows, len(stditer))
+
+class FakeTime(object):
+	def __init__(self):
+		self.now = 0.0
+
+	def clock(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.now += seconds
+
+class test_throttle(unittest.TestCase):
+	def throttle(self, **kw):
+		self.time = FakeTime()
+		return copyman.Throttle(clock = self.time.clock, sleep = self.time.sleep, **kw)
+
+	def testBytes(self):
+		t = self.throttle(bytes_per_second = 100)
+		# The bucket starts full.
+		self.assertEqual(t(100), 0)
+		self.assertEqual(t(100), 1.0)
+		self.assertEqual(t(50), 0.5)
+		self.assertEqual(t.throttled, 1.5)
+		# Idle time refills the bucket up to the burst.
+		self.time.now += 10
+		self.assertEqual(t(100), 0)
+		self.assertEqual(t(50), 0.5)
+
+	def testRows(self):
+		t = self.throttle(bytes_per_second = 1000, rows_per_second = 10, burst = 0)
+		# The slowest rate is waited for.
+		self.assertEqual(t(100, 5), 0.5)
+		self.assertEqual(t(900, 1), 0.9)
+
+	def testAdjust(self):
+		t = self.throttle()
+		self.assertEqual(t(10 ** 9, 10 ** 9), 0)
+		t.bytes_per_second = 100
+		self.assertEqual(t(200), 1.0)
+		t.bytes_per_second = 200
+		self.assertEqual(t(200), 1.0)
+		t.bytes_per_second = None
+		self.assertEqual(t(10 ** 9), 0)
+		self.assertEqual(t.throttled, 2.0)
+
+	def testRate(self):
+		for rate in (0, -1, 0.0):
+			self.assertRaises(ValueError, self.throttle, bytes_per_second = rate)
+			self.assertRaises(ValueError, self.throttle, rows_per_second = rate)
+		t = self.throttle(bytes_per_second = 100)
+		self.assertRaises(ValueError, setattr, t, 'bytes_per_second', 0)
+		self.assertEqual(t.bytes_per_second, 100)
+
+	def testTupleSize(self):
+		self.assertEqual(copyman.tuple_size(()), 0)
+		self.assertEqual(copyman.tuple_size((None,)), 1)
+		self.assertEqual(copyman.tuple_size(('abc', b'de', 123, None)), 12)
+
+	def testTupleBytes(self):
+		# Parameter tuples are charged to the byte rate.
+		t = self.throttle(bytes_per_second = 100, burst = 0)
+		rows = [(i, 'x' * 8) for i in range(10, 20)]
+		self.assertEqual(list(t.rows(rows, chunksize = 5)), rows)
+		self.assertAlmostEqual(t.throttled, 1.2)
+		t = self.throttle(bytes_per_second = 100, burst = 0)
+		self.assertEqual(list(t.rows(rows, size = lambda x: 10)), rows)
+		self.assertAlmostEqual(t.throttled, 1.0)
+
+	def testChunks(self):
+		t = self.throttle(rows_per_second = 100, burst = 0)
+		chunks = [stditer[i:i+100] for i in range(0, 1000, 100)]
+		self.assertEqual(list(t.chunks(chunks)), chunks)
+		self.assertAlmostEqual(t.throttled, 10.0)
+		t = self.throttle(rows_per_second = 100, burst = 0)
+		rows = list(range(1000))
+		self.assertEqual(list(t.rows(rows, chunksize = 50)), rows)
+		self.assertAlmostEqual(t.throttled, 10.0)
+
+	def testManager(self):
+		chunks = [stditer[i:i+100] for i in range(0, len(stditer), 100)]
+		for cmt in (copyman.CopyManager, copyman.ThreadedCopyManager):
+			p = copyman.IteratorProducer(chunks)
+			p.throttle = self.throttle(rows_per_second = 1000, burst = 0)
+			lines = []
+			r = copyman.CallReceiver(lines.extend)
+			r.throttle = copyman.Throttle(bytes_per_second = 10 ** 9)
+			cm = cmt(p, r)
+			cm.run()
+			self.assertEqual(lines, stditer)
+			self.assertAlmostEqual(cm.metrics.producer.throttled, 10.0)
+			self.assertAlmostEqual(self.time.now, 10.0)
+			self.assertTrue(cm.metrics.receiver(r).throttled >= 0)
+			self.assertAlmostEqual(
+				cm.metrics.statistics()['producer']['throttled'], 10.0
+			)
+
+		# The lines of a FileProducer's messages are charged as rows.
+		fd, path = tempfile.mkstemp()
+		try:
+			os.write(fd, b''.join(stditer))
+			os.close(fd)
+			for cmt in (copyman.CopyManager, copyman.ThreadedCopyManager):
+				p = copyman.FileProducer(path, buffer_size = 64 * 1024)
+				p.throttle = self.throttle(rows_per_second = 1000, burst = 0)
+				r = copyman.CallReceiver(list)
+				r.throttle = copyman.Throttle(rows_per_second = 10 ** 9)
+				cm = cmt(p, r)
+				cm.run()
+				self.assertAlmostEqual(cm.metrics.producer.throttled, 10.0)
+				self.assertAlmostEqual(self.time.now, 10.0)
+		finally:
+			os.remove(path)
+
+	def testReceiver(self):
+		chunks = [stditer[i:i+100] for i in range(0, len(stditer), 100)]
+		for cmt in (copyman.CopyManager, copyman.ThreadedCopyManager):
+			r = copyman.CallReceiver(list)
+			r.throttle = self.throttle(rows_per_second = 5000, burst = 0)
+			cm = cmt(copyman.IteratorProducer(chunks), r)
+			cm.run()
+			self.assertAlmostEqual(cm.metrics.receiver(r).throttled, 2.0)
+			self.assertEqual(cm.metrics.producer.throttled, 0)
+
+class test_metrics(unittest.TestCase):
+	def chunks(self):
+		return [stditer[i:i+100] for i in range(0, len(stditer), 100)]
+
+	def testCounts(self):
+		size = len(b''.join(stditer))
+		lines = []
+		r = copyman.CallReceiver(lines.extend)
+		cm = copyman.CopyManager(copyman.IteratorProducer(self.chunks()), r)
+		cm.run()
+		m = cm.metrics
+		self.assertEqual(m.producer.rows, len(stditer))
+		self.assertEqual(m.producer.bytes, size)
+		self.assertEqual(
+			m.producer.high_water, max(len(b''.join(x)) for x in self.chunks())
+		)
+		self.assertEqual(m.receiver(r).rows, len(stditer))
+		self.assertEqual(m.receiver(r).bytes, size)
+		self.assertEqual(m.receiver(r).faults, 0)
+		stats = m.statistics()
+		self.assertTrue(stats['elapsed'] > 0)
+		self.assertEqual(stats['producer']['bytes'], size)
+		self.assertEqual(stats['receivers'][0]['receiver'], r)
+
+	def testProgress(self):
+		calls = []
+		def progress(metrics):
+			calls.append(metrics.producer.bytes)
+		cm = copyman.CopyManager(
+			copyman.IteratorProducer(self.chunks()),
+			copyman.CallReceiver(list),
+		)
+		size = len(b''.join(stditer))
+		interval = size // 4
+		cm.run(progress = progress, interval = None, byte_interval = interval)
+		# The intervals and the completion.
+		self.assertTrue(len(calls) >= 4)
+		self.assertEqual(calls[-1], size)
+		self.assertTrue(calls[0] >= interval)
+		for a, b in zip(calls[:-2], calls[1:-1]):
+			self.assertTrue(b - a >= interval)
+
+	def testBottleneck(self):
+		def slow(lines):
+			time.sleep(0.002)
+		fast = copyman.CallReceiver(list)
+		slow = copyman.CallReceiver(slow)
+		for cmt in (copyman.CopyManager, copyman.ThreadedCopyManager):
+			cm = cmt(copyman.IteratorProducer(self.chunks()), fast, slow)
+			cm.run()
+			self.assertTrue(cm.metrics.bottleneck is slow)
+			self.assertTrue(
+				cm.metrics.receiver(slow).blocked > cm.metrics.receiver(fast).blocked
+			)
+
+	def testFaults(self):
+		def fail(lines):
+			raise ValueError("fault")
+		r = copyman.CallReceiver(fail)
+		cm = copyman.CopyManager(
+			copyman.IteratorProducer(self.chunks()),
+			r, copyman.CallReceiver(list),
+		)
+		self.assertRaises(copyman.CopyFail, cm.run)
+		self.assertEqual(cm.metrics.receiver(r).faults, 1)
+
+		def produce():
+			yield stditer[:10]
+			raise ValueError("fault")
+		cm = copyman.CopyManager(
+			copyman.IteratorProducer(produce()), copyman.CallReceiver(list),
+		)
+		self.assertRaises(copyman.CopyFail, cm.run)
+		self.assertEqual(cm.metrics.producer.faults, 1)
+		self.assertEqual(cm.metrics.producer.rows, 10)
+
+class test_transform(unittest.TestCase):
+	def chunks(self):
+		return [stditer[i:i+100] for i in range(0, len(stditer), 100)]
+
+	def testTextTransform(self):
+		t = copyman.TextTransform(
+			functions = {1 : lambda x: b'x' * len(x)},
+			predicate = lambda r: int(r[0]) % 2 == 0,
+		)
+		lines = []
+		cm = copyman.CopyManager(
+			copyman.IteratorProducer(self.chunks()),
+			copyman.CallReceiver(lines.extend),
+			transform = t,
+		)
+		cm.run()
+		expected = [
+			str(i).encode('ascii') + b'\t' + b'x' * len(str(i)) + b'\n'
+			for i in range(2, 10001, 2)
+		]
+		self.assertEqual(lines, expected)
+		self.assertEqual(cm.metrics.producer.rows, len(stditer))
+		self.assertEqual(list(cm.metrics.receivers.values())[0].rows, len(expected))
+
+	def testVectorized(self):
+		def nullify(column):
+			return [None if int(x) > 5000 else x for x in column]
+		t = copyman.TextTransform(vectorized = {1 : nullify})
+		lines = []
+		copyman.CopyManager(
+			copyman.IteratorProducer(self.chunks()),
+			copyman.CallReceiver(lines.extend),
+			transform = t,
+		).run()
+		self.assertEqual(lines[:5000], stditer[:5000])
+		self.assertEqual(lines[5000], b'5001\t\\N\n')
+
+	def testMessageBoundaries(self):
+		# PQv3 to PQv3 with messages split across reads.
+		received = []
+		fd, path = tempfile.mkstemp()
+		try:
+			os.write(fd, b''.join(stditer))
+			os.close(fd)
+			t = copyman.TextTransform(functions = {0 : lambda x: x + b'0'})
+			for cmt in (copyman.CopyManager, copyman.ThreadedCopyManager):
+				del received[:]
+				p = copyman.FileProducer(path, buffer_size = 37)
+				r = copyman.CallReceiver(received.extend)
+				cmt(p, r, transform = t).run()
+				self.assertEqual(
+					received, [x.replace(b'\t', b'0\t', 1) for x in stditer]
+				)
+		finally:
+			os.remove(path)
+
+	def testSpanningRows(self):
+		lines = []
+		cm = copyman.CopyManager(
+			copyman.IteratorProducer([[b'1\t', b'a\n2'], [b'\tb\n3\t'], [b'c']]),
+			copyman.CallReceiver(lines.extend),
+			transform = copyman.TextTransform(functions = {1 : bytes.upper}),
+		)
+		cm.run()
+		# The final row is flushed when the producer is exhausted.
+		self.assertEqual(lines, [b'1\tA\n', b'2\tB\n', b'3\tC\n'])
+		self.assertEqual(list(cm.metrics.receivers.values())[0].rows, 3)
+
+	def testUnchanged(self):
+		lines = []
+		copyman.CopyManager(
+			copyman.IteratorProducer(self.chunks()),
+			copyman.CallReceiver(lines.extend),
+			transform = copyman.TextTransform(),
+		).run()
+		self.assertEqual(lines, stditer)
+
+class test_archive(unittest.TestCase):
+	def setUp(self):
+		fd, self.path = tempfile.mkstemp()
+		os.close(fd)
+
+	def tearDown(self):
+		os.remove(self.path)
+
+	def chunks(self):
+		return [stditer[i:i+100] for i in range(0, len(stditer), 100)]
+
+	def testRoundTrip(self):
+		for codec in copyman.archive_codecs:
+			r = copyman.ArchiveReceiver(self.path, codec = codec,
+				block_size = 4096, workers = 2)
+			copyman.CopyManager(copyman.IteratorProducer(self.chunks()), r).run()
+			self.assertTrue(r.blocks > 1)
+			self.assertEqual(r.total_bytes, len(b''.join(stditer)))
+			self.assertTrue(r.compressed_bytes < r.total_bytes)
+
+			lines = []
+			p = copyman.ArchiveProducer(self.path, workers = 2)
+			copyman.CopyManager(p, copyman.CallReceiver(lines.extend)).run()
+			self.assertEqual(p.codec, codec)
+			self.assertEqual(b''.join(lines), b''.join(stditer))
+			self.assertEqual(p.total_messages, len(stditer))
+
+	def testBlocks(self):
+		r = copyman.ArchiveReceiver(self.path, codec = 'gzip', block_size = 4096)
+		copyman.CopyManager(copyman.IteratorProducer(self.chunks()), r).run()
+		# The blocks can be decompressed independently.
+		with open(self.path, 'rb') as f:
+			self.assertEqual(copyman._archive_codec(f), 'gzip')
+			blocks = list(copyman._archive_frames(f))
+		self.assertEqual(len(blocks), r.blocks)
+		self.assertEqual(sum(x[0] for x in blocks), len(stditer))
+		data = [copyman.archive_codecs['gzip'][1](x[2]) for x in blocks]
+		self.assertTrue(all(x.endswith(b'\n') for x in data))
+		self.assertEqual(b''.join(data), b''.join(stditer))
+
+	def testMultiLineMessages(self):
+		# Bodies holding many lines, as a FileProducer produces.
+		fd, source = tempfile.mkstemp()
+		try:
+			os.write(fd, b''.join(stditer))
+			os.close(fd)
+			for p in (
+				copyman.IteratorProducer([
+					[b''.join(stditer[i:i+100])] for i in range(0, len(stditer), 100)
+				]),
+				copyman.FileProducer(source, buffer_size = 4096),
+			):
+				r = copyman.ArchiveReceiver(self.path, block_size = 8192)
+				copyman.CopyManager(p, r).run()
+				with open(self.path, 'rb') as f:
+					copyman._archive_codec(f)
+					self.assertEqual(
+						sum(x[0] for x in copyman._archive_frames(f)), len(stditer)
+					)
+				p = copyman.ArchiveProducer(self.path)
+				copyman.CopyManager(p, copyman.CallReceiver(list)).run()
+				self.assertEqual(p.total_rows, len(stditer))
+		finally:
+			os.remove(source)
+
+	def testTruncated(self):
+		copyman.CopyManager(
+			copyman.IteratorProducer(self.chunks()),
+			copyman.ArchiveReceiver(self.path, block_size = 4096),
+		).run()
+		with open(self.path, 'rb+') as f:
+			f.truncate(os.path.getsize(self.path) - 12)
+		cm = copyman.CopyManager(
+			copyman.ArchiveProducer(self.path),
+			copyman.CallReceiver(list),
+		)
+		self.assertRaises(copyman.CopyFail, cm.run)
+
+	def testNotArchive(self):
+		with open(self.path, 'wb') as f:
+			f.write(b''.join(stditer))
+		cm = copyman.CopyManager(
+			copyman.ArchiveProducer(self.path), copyman.CallReceiver(list),
+		)
+		self.assertRaises(ValueError, cm.run)
+		self.assertRaises(ValueError, copyman.ArchiveReceiver, self.path, codec = 'zip')
+
+class FakeCopyStatement(object):
+	"""
+	``COPY ... FROM STDIN`` stand-in keeping the lines of committed transactions.
+	"""
+	def __init__(self, fail_after = None):
+		self.database = self
+		self.committed = []
+		self.fail_after = fail_after
+
+	@contextmanager
+	def xact(self):
+		self._staged = []
+		yield
+		self.committed.extend(self._staged)
+
+	def load_chunks(self, chunks):
+		if self.fail_after is not None and len(self.committed) >= self.fail_after:
+			raise RuntimeError("connection lost")
+		for x in chunks:
+			self._staged.extend(bytes(y) for y in x)
+
+class test_checkpoint(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.data = os.path.join(self.dir, 'data')
+		with open(self.data, 'wb') as f:
+			f.write(b''.join(stditer))
+		self.checkpoint = os.path.join(self.dir, 'checkpoint')
+
+	def tearDown(self):
+		for x in os.listdir(self.dir):
+			os.remove(os.path.join(self.dir, x))
+		os.rmdir(self.dir)
+
+	def receiver(self, statement, name, checkpoint = None, **kw):
+		return copyman.BatchReceiver(statement,
+			checkpoint = checkpoint or copyman.Checkpoint(self.checkpoint),
+			name = name, batch_size = 1000, **kw
+		)
+
+	def testCheckpoint(self):
+		cp = copyman.Checkpoint(self.checkpoint)
+		self.assertEqual(cp.get('a'), {'rows' : 0, 'bytes' : 0, 'key' : None})
+		cp.record('a', 10, 100, '10')
+		self.assertEqual(copyman.Checkpoint(self.checkpoint).get('a'),
+			{'rows' : 10, 'bytes' : 100, 'key' : '10'})
+		# The temporary file was replaced.
+		self.assertEqual(sorted(os.listdir(self.dir)), ['checkpoint', 'data'])
+
+	def testBatches(self):
+		s = FakeCopyStatement()
+		r = self.receiver(s, 'dst', key_column = 0)
+		copyman.CopyManager(copyman.IteratorProducer([stditer]), r).run()
+		self.assertEqual(s.committed, stditer)
+		state = copyman.Checkpoint(self.checkpoint).get('dst')
+		self.assertEqual(state, {
+			'rows' : len(stditer),
+			'bytes' : len(b''.join(stditer)),
+			'key' : '10000',
+		})
+
+	def testResumeFile(self):
+		total = b''.join(stditer)
+		ahead = FakeCopyStatement(fail_after = 100)
+		behind = FakeCopyStatement(fail_after = 30)
+		for s, name in ((ahead, 'ahead'), (behind, 'behind')):
+			self.assertRaises(copyman.CopyFail, copyman.resume_transfer,
+				self.data, self.receiver(s, name), buffer_size = 500,
+			)
+			s.fail_after = None
+		self.assertTrue(0 < len(behind.committed) < len(ahead.committed))
+
+		# Only the data after the committed offset of the receiver that is
+		# behind is read, and the other receiver discards what it has.
+		offset = len(b''.join(behind.committed))
+		cp = copyman.Checkpoint(self.checkpoint)
+		messages, size = copyman.resume_transfer(self.data,
+			self.receiver(ahead, 'ahead', cp), self.receiver(behind, 'behind', cp),
+			buffer_size = 500,
+		)
+		self.assertEqual(b''.join(ahead.committed), total)
+		self.assertEqual(b''.join(behind.committed), total)
+		self.assertEqual(size, len(total) - offset + (messages * 5))
+		cp = copyman.Checkpoint(self.checkpoint)
+		for name in ('ahead', 'behind'):
+			self.assertEqual(cp.get(name), {
+				'rows' : len(stditer), 'bytes' : len(total), 'key' : None
+			})
+
+	def testResumeAfterKey(self):
+		first = FakeCopyStatement()
+		r = self.receiver(first, 'a', key_column = 0)
+		copyman.CopyManager(copyman.IteratorProducer([stditer[:4321]]), r).run()
+		b = self.receiver(FakeCopyStatement(), 'b', key_column = 0)
+		copyman.CopyManager(copyman.IteratorProducer([stditer[:1000]]), b).run()
+
+		a = self.receiver(first, 'a', key_column = 0)
+		self.assertEqual(a.last_key, 4321)
+		# The source produces the rows after the smallest key.
+		a.resume_after(1000)
+		copyman.CopyManager(copyman.IteratorProducer([stditer[1000:]]), a).run()
+		self.assertEqual(first.committed, stditer)
+
+	def testNameRequired(self):
+		self.assertRaises(ValueError, copyman.BatchReceiver,
+			FakeCopyStatement(), checkpoint = copyman.Checkpoint(self.checkpoint))
+
 from ..copyman import WireState
 
 class test_WireState(unittest.TestCase):
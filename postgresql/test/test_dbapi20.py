@@ -803,6 +803,24 @@ class test_dbapi20(unittest.TestCase):
 			con.close()
 			con2.close()
 
+	def test_autocommit_stream(self):
+		con = self._connect()
+		try:
+			con.autocommit = True
+			cur = con.cursor()
+			cur.execute("select i from generate_series(1, 10000) as g(i)")
+			self.assertEqual(cur.fetchone(), (1,))
+			# Streamed in a transaction block, not a WITH HOLD cursor.
+			self.assertEqual(con.pq.state, b'T')
+			self.assertEqual(len(cur.fetchall()), 9999)
+			self.assertEqual(con.pq.state, b'I')
+			cur.execute("select i from generate_series(1, 10000) as g(i)")
+			cur.fetchmany(10)
+			cur.close()
+			self.assertEqual(con.pq.state, b'I')
+		finally:
+			con.close()
+
 	def test_None(self):
 		con = self._connect()
 		try:
@@ -877,5 +895,78 @@ class test_dbapi20(unittest.TestCase):
 		finally:
 			con.close()
 
+	def test_executemany_returning(self):
+		con = self._connect()
+		try:
+			cur = con.cursor()
+			cur.execute("create temp table ids (id serial, name text)")
+			cur.executemany(
+				"insert into ids (name) values (%s) returning id, name",
+				[(str(i),) for i in range(600)]
+			)
+			self.assertEqual(cur.rowcount, 600)
+			self.assertEqual(cur.description[0][0], 'id')
+			self.assertEqual(cur.fetchone(), (1, '0'))
+			rows = cur.fetchall()
+			self.assertEqual(len(rows), 599)
+			self.assertEqual(rows[-1], (600, '599'))
+			cur.executemany(
+				"update ids set name = name || 'x' where id <= %(id)s",
+				[{'id': 1}, {'id': 3}]
+			)
+			self.assertEqual(cur.rowcount, 4)
+			self.assertEqual(cur.description, None)
+			self.assertRaises(self.driver.Error, cur.fetchone)
+		finally:
+			con.close()
+
+	def test_statement_cache(self):
+		con = self._connect()
+		try:
+			c = con.cursor()
+			c.execute("SELECT %s::int", (1,))
+			ps = con._statement_cache["SELECT %s::int"][0]
+			c.execute("SELECT %s::int", (2,))
+			self.assertEqual(c.fetchone()[0], 2)
+			self.assertTrue(con._statement_cache["SELECT %s::int"][0] is ps)
+			c.execute("SELECT %(x)s::int", {'x': 3})
+			self.assertEqual(c.fetchone()[0], 3)
+			# Least recently used statements are evicted.
+			con.statement_cache_size = 2
+			c.execute("SELECT 4")
+			self.assertEqual(c.fetchone()[0], 4)
+			self.assertEqual(
+				list(con._statement_cache.keys()), ["SELECT %(x)s::int", "SELECT 4"]
+			)
+			# Closed statements are prepared again.
+			con._statement_cache["SELECT 4"][0].close()
+			c.execute("SELECT 4")
+			self.assertEqual(c.fetchone()[0], 4)
+			con.statement_cache_size = 0
+			con.clear_statement_cache()
+			c.execute("SELECT 5")
+			self.assertEqual(con._statement_cache, None)
+		finally:
+			con.close()
+
+	def test_statement_cache_replan(self):
+		con = self._connect()
+		try:
+			c = con.cursor()
+			c.execute("CREATE TEMP TABLE replan (i int)")
+			con.commit()
+			sql = "INSERT INTO replan VALUES (%s) RETURNING *"
+			c.executemany(sql, [(1,), (2,)])
+			c.execute("ALTER TABLE replan ADD COLUMN j int")
+			con.commit()
+			# The cached plan's result type changed; it is evicted.
+			self.assertRaises(self.driver.Error, c.executemany, sql, [(3,)])
+			con.rollback()
+			self.assertFalse(sql in con._statement_cache)
+			c.executemany(sql, [(4,)])
+			self.assertEqual(c.fetchall(), [(4, None)])
+		finally:
+			con.close()
+
 if __name__ == '__main__':
 	unittest.main()
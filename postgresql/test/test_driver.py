@@ -9,6 +9,7 @@ import time
 import datetime
 import decimal
 import uuid
+from array import array
 from itertools import chain, islice
 from operator import itemgetter
 
@@ -20,6 +21,7 @@ from ..types.io.stdlib_xml_etree import etree
 from .. import exceptions as pg_exc
 from ..types.bitwise import Bit, Varbit
 from ..temporal import pg_tmp
+from ..driver import pq3
 
 type_samples = [
 	('smallint', (
@@ -444,6 +446,27 @@ class test_driver(unittest.TestCase):
 		ps = db.prepare("SELECT 1, 2 UNION ALL SELECT 3, 4")
 		self.assertEqual(ps(), [(1,2),(3,4)])
 
+	@pg_tmp
+	def testStatementCallSpooled(self):
+		ps = db.prepare("SELECT i, i::text, NULL::int FROM generate_series(0, 999) AS g(i)")
+		expect = ps()
+		ps.spool_threshold = 1024
+		r = ps()
+		self.assertTrue(isinstance(r, pq3.SpooledRows))
+		self.assertEqual(len(r), 1000)
+		self.assertEqual(r[0], (0, '0', None))
+		self.assertEqual(r[-1], (999, '999', None))
+		self.assertEqual(r[500]['i'], 500)
+		self.assertEqual(r[10:20], expect[10:20])
+		self.assertEqual(list(r), expect)
+		r.close()
+		self.assertTrue(r.closed)
+		self.assertRaises(RuntimeError, r.__getitem__, 0)
+		self.assertRaises(RuntimeError, list, r)
+		# Below the threshold, it's still a list.
+		ps.spool_threshold = 1024 * 1024
+		self.assertTrue(isinstance(ps(), list))
+
 	@pg_tmp
 	def testStatementFirstDML(self):
 		cmd = prepare("CREATE TEMP TABLE first (i int)").first()
@@ -925,6 +948,65 @@ class test_driver(unittest.TestCase):
 
 		self.assertEqual(c.seek('ALL'), 27)
 
+	@pg_tmp
+	def testCursorWindow(self):
+		# Read-ahead must not change what the user sees.
+		ps = db.prepare("SELECT i FROM generate_series(0, 99) AS g(i)")
+		ref = ps.declare()
+		ref.chunksize = 0
+		c = ps.declare()
+		c.chunksize = 8
+		for x in range(3):
+			self.assertEqual(next(c), next(ref))
+		self.assertEqual(c.read(3), ref.read(3))
+		self.assertEqual(c.read(2, 'BACKWARD'), ref.read(2, 'BACKWARD'))
+		self.assertEqual(c.seek(2, 'FORWARD'), ref.seek(2, 'FORWARD'))
+		self.assertEqual(next(c), next(ref))
+		self.assertEqual(c.seek(-1, 'RELATIVE'), ref.seek(-1, 'RELATIVE'))
+		self.assertEqual(c.read(20), ref.read(20))
+		self.assertEqual(next(c), next(ref))
+		self.assertEqual(c.seek(30, 'FORWARD'), ref.seek(30, 'FORWARD'))
+		self.assertEqual(next(c), next(ref))
+		c.direction = ref.direction = False
+		self.assertEqual(c.read(5), ref.read(5))
+		c.direction = ref.direction = True
+		self.assertEqual(list(c), list(ref))
+		self.assertEqual(c.read(1, 'BACKWARD'), ref.read(1, 'BACKWARD'))
+		self.assertEqual(c.seek(0), ref.seek(0))
+		self.assertEqual(list(c), [(i,) for i in range(100)])
+
+	@pg_tmp
+	def testChunksDriverBlock(self):
+		# A separate connection so hold_cursors and any open transaction
+		# do not leak into the other tests.
+		alt = new()
+		with alt:
+			alt.hold_cursors = False
+			ps = alt.prepare("SELECT i FROM generate_series(1, 10000) AS g(i)")
+			c = ps.chunks()
+			self.assertTrue(isinstance(c, pq3.MultiXactDriverBlock))
+			rows = list(next(c))
+			# The rows are streamed inside the driver's transaction.
+			self.assertEqual(alt.pq.state, b'T')
+			for x in c:
+				rows.extend(x)
+			self.assertEqual(rows, [(i,) for i in range(1, 10001)])
+			self.assertEqual(alt.pq.state, b'I')
+			# Closing early ends the transaction as well.
+			c = ps.chunks()
+			next(c)
+			c.close()
+			self.assertEqual(alt.pq.state, b'I')
+			self.assertEqual(list(ps.column()), list(range(1, 10001)))
+			self.assertEqual(alt.pq.state, b'I')
+			# Inside a transaction block, the rows are streamed in that block.
+			with alt.xact():
+				c = ps.chunks()
+				self.assertTrue(isinstance(c, pq3.MultiXactInsideBlock))
+				self.assertFalse(isinstance(c, pq3.MultiXactDriverBlock))
+			alt.hold_cursors = True
+			self.assertTrue(isinstance(ps.chunks(), pq3.MultiXactOutsideBlock))
+
 	def testScrollBackwards(self):
 		# testScroll again, but backwards this time.
 		self.testScroll(direction = False)
@@ -1027,6 +1109,66 @@ class test_driver(unittest.TestCase):
 		with db.xact():
 			self.load_chunks()
 
+	@pg_tmp
+	def testLoadRowsCopy(self):
+		db.execute("CREATE TEMP TABLE load_copy (i int, t text, n numeric)")
+		rows = [(i, str(i) if i % 7 else None, i) for i in range(1000)]
+		ps = db.prepare("INSERT INTO load_copy VALUES ($1, $2, $3)")
+		ps.load_rows(rows, copy = True)
+		self.assertTrue(ps._copy)
+		self.assertEqual(
+			db.prepare("SELECT * FROM load_copy ORDER BY i")(), rows
+		)
+		db.execute("TRUNCATE load_copy")
+		# Column list.
+		ps = db.prepare("INSERT INTO load_copy (t, i) VALUES ($1, $2)")
+		ps.load_rows([(x[1], x[0]) for x in rows], copy = True)
+		self.assertTrue(ps._copy)
+		self.assertEqual(db.prepare("SELECT count(*) FROM load_copy WHERE n IS NULL").first(), 1000)
+		# Not eligible, but still loaded.
+		ps = db.prepare("INSERT INTO load_copy (i) VALUES ($1::int + 1)")
+		ps.load_rows([(1,), (2,)], copy = True)
+		self.assertFalse(ps._copy)
+		self.assertEqual(db.prepare("SELECT count(*) FROM load_copy").first(), 1002)
+		# Packing errors finish the COPY and raise the original error.
+		ps = db.prepare("INSERT INTO load_copy (i) VALUES ($1)")
+		self.assertRaises(pg_exc.ParameterError, ps.load_rows, [(1,), ('x',)], copy = True)
+		self.assertEqual(db.prepare("SELECT 1").first(), 1)
+
+	@pg_tmp
+	def testLoadColumns(self):
+		db.execute("CREATE TEMP TABLE load_columns (i int, l bigint, f float8, t text)")
+		n = 1000
+		columns = [
+			array('i', range(n)),
+			memoryview(array('q', range(n))),
+			[None if i % 5 == 0 else i / 2 for i in range(n)],
+			[str(i) for i in range(n)],
+		]
+		rows = list(zip(*[list(c) for c in columns]))
+		get = db.prepare("SELECT * FROM load_columns ORDER BY i")
+		ps = db.prepare("INSERT INTO load_columns VALUES ($1, $2, $3, $4)")
+		ps.load_columns(columns, chunksize = 100)
+		self.assertEqual(get(), rows)
+		db.execute("TRUNCATE load_columns")
+		# Mapping of parameter indexes, through COPY.
+		ps.load_columns(dict(enumerate(columns)), copy = True)
+		self.assertEqual(get(), rows)
+		db.execute("TRUNCATE load_columns")
+		# Out of range for int4; the error identifies the parameter.
+		ps = db.prepare("INSERT INTO load_columns (i) VALUES ($1)")
+		try:
+			ps.load_columns([[1, 2, 2**40]])
+			self.fail("load_columns did not raise a parameter error")
+		except pg_exc.ParameterError as err:
+			self.assertEqual(int(err.details['position']), 0)
+		self.assertEqual(db.prepare("SELECT count(*) FROM load_columns").first(), 0)
+		self.assertRaises(ValueError, ps.load_columns, [[1, 2], [3]])
+		self.assertRaises(TypeError, ps.load_columns, [[1], [2]])
+		# Without parameter descriptions, the columns cannot be packed.
+		ps._input = None
+		self.assertRaises(TypeError, ps.load_columns, [[1]])
+
 	@pg_tmp
 	def testSimpleDML(self):
 		db.execute("CREATE TEMP TABLE emp(emp_name text, emp_age int)")
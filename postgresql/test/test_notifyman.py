@@ -133,5 +133,81 @@ class test_notifyman(unittest.TestCase):
 		self.assertEqual(db.closed, True)
 		self.assertEqual(hit, True)
 
+	@pg_tmp
+	def testNoRoundTrip(self):
+		# The notifications are parsed from the socket; no query is sent.
+		alt = new()
+		with alt:
+			alt.listen('foo')
+			def fail(*args):
+				self.fail("query executed to receive notifications")
+			alt.execute = fail
+			nm = NotificationManager(alt, timeout = 5)
+			db.notify(('foo', '1'), ('foo', '2'), ('foo', '3'))
+			received = []
+			for x in nm:
+				self.assertNotEqual(x, None)
+				received.extend(x[1])
+				if len(received) == 3:
+					break
+			self.assertEqual(received, [
+				('foo', x, db.backend_id) for x in ('1', '2', '3')
+			])
+			self.assertEqual(nm.garbage, set())
+			del alt.execute
+			self.assertEqual(alt.prepare('SELECT 1').first(), 1)
+
+	@pg_tmp
+	def testManyConnections(self):
+		listeners = [new() for x in range(32)]
+		try:
+			for x in listeners:
+				x.listen('many')
+			nm = NotificationManager(*listeners, timeout = 5)
+			db.notify('many')
+			remaining = set(listeners)
+			for x in nm:
+				self.assertNotEqual(x, None)
+				ndb, notifies = x
+				self.assertEqual(notifies, [('many', '', db.backend_id)])
+				remaining.remove(ndb)
+				if not remaining:
+					break
+		finally:
+			for x in listeners:
+				x.close()
+
+	@pg_tmp
+	def testQueried(self):
+		# Only the connections that started a query since the last wait are
+		# checked for messages read along with its results.
+		alt = new()
+		with alt:
+			alt.listen('foo')
+			nm = NotificationManager(db, alt, timeout = 5)
+			db.notify('foo')
+			self.assertEqual(next(nm), (alt, [('foo', '', db.backend_id)]))
+			self.assertEqual(nm._queried, set())
+			alt.prepare('SELECT 1').first()
+			self.assertEqual(nm._queried, {alt})
+			# Unwatched connections are forgotten.
+			nm.connections.discard(alt)
+			nm.settimeout(0.1)
+			self.assertEqual(next(nm), None)
+			self.assertNotIn(nm, alt._pq_watchers)
+			self.assertNotIn(alt, nm._queried)
+
+	@pg_tmp
+	def testTerminated(self):
+		# A connection terminated by the server is moved to garbage.
+		alt = new()
+		alt.listen('foo')
+		nm = NotificationManager(alt, timeout = 5)
+		db.prepare("SELECT pg_terminate_backend($1)").first(alt.backend_id)
+		self.assertEqual(list(nm), [])
+		self.assertEqual(nm.garbage, {alt})
+		self.assertEqual(nm.connections, set())
+		alt.close()
+
 if __name__ == '__main__':
 	unittest.main()
@@ -6,6 +6,7 @@ import struct
 import sys
 from ..port import optimized
 from ..python.itertools import interlace
+from .test_copyformat import text_samples, csv_samples
 
 def pack_tuple(*data,
 	packH = struct.Struct("!H").pack,
@@ -243,6 +244,20 @@ class test_optimized(unittest.TestCase):
 		self.assertEqual(optimized.uint8_pack((2**64)-1), b'\xFF\xFF\xFF\xFF'*2)
 		self.assertEqual(optimized.swap_uint8_pack((2**64)-1), b'\xFF\xFF\xFF\xFF'*2)
 
+	def test_text_fields(self):
+		for line, delimiter, null, fields in text_samples:
+			self.assertEqual(optimized.text_fields(line, delimiter, null), fields)
+		self.assertEqual(optimized.text_fields(b'a\tb'), [b'a', b'b'])
+		self.assertRaises(ValueError, optimized.text_fields, b'a', b'')
+		self.assertRaises(TypeError, optimized.text_fields, 'a')
+
+	def test_csv_fields(self):
+		for line, delimiter, quote, null, fields in csv_samples:
+			self.assertEqual(optimized.csv_fields(line, delimiter, quote, null), fields)
+		self.assertEqual(optimized.csv_fields(b'a,"b"'), [b'a', b'b'])
+		self.assertRaises(ValueError, optimized.csv_fields, b'"a')
+		self.assertRaises(ValueError, optimized.csv_fields, b'a', b',', b'""')
+
 if __name__ == '__main__':
 	from types import ModuleType
 	this = ModuleType("this")
@@ -0,0 +1,69 @@
+##
+# .test.test_pg_load - test .bin.pg_load
+##
+import unittest
+from ..temporal import pg_tmp
+from ..bin import pg_load
+
+class BrokenConnector(object):
+	"""
+	Connector whose connections cannot be established.
+	"""
+	closed = True
+
+	def __call__(self):
+		return self
+
+	def connect(self):
+		raise RuntimeError("cannot connect")
+
+	def close(self):
+		pass
+
+def chunks(count, rows):
+	offset = 0
+	for x in range(count):
+		pieces = [
+			(str(x * rows + i) + '\n').encode('ascii') for i in range(rows)
+		]
+		yield offset, pieces
+		offset += sum(map(len, pieces))
+
+class test_pg_load(unittest.TestCase):
+	def testNoConnections(self):
+		# The load stops once no worker is left to take the chunks.
+		progress = pg_load.Progress()
+		pg_load.load(
+			[BrokenConnector(), BrokenConnector()],
+			("COPY t FROM STDIN", None), chunks(1000, 10), progress,
+		)
+		self.assertEqual(progress.chunks, 0)
+		connect_failures = [x for x in progress.failures if not x[0]]
+		self.assertEqual(len(connect_failures), 2)
+		chunk_failures = [x for x in progress.failures if x[0]]
+		self.assertTrue(chunk_failures)
+		self.assertTrue(len(chunk_failures) < 1000)
+
+	@pg_tmp
+	def testFailedConnection(self):
+		# The chunks are loaded by the connection that is left.
+		db.execute("CREATE TABLE pg_load_target (i int)")
+		try:
+			progress = pg_load.Progress()
+			pg_load.load(
+				[BrokenConnector(), db.connector],
+				("COPY pg_load_target FROM STDIN", None), chunks(50, 100), progress,
+			)
+			self.assertEqual(progress.chunks, 50)
+			self.assertEqual(progress.rows, 5000)
+			self.assertEqual(len(progress.failures), 1)
+			self.assertEqual(progress.failures[0][0], [])
+			self.assertEqual(
+				list(prepare("SELECT i FROM pg_load_target ORDER BY i").column()),
+				list(range(5000))
+			)
+		finally:
+			db.execute("DROP TABLE pg_load_target")
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,159 @@
+##
+# .test.test_pool - test .pool
+##
+import unittest
+import threading
+from .. import pool as pg_pool
+from .. import exceptions as pg_exc
+from ..temporal import pg_tmp
+
+class FakePQ(object):
+	state = b'I'
+
+class FakeConnection(object):
+	"""
+	Connection stand-in recording the statements executed.
+	"""
+	def __init__(self):
+		self.closed = True
+		self.pq = FakePQ()
+		self.executed = []
+		self.broken = False
+
+	def connect(self):
+		self.closed = False
+
+	def close(self):
+		self.closed = True
+
+	def execute(self, sql):
+		if self.broken:
+			raise pg_exc.ConnectionFailureError("broken")
+		self.executed.append(sql)
+
+class FakeConnector(object):
+	def __init__(self):
+		self.connections = []
+
+	def __call__(self):
+		c = FakeConnection()
+		self.connections.append(c)
+		return c
+
+class Clock(object):
+	def __init__(self):
+		self.now = 0.0
+	def __call__(self):
+		return self.now
+
+class test_pool(unittest.TestCase):
+	def pool(self, **kw):
+		self.connector = FakeConnector()
+		self.clock = Clock()
+		return pg_pool.Pool(self.connector, clock = self.clock, **kw)
+
+	def testReuse(self):
+		p = self.pool(maxsize = 2)
+		db = p.acquire()
+		p.release(db)
+		self.assertTrue(p.acquire() is db)
+		self.assertEqual(db.executed, ['RESET ALL'])
+		self.assertEqual(len(self.connector.connections), 1)
+
+	def testResetAborts(self):
+		p = self.pool(reset = 'RESET ALL; DISCARD TEMP')
+		db = p.acquire()
+		db.pq.state = b'E'
+		p.release(db)
+		self.assertEqual(db.executed, ['ABORT', 'RESET ALL; DISCARD TEMP'])
+
+	def testTimeout(self):
+		p = self.pool(maxsize = 1)
+		db = p.acquire()
+		self.assertRaises(pg_exc.PoolTimeoutError, p.acquire, timeout = 0)
+		self.assertEqual(p.statistics()['timeouts'], 1)
+		self.assertEqual(p.statistics()['utilization'], 1.0)
+
+	def testBlockingAcquire(self):
+		p = self.pool(maxsize = 1)
+		db = p.acquire()
+		got = []
+		t = threading.Thread(target = lambda: got.append(p.acquire(timeout = 5)))
+		t.start()
+		p.release(db)
+		t.join()
+		self.assertTrue(got[0] is db)
+
+	def testLifetime(self):
+		p = self.pool(max_lifetime = 10)
+		db = p.acquire()
+		p.release(db)
+		self.clock.now = 11
+		db2 = p.acquire()
+		self.assertFalse(db2 is db)
+		self.assertTrue(db.closed)
+
+	def testIdleReaping(self):
+		p = self.pool(minsize = 1, max_idle = 5)
+		a = p.acquire()
+		b = p.acquire()
+		p.release(a)
+		p.release(b)
+		self.clock.now = 6
+		p.reap()
+		self.assertEqual(p.statistics()['size'], 1)
+		self.assertTrue(a.closed)
+		self.assertFalse(b.closed)
+
+	def testLivenessCheck(self):
+		p = self.pool(check_after = 5)
+		db = p.acquire()
+		p.release(db)
+		db.broken = True
+		self.clock.now = 6
+		db2 = p.acquire()
+		self.assertFalse(db2 is db)
+		self.assertTrue(db.closed)
+
+	def testDiscardOnDisconnection(self):
+		p = self.pool()
+		try:
+			with p.connection() as db:
+				raise pg_exc.ConnectionFailureError("lost")
+		except pg_exc.ConnectionFailureError:
+			pass
+		self.assertTrue(db.closed)
+		self.assertEqual(p.statistics()['size'], 0)
+
+	def testFork(self):
+		p = self.pool()
+		db = p.acquire()
+		p.release(db)
+		# Simulate the child process.
+		p._pid = -1
+		db2 = p.acquire()
+		self.assertFalse(db2 is db)
+		# The parent's connection was abandoned, not closed.
+		self.assertFalse(db.closed)
+
+	def testClose(self):
+		p = self.pool()
+		db = p.acquire()
+		p.close()
+		self.assertRaises(pg_exc.OperationError, p.acquire)
+		p.release(db)
+		self.assertTrue(db.closed)
+
+	@pg_tmp
+	def testPool(self):
+		p = pg_pool.Pool(db.connector, maxsize = 2)
+		with p.connection() as c:
+			c.settings['application_name'] = 'pooled'
+			self.assertEqual(c.prepare("SELECT 1").first(), 1)
+		with p.connection() as c2:
+			self.assertTrue(c2 is c)
+			self.assertNotEqual(c2.settings['application_name'], 'pooled')
+		p.close()
+
+if __name__ == '__main__':
+	unittest.main()
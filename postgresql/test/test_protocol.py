@@ -589,6 +589,30 @@ class test_xact3(unittest.TestCase):
 		sys.excepthook = seh
 		self.assertTrue(isinstance(v, Nee))
 
+	def testAsynchronous(self):
+		l = []
+		x = x3.Asynchronous(l.append)
+		a1 = e3.Notice(((b'M', b"m1"),))
+		a2 = e3.Notify(0, b'relation', b'parameter')
+		a3 = e3.ShowOption(b'optname', b'optval')
+		self.assertEqual(x.state[0], x3.Receiving)
+		self.assertEqual(x.state[1](pairs(a1, a2)), 2)
+		self.assertEqual(x.state[1](pairs(a3)), 1)
+		self.assertEqual([a1,a2,a3], l)
+		self.assertEqual(list(x.messages_received()), l)
+		self.assertEqual(x.fatal, None)
+		# the server terminated the session.
+		err = e3.Error(((b'S', b'FATAL'), (b'C', b'57P01'), (b'M', b'terminating')))
+		self.assertEqual(x.state[1](pairs(err, a1)), 1)
+		self.assertEqual(x.state, x3.Complete)
+		self.assertEqual(x.fatal, True)
+		self.assertEqual(x.error_message[b'C'], b'57P01')
+		# anything else is a protocol error.
+		x = x3.Asynchronous()
+		x.state[1](pairs(e3.Ready(b'I')))
+		self.assertEqual(x.fatal, True)
+		self.assertEqual(x.error_message[b'C'], '08P01')
+
 class test_client3(unittest.TestCase):
 	def test_timeout(self):
 		portnum = find_available_port()
@@ -680,6 +704,40 @@ class test_client3(unittest.TestCase):
 			if pc.socket is not None:
 				pc.socket.close()
 
+	def test_drain(self):
+		client, server = socket.socketpair()
+		with client, server:
+			pc = c3.Connection(SocketFactory(None, None), {})
+			pc.socket = client
+			pc.xact = None
+			a1 = e3.Notify(10, b'channel', b'payload')
+			a2 = e3.Notify(11, b'channel', b'')
+			data = e3.cat_messages([a1, a2])
+			# a message split across reads is held until it is complete.
+			server.sendall(data[:-3])
+			x = x3.Asynchronous()
+			pc.drain(x)
+			self.assertEqual(x.messages_received(), [a1])
+			self.assertEqual(x.state, x3.Complete)
+			self.assertEqual(pc.xact, None)
+			self.assertEqual(client.gettimeout(), None)
+			server.sendall(data[-3:])
+			x = x3.Asynchronous()
+			pc.drain(x)
+			self.assertEqual(x.messages_received(), [a2])
+			# nothing to read.
+			x = x3.Asynchronous()
+			pc.drain(x)
+			self.assertEqual(x.messages_received(), [])
+			self.assertEqual(pc.xact, None)
+			# closed by the server.
+			server.close()
+			x = x3.Asynchronous()
+			pc.drain(x)
+			self.assertEqual(x.fatal, True)
+			self.assertEqual(pc.xact, x)
+			self.assertEqual(x.error_message[b'C'], '08006')
+
 if __name__ == '__main__':
 	from types import ModuleType
 	this = ModuleType("this")
@@ -115,6 +115,29 @@ class test_itertools(unittest.TestCase):
 			list(range(100))
 		)
 
+	def testCoalesce(self):
+		lines = [str(i).encode('ascii') + b'\n' for i in range(1000)]
+		chunks = list(itertools.chunk(lines, 7))
+		for size in (1, 10, 100, 1000, 100000):
+			out = list(itertools.coalesce(chunks, size = size))
+			messages = [x for c in out for x in c]
+			self.assertEqual(b''.join(messages), b''.join(lines))
+			self.assertTrue(all(len(x) >= size for x in messages[:-1]))
+		self.assertEqual(list(itertools.coalesce([])), [])
+		self.assertEqual(list(itertools.coalesce([[], [b'']], size = 1)), [])
+		self.assertEqual(list(itertools.coalesce([[b''], [b'a', b'']], size = 0)), [[b'a']])
+
+	def testCoalesceDelay(self):
+		now = [0]
+		def clock():
+			return now[0]
+		def chunks():
+			for x in range(4):
+				yield [b'x']
+				now[0] += 1
+		out = list(itertools.coalesce(chunks(), size = 100, delay = 2, clock = clock))
+		self.assertEqual(out, [[b'xxx'], [b'x']])
+
 class test_functools(unittest.TestCase):
 	def testComposition(self):
 		compose = functools.Composition
@@ -0,0 +1,145 @@
+##
+# .test.test_routing - test .routing
+##
+import unittest
+from .. import routing as pg_routing
+from .. import exceptions as pg_exc
+from ..temporal import pg_tmp
+from .test_pool import FakeConnection, Clock
+
+class FakeSys(object):
+	def __init__(self, server):
+		self.server = server
+
+	def is_in_recovery(self):
+		return self.server.standby
+
+class RoutedConnection(FakeConnection):
+	def __init__(self, server):
+		super().__init__()
+		self.server = server
+		self.sys = FakeSys(server)
+
+class FakeServer(object):
+	"""
+	Connector stand-in for a server that may be a standby or unreachable.
+	"""
+	def __init__(self, name, standby = False):
+		self.name = name
+		self.standby = standby
+		self.down = False
+		self.connections = []
+
+	def __call__(self):
+		if self.down:
+			raise pg_exc.ClientCannotConnectError("could not connect to " + self.name)
+		c = RoutedConnection(self)
+		self.connections.append(c)
+		return c
+
+class test_routing(unittest.TestCase):
+	def router(self, *servers, **kw):
+		self.clock = Clock()
+		return pg_routing.Router(servers, clock = self.clock, check_after = None, **kw)
+
+	def testReadWrite(self):
+		primary = FakeServer('primary')
+		standby = FakeServer('standby', standby = True)
+		r = self.router(standby, primary)
+		db = r.acquire(mode = 'read write')
+		self.assertTrue(db.server is primary)
+		r.release(db)
+		db = r.acquire(mode = 'read only')
+		self.assertTrue(db.server is standby)
+		r.release(db)
+		roles = [x['role'] for x in r.statistics()]
+		self.assertEqual(roles, [pg_routing.STANDBY, pg_routing.PRIMARY])
+
+	def testLeastConnections(self):
+		primary = FakeServer('primary')
+		s1 = FakeServer('s1', standby = True)
+		s2 = FakeServer('s2', standby = True)
+		r = self.router(primary, s1, s2)
+		a = r.acquire(mode = 'read only')
+		b = r.acquire(mode = 'read only')
+		self.assertNotEqual(a.server, b.server)
+		self.assertTrue(a.server.standby and b.server.standby)
+		r.release(a)
+		c = r.acquire(mode = 'read only')
+		self.assertTrue(c.server is a.server)
+
+	def testFallback(self):
+		primary = FakeServer('primary')
+		standby = FakeServer('standby', standby = True)
+		standby.down = True
+		r = self.router(primary, standby)
+		db = r.acquire(mode = 'read only')
+		self.assertTrue(db.server is primary)
+		r.release(db)
+
+		r = self.router(primary, standby, fallback = False)
+		self.assertRaises(pg_exc.ClientCannotConnectError, r.acquire, mode = 'read only')
+
+	def testUnavailable(self):
+		standby = FakeServer('standby', standby = True)
+		r = self.router(standby)
+		self.assertRaises(pg_exc.ClientCannotConnectError, r.acquire, mode = 'read write')
+		# Without a mode, any server is used.
+		db = r.acquire()
+		self.assertTrue(db.server is standby)
+
+	def testRoleTTL(self):
+		primary = FakeServer('primary')
+		other = FakeServer('other', standby = True)
+		r = self.router(primary, other, role_ttl = 10)
+		r.release(r.acquire(mode = 'read only'))
+		# Promotion is noticed once the cached role expires.
+		primary.standby = True
+		other.standby = False
+		db = r.acquire(mode = 'read write')
+		self.assertTrue(db.server is primary)
+		r.release(db)
+		self.clock.now += 10
+		db = r.acquire(mode = 'read write')
+		self.assertTrue(db.server is other)
+		r.release(db)
+
+	def testReadOnlyErrorInvalidates(self):
+		primary = FakeServer('primary')
+		r = self.router(primary)
+		def fail():
+			with r.connection(mode = 'read write') as db:
+				raise pg_exc.ReadOnlyTransactionError("read-only")
+		self.assertRaises(pg_exc.ReadOnlyTransactionError, fail)
+		self.assertEqual(r.statistics()[0]['role'], None)
+		self.assertEqual(r.statistics()[0]['idle'], 1)
+
+	def testUnreachableSkipped(self):
+		primary = FakeServer('primary')
+		primary.down = True
+		r = self.router(primary, role_ttl = 10)
+		self.assertRaises(pg_exc.ClientCannotConnectError, r.acquire)
+		primary.down = False
+		self.assertRaises(pg_exc.ClientCannotConnectError, r.acquire)
+		self.clock.now += 10
+		r.release(r.acquire())
+
+	def testClose(self):
+		primary = FakeServer('primary')
+		with self.router(primary) as r:
+			r.release(r.acquire())
+		self.assertTrue(primary.connections[0].closed)
+
+	@pg_tmp
+	def testRouter(self):
+		r = pg_routing.Router([db.connector, db.connector], maxsize = 1)
+		with r:
+			with r.xact(mode = 'read only') as x:
+				self.assertEqual(x.prepare("SELECT 1").first(), 1)
+			self.assertEqual(
+				[s['role'] for s in r.statistics()],
+				[pg_routing.PRIMARY, pg_routing.PRIMARY]
+			)
+
+if __name__ == '__main__':
+	unittest.main()
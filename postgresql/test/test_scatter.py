@@ -0,0 +1,228 @@
+##
+# .test.test_scatter - test .scatter
+##
+import time
+import unittest
+import threading
+from operator import itemgetter
+from .. import scatter as pg_scatter
+from ..temporal import pg_tmp
+
+class FakeChunks(object):
+	_output_io = None
+
+	def __init__(self, chunks, fail = None):
+		self.chunks = iter(chunks)
+		self.fail = fail
+		self.closed = False
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		x = next(self.chunks, None)
+		if x is None:
+			if self.fail is not None:
+				raise self.fail
+			raise StopIteration
+		return x
+
+	def close(self):
+		self.closed = True
+
+class FakeStatement(object):
+	column_names = ('id', 'shard')
+
+	def __init__(self, db):
+		self.db = db
+		self.cursors = []
+
+	def chunks(self):
+		c = FakeChunks(self.db.chunks, fail = self.db.fail)
+		self.cursors.append(c)
+		return c
+
+	def __call__(self):
+		return [x for c in self.db.chunks for x in c]
+
+	def first(self):
+		return self.db.chunks[0][0][0]
+
+	def close(self):
+		pass
+
+class FakeConnection(object):
+	def __init__(self, chunks, fail = None):
+		self.chunks = chunks
+		self.fail = fail
+		self.statements = []
+
+	def prepare(self, sql):
+		ps = FakeStatement(self)
+		self.statements.append(ps)
+		return ps
+
+class MapStatement(object):
+	def __init__(self, db):
+		self.db = db
+
+	def __call__(self, x):
+		self.db.executed += 1
+		if x < 0:
+			raise ValueError("negative")
+		# Let the other connections take work.
+		time.sleep(0.0001 * (x % 3))
+		return [(x * 2,)]
+
+	def first(self, x):
+		return self(x)[0][0]
+
+class MapConnection(object):
+	def __init__(self, connector):
+		self.connector = connector
+		self.executed = 0
+		self.closed = True
+
+	def connect(self):
+		self.closed = False
+
+	def prepare(self, sql):
+		self.connector.prepared.append(sql)
+		return MapStatement(self)
+
+	def close(self):
+		self.closed = True
+
+class MapConnector(object):
+	def __init__(self):
+		self.connections = []
+		self.prepared = []
+		self.lock = threading.Lock()
+
+	def __call__(self):
+		with self.lock:
+			c = MapConnection(self)
+			self.connections.append(c)
+			return c
+
+def shard(n, ids):
+	return FakeConnection([[(i, n) for i in ids[x:x+2]] for x in range(0, len(ids), 2)])
+
+class test_scatter(unittest.TestCase):
+	def testMerge(self):
+		m = pg_scatter.merge
+		self.assertEqual(list(m([[1, 4, 7], [2, 5], [], [3, 6, 8, 9]])), list(range(1, 10)))
+		self.assertEqual(list(m([[7, 4, 1], [5, 2]], reverse = True)), [7, 5, 4, 2, 1])
+		# Stable on equal keys.
+		self.assertEqual(
+			list(m([[(1, 'a'), (2, 'a')], [(1, 'b')]], key = itemgetter(0))),
+			[(1, 'a'), (1, 'b'), (2, 'a')]
+		)
+		self.assertEqual(list(m([])), [])
+
+	def testMap(self):
+		dbs = [shard(i, [i]) for i in range(4)]
+		with pg_scatter.Scatter(dbs) as s:
+			ps = s.prepare("SELECT")
+			self.assertEqual(ps.first(), [0, 1, 2, 3])
+			self.assertEqual(ps(), [[(i, i)] for i in range(4)])
+
+	def testUnordered(self):
+		dbs = [shard(0, [1, 3, 5]), shard(1, [2, 4]), shard(2, [])]
+		s = pg_scatter.Scatter(dbs, queue_size = 1)
+		ps = s.prepare("SELECT")
+		self.assertEqual(sorted(ps.rows()), sorted([(1, 0), (3, 0), (5, 0), (2, 1), (4, 1)]))
+		self.assertEqual(sum(map(len, ps.chunks())), 5)
+		s.close()
+
+	def testOrdered(self):
+		dbs = [shard(0, [1, 3, 5, 7, 9]), shard(1, [2, 4]), shard(2, [6, 8, 10])]
+		s = pg_scatter.Scatter(dbs, queue_size = 1)
+		ps = s.prepare("SELECT")
+		self.assertEqual([x[0] for x in ps.rows(key = 'id')], list(range(1, 11)))
+		self.assertEqual([x[0] for x in ps.rows(key = itemgetter(0))], list(range(1, 11)))
+		s.close()
+
+	def testEarlyClose(self):
+		dbs = [shard(0, list(range(0, 100, 2))), shard(1, list(range(1, 100, 2)))]
+		s = pg_scatter.Scatter(dbs, queue_size = 1)
+		ps = s.prepare("SELECT")
+		for key in (None, 'id'):
+			rows = ps.rows(key = key)
+			next(rows)
+			rows.close()
+		for db in dbs:
+			self.assertTrue(all(c.closed for c in db.statements[0].cursors))
+		s.close()
+
+	def testError(self):
+		dbs = [shard(0, [1, 2, 3]), shard(1, [4])]
+		dbs[1].fail = ValueError("shard failed")
+		s = pg_scatter.Scatter(dbs, queue_size = 1)
+		ps = s.prepare("SELECT")
+		self.assertRaises(ValueError, list, ps.rows())
+		self.assertRaises(ValueError, list, ps.rows(key = 'id'))
+		s.close()
+
+	def testParallelMapOrdered(self):
+		c = MapConnector()
+		params = [(x,) for x in range(1000)]
+		r = list(pg_scatter.parallel_map(c, "SELECT", params, workers = 4, batchsize = 7))
+		self.assertEqual(r, [[(x * 2,)] for x in range(1000)])
+		self.assertEqual(c.prepared, ["SELECT"] * 4)
+		self.assertEqual(sum(x.executed for x in c.connections), 1000)
+		self.assertTrue(all(x.closed for x in c.connections))
+
+	def testParallelMapCompletion(self):
+		c = MapConnector()
+		params = [(x,) for x in range(500)]
+		r = list(pg_scatter.parallel_map(
+			c, "SELECT", params, workers = 3, batchsize = 5, ordered = False, first = True
+		))
+		self.assertEqual(sorted(r), [((x,), x * 2) for x in range(500)])
+
+	def testParallelMapBackpressure(self):
+		c = MapConnector()
+		read = []
+		def params():
+			for x in range(10000):
+				read.append(x)
+				yield (x,)
+		r = pg_scatter.parallel_map(c, "SELECT", params(), workers = 2, batchsize = 10, backlog = 2)
+		next(r)
+		# At most workers * backlog batches are read ahead.
+		self.assertTrue(len(read) <= 2 * 2 * 10 + 10)
+		r.close()
+		self.assertTrue(all(x.closed for x in c.connections))
+
+	def testParallelMapError(self):
+		c = MapConnector()
+		params = [(x,) for x in range(100)] + [(-1,)]
+		self.assertRaises(
+			ValueError, list, pg_scatter.parallel_map(c, "SELECT", params, workers = 2)
+		)
+		self.assertTrue(all(x.closed for x in c.connections))
+
+	@pg_tmp
+	def testParallelMap(self):
+		r = list(pg_scatter.parallel_map(
+			db.connector, "SELECT $1::int * 2", ((x,) for x in range(100)),
+			workers = 3, batchsize = 8, first = True
+		))
+		self.assertEqual(r, [x * 2 for x in range(100)])
+
+	@pg_tmp
+	def testScatter(self):
+		with pg_scatter.Scatter([db.connector] * 3) as s:
+			self.assertEqual(len(s.connections), 3)
+			ps = s.prepare(
+				"SELECT i FROM generate_series($1::int, 30, 3) AS g(i) ORDER BY i"
+			)
+			self.assertEqual(ps.first(1), [1, 1, 1])
+			rows = list(ps.rows(1, key = 'i'))
+			self.assertEqual([x['i'] for x in rows], sorted([x for x in range(1, 31, 3)] * 3))
+			self.assertEqual(len(list(ps.rows(1))), 30)
+		self.assertTrue(all(x.closed for x in s.connections))
+
+if __name__ == '__main__':
+	unittest.main()
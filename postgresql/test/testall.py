@@ -34,6 +34,11 @@ from .test_driver import *
 from .test_alock import *
 from .test_notifyman import *
 from .test_copyman import *
+from .test_copyformat import *
+from .test_pool import *
+from .test_routing import *
+from .test_scatter import *
+from .test_pg_load import *
 from .test_lib import *
 from .test_dbapi20 import *
 from .test_types import *